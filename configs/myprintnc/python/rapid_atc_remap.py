@@ -0,0 +1,483 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    M6 as a Python remap, the same sequence as tool_change.ngc / _drop_tool.ngc /
+    _pickup_tool.ngc / _dust_cover_op.ngc / _auto_probe_tool.ngc but run as a state machine.
+    The rapid_atc pins are read once per change, the G-code is emitted one finished block at a
+    time with self.execute() and the interpreter is only synced (yield INTERP_EXECUTE_FINISH)
+    where a sensor or probe result decides what happens next.
+
+    To use it instead of the NGC remap, swap the REMAP lines in the INI:
+
+        [RS274NGC]
+        #REMAP=M6  modalgroup=6 prolog=change_prolog ngc=tool_change epilog=change_epilog
+        REMAP=M6  modalgroup=6 python=rapid_tool_change
+
+    [PYTHON] TOPLEVEL (toplevel.py -> remap.py) provides both, so switching back to the
+    NGC remap is only a matter of swapping the lines again.
+'''
+
+import os
+import sys
+from os import path
+
+import emccanon
+import hal
+import linuxcnc
+from interpreter import INTERP_OK, INTERP_ERROR, INTERP_EXECUTE_FINISH, InterpreterException
+
+# share the pin names and the pocket positions with the QtVCP handler
+QTVCP_DIR = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'qtvcp')
+if QTVCP_DIR not in sys.path:
+    sys.path.append(QTVCP_DIR)
+
+from atc_params import AtcHalPin
+from atc_planner import RackGeometry
+from atc_rack import RACK_OK, MESSAGES as RACK_MESSAGES
+
+COMP = 'rapid_atc'
+HANDLER_WAITS = 40 # 50 ms each, for the answer to a rack or probe check
+DROP, PICKUP, PROBE = 1, 2, 3
+# phase steps, see ToolChangeProfiler
+SAFE_Z, XY_MOVE, COVER_OPEN, SPINDLE_SPINUP, ENGAGE, IR_CHECK, PROBE_MOVE, RETRACT, CACHED = 1, 2, 3, 4, 5, 6, 7, 8, 9
+
+class ToolChangeError(Exception):
+    pass
+
+class RackConfig():
+    '''
+        The rapid_atc pins of one change, each pin is read from HAL at most once
+    '''
+    def __init__(self, get=hal.get_value, comp:str = COMP) -> None:
+        self.get = get
+        self.comp = comp
+        self.values = {}
+
+    def __getitem__(self, pin:AtcHalPin):
+        try:
+            return self.values[pin]
+        except KeyError:
+            value = self.values[pin] = self.get(f'{self.comp}.{pin}')
+            return value
+
+    def forget(self, *pins):
+        '''
+            Read pins from HAL again on their next use
+        '''
+        for pin in pins:
+            self.values.pop(pin, None)
+
+    def geometry(self) -> RackGeometry:
+        return RackGeometry(num_pockets=self[AtcHalPin.NUM_POCKETS],
+                            first_pocket_x=self[AtcHalPin.FIRST_POCKET_X],
+                            first_pocket_y=self[AtcHalPin.FIRST_POCKET_Y],
+                            pocket_offset=self[AtcHalPin.POCKET_OFFSET],
+                            align_axis=self[AtcHalPin.ALIGN_AXIS],
+                            safe_z=self[AtcHalPin.SAFE_Z],
+                            z_ir_engage=self[AtcHalPin.Z_IR_ENGAGE],
+                            engage_z=self[AtcHalPin.ENGAGE_Z])
+
+'''
+    ToolChange is one M6. run() is a generator of states: each state emits its blocks and
+    yields when it needs the interpreter synced before it can read a result (#5399, #5070).
+    rapid_tool_change() turns those yields into INTERP_EXECUTE_FINISH.
+'''
+class ToolChange():
+    SYNC = 'sync'
+
+    def __init__(self, interp, ini, tool:int) -> None:
+        self.interp = interp
+        self.ini = ini
+        self.tool = tool
+        self.cfg = None
+        self.rack = None
+        self.lines = 0
+        self.syncs = 0
+
+    def emit(self, block:str):
+        self.lines += 1
+        self.interp.execute(block)
+
+    def phase(self, op:int, step:int):
+        self.emit(f'M67 E0 Q{op * 10 + step}')
+
+    def param(self, key) -> float:
+        return self.interp.params[key]
+
+    def run(self):
+        # like M66 E0 in tool_change.ngc, the handler's pins are current once the queue is empty
+        self.syncs += 1
+        yield self.SYNC
+        cfg = self.cfg = RackConfig()
+        self.rack = cfg.geometry()
+        current_pocket = int(cfg[AtcHalPin.CURRENT_TOOL_POCKET])
+        new_pocket = int(hal.get_value('iocontrol.0.tool-prep-pocket'))
+        print(f'current pocket = {current_pocket}, new_pocket = {new_pocket}')
+        self.emit('G61 G90 G40 G49')
+        if current_pocket == new_pocket:
+            print('Current pocket is equal to the new pocket, measuring tool then returning..')
+            yield from self.measure()
+            return
+        # checked before the drop, unlike tool_change.ngc, so a bad pocket leaves the tool in the spindle
+        if not self.rack.in_rack(new_pocket):
+            raise ToolChangeError(f'Pocket number invalid, expected a value between 1 and '
+                                  f'{self.rack.num_pockets}, got {new_pocket}')
+        # the handler's pocket occupancy check of the prepared change, see updateRackCheck
+        code = yield from self.rackCheck()
+        if code != RACK_OK:
+            raise ToolChangeError(f'T{self.interp.current_tool} -> T{self.tool}: {RACK_MESSAGES[code]}')
+        direct = bool(cfg[AtcHalPin.PLAN_DIRECT]) and \
+            int(cfg[AtcHalPin.PLAN_FROM_POCKET]) == current_pocket and \
+            int(cfg[AtcHalPin.PLAN_TO_POCKET]) == new_pocket
+        if direct:
+            print(f'Planned direct traverse from pocket {current_pocket} to pocket {new_pocket}')
+        # the drop leaves the spindle at safe Z with the cover open for the pickup
+        staged = bool(cfg[AtcHalPin.PRESTAGE]) and not direct and current_pocket != 0
+        if staged:
+            print(f'Pre-staging pocket {new_pocket}, the cover stays open between drop and pickup')
+        if current_pocket != 0:
+            yield from self.drop(current_pocket, direct, staged)
+        if direct:
+            self.phase(PICKUP, XY_MOVE)
+            self.emit(f'G53 G0 Z{cfg[AtcHalPin.PLAN_TRAVERSE_Z]:.4f}')
+            self.emit(f'G53 G0 X{cfg[AtcHalPin.PLAN_X]:.4f} Y{cfg[AtcHalPin.PLAN_Y]:.4f}')
+        yield from self.pickup(new_pocket, direct, staged)
+        yield from self.measure()
+        self.emit('M67 E0 Q0')
+
+    def ask(self, output:int, ack:AtcHalPin):
+        '''
+            Set a new request number on motion.analog-out-<output> and wait for the handler to echo
+            it on ack, like tool_change.ngc and _auto_probe_tool.ngc. True once it did.
+        '''
+        get = lambda: hal.get_value(f'{COMP}.{ack}')
+        request = get() + 1
+        self.emit(f'M68 E{output} Q{request}')
+        for _ in range(HANDLER_WAITS):
+            self.emit('G4 P0.05')
+            self.syncs += 1
+            yield self.SYNC
+            if get() == request:
+                return True
+        return False
+
+    def rackCheck(self):
+        '''
+            The handler's answer to the rack check of this change, see updateRackCheck
+        '''
+        if not (yield from self.ask(2, AtcHalPin.RACK_CHECK_ACK)):
+            raise ToolChangeError('No answer from the rack occupancy check, is the rapid_atc GUI running?')
+        return int(hal.get_value(f'{COMP}.{AtcHalPin.RACK_CHECK}'))
+
+    def drop(self, pocket:int, direct:bool, staged:bool = False):
+        cfg = self.cfg
+        if self.interp.current_tool == 0:
+            raise ToolChangeError('Drop tool: no tool is currently loaded')
+        print(f'Dropping tool {self.interp.current_tool} into pocket {pocket}')
+        self.emit(f'M67 E1 Q{pocket}')
+        lead = self.moveToPocket(DROP, pocket)
+        yield from self.openCover(DROP, lead)
+        yield from self.engageHeight(DROP, expect_empty=False)
+        yield from self.engage(DROP)
+        self.emit('M61 Q0')
+        if direct:
+            return
+        self.phase(DROP, RETRACT)
+        self.emit(f'G53 G0 Z{cfg[AtcHalPin.SAFE_Z]:.4f}')
+        if not staged:
+            yield from self.cover(False)
+
+    def pickup(self, pocket:int, direct:bool, staged:bool = False):
+        if self.interp.current_tool != 0:
+            raise ToolChangeError('Pickup tool: a tool is already loaded')
+        print(f'Picking up tool {self.tool} from pocket {pocket}')
+        self.emit(f'M67 E1 Q{pocket}')
+        if staged:
+            # already at safe Z with the cover open
+            self.moveToPocket(PICKUP, pocket, safe_z=False)
+        elif not direct:
+            lead = self.moveToPocket(PICKUP, pocket)
+            yield from self.openCover(PICKUP, lead)
+        yield from self.engageHeight(PICKUP, expect_empty=True)
+        yield from self.engage(PICKUP)
+        self.emit(f'M61 Q{self.tool}')
+        self.phase(PICKUP, RETRACT)
+        self.emit(f'G53 G0 Z{self.cfg[AtcHalPin.SAFE_Z]:.4f}')
+        yield from self.cover(False)
+
+    def moveToPocket(self, op:int, pocket:int, safe_z:bool = True) -> float:
+        '''
+            Traverse to the pocket at safe Z, returns the lead the cover got from _prestage_cover
+        '''
+        x, y = self.rack.pocket_xy(pocket)
+        if safe_z:
+            self.phase(op, SAFE_Z)
+            self.emit(f'G53 G0 Z{self.rack.safe_z:.4f}')
+        self.phase(op, XY_MOVE)
+        lead = self.prestageCover(x, y) if safe_z else 0.0
+        self.emit(f'G53 G0 X{x:.4f} Y{y:.4f}')
+        return lead
+
+    def prestageCover(self, x:float, y:float) -> float:
+        '''
+            _prestage_cover.ngc, open the cover with the start of the traverse to x, y and return
+            a lower bound of the traverse time
+        '''
+        cfg = self.cfg
+        if not cfg[AtcHalPin.PRESTAGE] or not cfg[AtcHalPin.COVER_ENABLED]:
+            return 0.0
+        lead = max(abs(x - self.param('_abs_x')) / float(self.ini.find('AXIS_X', 'MAX_VELOCITY')),
+                   abs(y - self.param('_abs_y')) / float(self.ini.find('AXIS_Y', 'MAX_VELOCITY')))
+        self.emit(f'M64 P{int(cfg[AtcHalPin.COVER_HAL_DPIN])}')
+        return lead
+
+    def openCover(self, op:int, lead:float = 0.0):
+        self.phase(op, COVER_OPEN)
+        yield from self.cover(True, lead)
+        self.emit(f'G4 P{self.cfg[AtcHalPin.COVER_SETTLE]:.3f}')
+
+    def engageHeight(self, op:int, expect_empty:bool):
+        cfg = self.cfg
+        self.phase(op, ENGAGE)
+        self.emit(f'G53 G0 Z{self.rack.z_ir_engage:.4f}')
+        if not cfg[AtcHalPin.IR_ENABLED]:
+            return
+        self.emit(f'M66 P{int(cfg[AtcHalPin.IR_HAL_DPIN])} L0')
+        self.syncs += 1
+        yield self.SYNC
+        # the IR input is 1 when the spindle is empty
+        empty = self.param(5399) == 1
+        if empty and not expect_empty:
+            raise ToolChangeError('No tool detected in spindle')
+        if not empty and expect_empty:
+            raise ToolChangeError('Timeout! Tool still in spindle')
+
+    def engage(self, op:int):
+        '''
+            Spin up, plunge to the engage height and back, check the IR sensor, retry on a miss
+        '''
+        cfg = self.cfg
+        event_waits = bool(cfg[AtcHalPin.EVENT_WAITS])
+        ir_enabled = bool(cfg[AtcHalPin.IR_ENABLED])
+        ir_pin = int(cfg[AtcHalPin.IR_HAL_DPIN])
+        timeout = cfg[AtcHalPin.SENSOR_TIMEOUT]
+        if op == DROP:
+            spindle, speed, rate, wait, expected = 'M4', AtcHalPin.SPINDLE_SPEED_DROP, AtcHalPin.DROP_RATE, 3, 1
+        else:
+            spindle, speed, rate, wait, expected = 'M3', AtcHalPin.SPINDLE_SPEED_PICKUP, AtcHalPin.PICKUP_RATE, 4, 0
+        for attempt in range(int(cfg[AtcHalPin.ENGAGE_RETRIES])):
+            self.phase(op, SPINDLE_SPINUP)
+            self.emit(f'{spindle} S{cfg[speed]:.1f}')
+            if event_waits:
+                # the result is not needed, no sync
+                self.emit(f'M66 P{int(cfg[AtcHalPin.AT_SPEED_DPIN])} L1 Q{timeout:.3f}')
+            else:
+                self.emit(f'G4 P{cfg[AtcHalPin.SPINUP_DWELL]:.3f}')
+            self.phase(op, ENGAGE)
+            self.emit(f'G53 G1 Z{self.rack.engage_z:.4f} F{cfg[rate]:.1f}')
+            self.emit(f'G53 G0 Z{self.rack.z_ir_engage:.4f}')
+            self.phase(op, IR_CHECK)
+            self.emit('M5')
+            if not ir_enabled:
+                return
+            if event_waits:
+                self.emit(f'M66 P{ir_pin} L{wait} Q{timeout:.3f}')
+            else:
+                self.emit(f'G4 P{cfg[AtcHalPin.SPINDLE_STOP_DWELL]:.3f}')
+                if op == PICKUP:
+                    self.emit(f'G53 G0 Z{self.rack.z_ir_engage:.4f}')
+                    self.emit(f'G4 P{cfg[AtcHalPin.IR_SETTLE_DWELL]:.3f}')
+                self.emit(f'M66 P{ir_pin} L0')
+            self.syncs += 1
+            yield self.SYNC
+            if self.param(5399) == expected:
+                return
+            print(f'Timeout! Tool still in spindle! Retry Count = {attempt}')
+        raise ToolChangeError('Timeout! Tool still in spindle')
+
+    def cover(self, open:bool, lead:float = 0.0):
+        cfg = self.cfg
+        if not cfg[AtcHalPin.COVER_ENABLED]:
+            return
+        self.emit(f'{"M64" if open else "M65"} P{int(cfg[AtcHalPin.COVER_HAL_DPIN])}')
+        sensor = int(cfg[AtcHalPin.COVER_OPEN_DPIN])
+        if cfg[AtcHalPin.EVENT_WAITS] and sensor >= 0:
+            self.emit(f'M66 P{sensor} L{3 if open else 4} Q{cfg[AtcHalPin.SENSOR_TIMEOUT]:.3f}')
+            if not open:
+                return # _drop_tool.ngc / _pickup_tool.ngc ignore a cover that does not close
+            self.syncs += 1
+            yield self.SYNC
+            if self.param(5399) == -1:
+                raise ToolChangeError('Dust cover did not open!')
+        elif cfg[AtcHalPin.COVER_DWELL] > lead:
+            self.emit(f'G4 P{cfg[AtcHalPin.COVER_DWELL] - lead:.3f}')
+
+    def measure(self):
+        '''
+            _auto_probe_tool.ngc, measure the new tool on the toolsetter and apply its offset
+        '''
+        ini = self.ini
+        probe = lambda name: hal.get_value(f'qtversaprobe.{name}')
+        metric = bool(self.param('_metric_machine'))
+        if metric and self.param('_imperial'):
+            raise ToolChangeError('Auto Tool probe error: not in G21 mode')
+        if not metric and not self.param('_imperial'):
+            raise ToolChangeError('Auto Tool probe error: not in G20 mode')
+        # the probe_cached and probe_prior pins are only used once the handler answered for this change,
+        # without an answer the tool is probed with the full search
+        answered = yield from self.ask(3, AtcHalPin.PROBE_CHECK_ACK)
+        if not answered:
+            print(f'No answer from the probe check, probing tool {self.tool}')
+        self.cfg.forget(AtcHalPin.PROBE_CACHED, AtcHalPin.PROBE_CACHED_TOOL, AtcHalPin.PROBE_PRIOR_TOOL,
+                        AtcHalPin.PROBE_PRIOR_LENGTH, AtcHalPin.PROBE_PRIOR_Z_OFFSET)
+        # the handler publishes whether the prepared tool's length in the tool table can be trusted
+        cached = answered and bool(self.cfg[AtcHalPin.PROBE_CACHED]) \
+            and int(self.cfg[AtcHalPin.PROBE_CACHED_TOOL]) == self.tool
+        change_z = float(ini.find('CHANGE_POSITION', 'Z'))
+        self.phase(PROBE, CACHED if cached else SAFE_Z)
+        self.emit(f'G53 G0 Z{change_z:.4f}')
+        if self.interp.current_tool != self.tool:
+            self.emit(f'G53 G0 X{float(ini.find("CHANGE_POSITION", "X")):.4f} '
+                      f'Y{float(ini.find("CHANGE_POSITION", "Y")):.4f}')
+        self.emit('G49')
+        if cached:
+            print(f'Tool {self.tool} length is cached, skipping the probe')
+            self.emit('G43')
+            return
+        if not probe('enable'):
+            emccanon.MESSAGE('Auto Tool probe disabled')
+            self.emit('G43')
+            return
+        search, slow, backoff = probe('searchvel'), probe('probevel'), probe('backoffdist')
+        if search <= 0:
+            raise ToolChangeError('Probe search velocity must be greater than 0')
+        if slow <= 0:
+            raise ToolChangeError('Probe velocity must be greater than 0')
+        setter_z = float(ini.find('VERSA_TOOLSETTER', 'Z'))
+        max_probe = float(ini.find('VERSA_TOOLSETTER', 'MAXPROBE'))
+        approach = self.probeApproach(setter_z, max_probe) if answered else None
+        self.phase(PROBE, XY_MOVE)
+        self.emit(f'G53 G0 X{float(ini.find("VERSA_TOOLSETTER", "X")):.4f} '
+                  f'Y{float(ini.find("VERSA_TOOLSETTER", "Y")):.4f}')
+        self.emit(f'G53 G0 Z{setter_z if approach is None else approach:.4f}')
+        self.phase(PROBE, PROBE_MOVE)
+        self.emit(f'G91 F{search:.3f}')
+        if approach is not None:
+            self.emit(f'G38.3 Z-{self.cfg[AtcHalPin.PROBE_WINDOW] * 2:.4f}')
+            self.syncs += 1
+            yield self.SYNC
+            if self.param(5070) == 0:
+                print('No contact within the probe window, falling back to the full search')
+                self.emit('G90')
+                self.emit(f'G53 G0 Z{setter_z:.4f}')
+                self.emit('G91')
+                approach = None
+        if approach is None:
+            self.emit(f'G38.2 Z-{max_probe:.4f}')
+        self.emit(f'G0 Z{backoff:.4f}')
+        self.emit(f'F{slow:.3f}')
+        self.emit(f'G38.2 Z-{backoff * 1.2:.4f}')
+        self.emit('G90')
+        self.syncs += 1
+        yield self.SYNC
+        if self.param(5070) == 0:
+            raise ToolChangeError('Probe contact failure')
+        self.phase(PROBE, RETRACT)
+        self.emit(f'G53 G0 Z{change_z:.4f}')
+        length = self.param(5063) - probe('probeheight') + probe('blockheight')
+        self.emit(f'G10 L1 P{self.tool} Z{length:.4f}')
+        self.emit('G43')
+
+    def workZOffset(self) -> float:
+        '''
+            The active G5x + G92 Z offset, #5063 and so the measured lengths are relative to it
+        '''
+        return self.param(5203 + 20 * int(self.param(5220))) + self.param(5213) * self.param(5210)
+
+    def probeApproach(self, setter_z:float, max_probe:float):
+        '''
+            Machine Z probe_window above where the tool's previous length touches the setter,
+            None when there is no previous length, it was measured at another work Z offset
+            or the window is off
+        '''
+        cfg = self.cfg
+        window = cfg[AtcHalPin.PROBE_WINDOW]
+        if window <= 0 or int(cfg[AtcHalPin.PROBE_PRIOR_TOOL]) != self.tool:
+            return None
+        work_z = self.workZOffset()
+        if abs(cfg[AtcHalPin.PROBE_PRIOR_Z_OFFSET] - work_z) >= 1e-4:
+            return None
+        probe = lambda name: hal.get_value(f'qtversaprobe.{name}')
+        approach = cfg[AtcHalPin.PROBE_PRIOR_LENGTH] + probe('probeheight') - probe('blockheight') + window + work_z
+        if not setter_z - max_probe < approach < setter_z:
+            return None
+        return approach
+
+# totals over the session, for comparing with the NGC remap
+STATS = {'changes': 0, 'lines': 0, 'syncs': 0}
+
+def commit_tool_change(interp):
+    '''
+        What stdglue's change_epilog does after the NGC remap returns
+    '''
+    emccanon.CHANGE_TOOL(interp.selected_pocket)
+    interp.current_pocket = interp.selected_pocket
+    interp.selected_pocket = -1
+    interp.selected_tool = -1
+    interp.set_tool_parameters()
+    interp.toolchange_flag = True
+
+def rapid_tool_change(self, **words):
+    '''
+        REMAP=M6 modalgroup=6 python=rapid_tool_change
+    '''
+    if self.selected_pocket < 0:
+        self.set_errormsg('M6: no tool prepared')
+        yield INTERP_ERROR
+        return
+    if self.cutter_comp_side:
+        self.set_errormsg('Cannot change tools with cutter radius compensation on')
+        yield INTERP_ERROR
+        return
+    if self.task == 0:
+        # preview interpreter, nothing to move but the preview needs the new tool for its G43s
+        commit_tool_change(self)
+        yield INTERP_EXECUTE_FINISH
+        return INTERP_OK
+    change = ToolChange(self, linuxcnc.ini(os.environ.get('INI_FILE_NAME', '')), int(self.selected_tool))
+    try:
+        for _ in change.run():
+            yield INTERP_EXECUTE_FINISH
+    except (ToolChangeError, InterpreterException) as e:
+        message = getattr(e, 'error_message', None) or str(e)
+        self.set_errormsg(f'M6 aborted: {message}')
+        yield INTERP_ERROR
+        return
+    finally:
+        STATS['changes'] += 1
+        STATS['lines'] += change.lines
+        STATS['syncs'] += change.syncs
+    commit_tool_change(self)
+    yield INTERP_EXECUTE_FINISH
+    return INTERP_OK
@@ -0,0 +1,279 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Batch ATC operations planned as one sequence of MDI steps: verify every pocket (pick the
+    tool up so the IR sensor sees it, put it back), measure every rack tool and cycle through a
+    list of tools. The pockets are visited in one sweep along the rack, and the moves between
+    two pockets keep the cover open and use the direct traverse when the planner allows it.
+'''
+
+import time
+
+from atc_planner import ToolChangePlanner
+
+VERIFY = 'verify'
+MEASURE = 'measure'
+CYCLE = 'cycle'
+OPERATIONS = (VERIFY, MEASURE, CYCLE)
+
+'''
+    One MDI command of a batch. target is set on the steps that do the batch's work on one of
+    its tools (the pickup of a verify, the change of a measure or cycle), progress counts them.
+'''
+class BatchStep():
+    DROP = 'drop'
+    PICKUP = 'pickup'
+    TRAVERSE = 'traverse'
+    CHANGE = 'change'
+
+    def __init__(self, kind:str, gcode:str, tool:int = 0, pocket:int = 0, target:bool = False) -> None:
+        self.kind = kind
+        self.gcode = gcode
+        self.tool = tool
+        self.pocket = pocket
+        self.target = target
+
+    def describe(self) -> str:
+        if self.kind == BatchStep.DROP:
+            return f'drop T{self.tool} into pocket {self.pocket}'
+        if self.kind == BatchStep.PICKUP:
+            return f'pick up T{self.tool} from pocket {self.pocket}'
+        if self.kind == BatchStep.CHANGE:
+            return f'change to T{self.tool}'
+        return f'traverse to pocket {self.pocket}'
+
+    def __repr__(self) -> str:
+        return f'BatchStep({self.kind}, {self.gcode!r})'
+
+'''
+    seconds_saved is the planner's estimate of the rack moves and cover cycles the sequence
+    leaves out compared to a pickup and a drop per tool from the TOOL ACTIONS buttons.
+'''
+class BatchPlan():
+    def __init__(self, op:str, steps:list, skipped:list = None, seconds_saved:float = 0.0) -> None:
+        self.op = op
+        self.steps = steps
+        self.skipped = skipped or [] # (tool, reason)
+        self.seconds_saved = seconds_saved
+
+    @property
+    def targets(self) -> list:
+        return [step for step in self.steps if step.target]
+
+    def format_summary(self) -> str:
+        lines = [f'{self.op.upper()}: {len(self.targets)} tool(s) in {len(self.steps)} step(s), '
+                 f'~{self.seconds_saved:.0f}s saved']
+        lines += [f'  {i + 1:3d} {step.describe():<32} {step.gcode}' for i, step in enumerate(self.steps)]
+        lines += [f'  skipped T{tool}: {reason}' for tool, reason in self.skipped]
+        return '\n'.join(lines)
+
+'''
+    BatchPlanner orders the tools of a batch and turns them into BatchSteps.
+    Verify uses _drop_tool / _pickup_tool directly: between two pockets the drop is staged (the
+    cover stays open at safe Z) or direct (the spindle stays at IR engage height and traverses
+    at traverse_z), and the pickup skips what the drop already did, like tool_change.ngc.
+    Measure and cycle are T<n> M6, tool_change.ngc plans the move between the pockets itself.
+'''
+class BatchPlanner():
+    def __init__(self, planner:ToolChangePlanner) -> None:
+        self.planner = planner
+
+    @property
+    def rack(self):
+        return self.planner.rack
+
+    def order(self, pockets:list, start_pocket:int = 0) -> list:
+        '''
+            The pockets in one sweep: from start_pocket to the nearer end of the rack first,
+            then to the other end. Without a start pocket the sweep starts at pocket 1.
+        '''
+        pockets = sorted(set(pockets))
+        if not pockets or start_pocket <= 0:
+            return pockets
+        below = [p for p in pockets if p < start_pocket]
+        above = [p for p in pockets if p >= start_pocket]
+        if not below or not above:
+            return above + below[::-1]
+        if start_pocket - below[0] < above[-1] - start_pocket:
+            return below[::-1] + above
+        return above + below[::-1]
+
+    def rack_tools(self, tool_pockets:dict) -> tuple:
+        '''
+            ({tool: pocket} of the tools in the rack, [(tool, reason)] of the others)
+        '''
+        tools = {}
+        skipped = []
+        for tool, pocket in tool_pockets.items():
+            if self.rack.in_rack(pocket):
+                tools[tool] = pocket
+            else:
+                skipped.append((tool, f'pocket {pocket} is not in the rack'))
+        return tools, skipped
+
+    def move_saved(self, from_pocket:int, to_pocket:int, staged:bool) -> float:
+        '''
+            Seconds a planned move between two pockets saves over a drop and a pickup of their own,
+            each with its own retract and cover cycle
+        '''
+        planner = self.planner
+        standard, _ = planner.standard_path(from_pocket, to_pocket)
+        manual = planner.path_time(standard) + planner.timings.cover_close() + planner.timings.cover_open()
+        plan = planner.plan(from_pocket, to_pocket)
+        if plan.direct:
+            return manual - plan.seconds
+        return manual - planner.path_time(standard) - (0.0 if staged else planner.timings.cover_between())
+
+    def move(self, steps:list, from_tool:int, from_pocket:int, to_tool:int, to_pocket:int,
+             target:bool) -> float:
+        '''
+            Drop from_tool and pick up to_tool without a retract and cover cycle in between,
+            returns the seconds saved
+        '''
+        plan = self.planner.plan(from_pocket, to_pocket)
+        flags = '[1] [0]' if plan.direct else '[0] [1]'
+        steps.append(BatchStep(BatchStep.DROP, f'o<_drop_tool> call [{from_pocket}] {flags}', from_tool, from_pocket))
+        if plan.direct:
+            x, y = self.rack.pocket_xy(to_pocket)
+            steps.append(BatchStep(BatchStep.TRAVERSE, f'G53 G0 Z{self.rack.traverse_z:.4f}', pocket=to_pocket))
+            steps.append(BatchStep(BatchStep.TRAVERSE, f'G53 G0 X{x:.4f} Y{y:.4f}', pocket=to_pocket))
+        steps.append(BatchStep(BatchStep.PICKUP, f'o<_pickup_tool> call [{to_pocket}] [{to_tool}] [0] {flags}',
+                               to_tool, to_pocket, target))
+        return self.move_saved(from_pocket, to_pocket, staged=True)
+
+    def verify(self, targets:dict, spindle:tuple = (0, 0), restore:tuple = (0, 0), start_pocket:int = 0) -> BatchPlan:
+        '''
+            Pick every target tool up from its pocket and put it back, the pickup fails when the
+            IR sensor does not see the tool. spindle is the (tool, pocket) in the spindle at the
+            start, it is dropped first. restore is the (tool, pocket) picked up at the end.
+            An empty spindle starts the sweep at start_pocket.
+        '''
+        targets, skipped = self.rack_tools(targets)
+        spindle_tool, spindle_pocket = spindle
+        order = self.order([p for t, p in targets.items() if t != spindle_tool], spindle_pocket or start_pocket)
+        pocket_tool = {p: t for t, p in targets.items()}
+        steps = []
+        saved = 0.0
+        tool, pocket = spindle if spindle_tool > 0 else (0, 0)
+        for p in order:
+            if tool > 0:
+                saved += self.move(steps, tool, pocket, pocket_tool[p], p, target=True)
+            else:
+                steps.append(BatchStep(BatchStep.PICKUP, f'o<_pickup_tool> call [{p}] [{pocket_tool[p]}]',
+                                       pocket_tool[p], p, target=True))
+            tool, pocket = pocket_tool[p], p
+        if restore[0] > 0 and restore != (tool, pocket):
+            if tool > 0:
+                saved += self.move(steps, tool, pocket, restore[0], restore[1], target=False)
+            else:
+                steps.append(BatchStep(BatchStep.PICKUP, f'o<_pickup_tool> call [{restore[1]}] [{restore[0]}]',
+                                       restore[0], restore[1]))
+        elif restore[0] <= 0 and tool > 0:
+            steps.append(BatchStep(BatchStep.DROP, f'o<_drop_tool> call [{pocket}]', tool, pocket))
+        return BatchPlan(VERIFY, steps, skipped, saved)
+
+    def changes(self, op:str, targets:dict, spindle:tuple, unload:bool) -> BatchPlan:
+        targets, skipped = self.rack_tools(targets)
+        spindle_tool, spindle_pocket = spindle
+        order = self.order([p for t, p in targets.items() if t != spindle_tool], spindle_pocket)
+        pocket_tool = {p: t for t, p in targets.items()}
+        tools = [pocket_tool[p] for p in order]
+        if spindle_tool in targets:
+            if op == MEASURE:
+                tools.append(spindle_tool) # measured last, the spindle ends up with the tool it started with
+            else:
+                tools.insert(0, spindle_tool)
+        steps = [BatchStep(BatchStep.CHANGE, f'T{t} M6', t, targets[t], target=True) for t in tools]
+        saved = 0.0
+        pockets = [spindle_pocket] + [targets[t] for t in tools]
+        for a, b in zip(pockets, pockets[1:]):
+            if self.rack.in_rack(a) and a != b:
+                saved += self.move_saved(a, b, staged=False)
+        if unload and tools and spindle_tool <= 0:
+            steps.append(BatchStep(BatchStep.DROP, f'o<_drop_tool> call [{targets[tools[-1]]}]',
+                                   tools[-1], targets[tools[-1]]))
+        return BatchPlan(op, steps, skipped, saved)
+
+    def measure(self, targets:dict, spindle:tuple = (0, 0)) -> BatchPlan:
+        '''
+            T<n> M6 for every target tool with the probe cache bypassed by the caller. An empty
+            spindle is empty again at the end, a spindle tool is measured last and stays loaded.
+        '''
+        return self.changes(MEASURE, targets, spindle, unload=True)
+
+    def cycle(self, targets:dict, spindle:tuple = (0, 0)) -> BatchPlan:
+        '''
+            T<n> M6 through the target tools, the last one stays in the spindle
+        '''
+        return self.changes(CYCLE, targets, spindle, unload=False)
+
+'''
+    BatchRun is the progress of a running batch: the plan, the index of the step that is running
+    and the targets that are done or failed. A verify that fails on a pocket is planned again for
+    the pockets that are left, the run keeps its counts across those plans.
+'''
+class BatchRun():
+    def __init__(self, plan:BatchPlan, spindle:tuple = (0, 0), restore:tuple = (0, 0), now:float = None) -> None:
+        self.op = plan.op
+        self.plan = plan
+        self.spindle = spindle
+        self.restore = restore
+        self.total = len(plan.targets)
+        self.done = [] # tools
+        self.failed = [] # (tool, pocket)
+        self.index = 0
+        self.started = time.monotonic() if now is None else now
+        self.seconds_saved = plan.seconds_saved
+
+    @property
+    def step(self) -> BatchStep:
+        return self.plan.steps[self.index] if self.index < len(self.plan.steps) else None
+
+    def replan(self, plan:BatchPlan):
+        self.plan = plan
+        self.index = 0
+        self.seconds_saved += plan.seconds_saved
+
+    def remaining(self) -> dict:
+        '''
+            {tool: pocket} of the targets of the current plan that are not done or failed
+        '''
+        finished = set(self.done) | {t for t, _ in self.failed}
+        return {s.tool: s.pocket for s in self.plan.targets if s.tool not in finished}
+
+    def format_progress(self) -> str:
+        count = len(self.done) + len(self.failed)
+        text = f'{self.op.upper()} {count}/{self.total}'
+        if self.step is not None:
+            text += f': {self.step.describe()}'
+        if self.failed:
+            text += ', failed ' + ' '.join(f'T{t}' for t, _ in self.failed)
+        return text
+
+    def format_result(self, now:float = None) -> str:
+        elapsed = (time.monotonic() if now is None else now) - self.started
+        text = f'{self.op.upper()} finished: {len(self.done)}/{self.total} tool(s) in {elapsed:.0f}s'
+        if self.failed:
+            text += ', failed ' + ' '.join(f'T{t} (pocket {p})' for t, p in self.failed)
+        return text
@@ -0,0 +1,217 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    Tool to pocket assignment. Given the tool sequences of one or more jobs, choose which
+    tools go in the rack (the most used ones when there are more tools than pockets) and
+    arrange them so the rack travel between consecutive changes is as short as possible.
+'''
+
+import time
+
+from atc_planner import ToolChangePlanner
+from atc_tooltable import update_tool_table
+
+'''
+    A proposed layout, {tool: pocket} for the tools in the rack.
+    cost and current_cost are seconds of rack travel for the scanned sequences.
+'''
+class LayoutProposal():
+    def __init__(self, layout:dict, cost:float, current_cost:float, unloaded:list, elapsed_ms:float) -> None:
+        self.layout = layout
+        self.cost = cost
+        self.current_cost = current_cost
+        self.unloaded = unloaded
+        self.elapsed_ms = elapsed_ms
+
+    def format_summary(self) -> str:
+        lines = [f'Proposed layout: rack travel {self.cost:.1f}s (current {self.current_cost:.1f}s), '
+                 f'{self.elapsed_ms:.0f}ms']
+        lines.extend(f'P{p}: T{t}' for t, p in sorted(self.layout.items(), key=lambda i: i[1]))
+        if self.unloaded:
+            lines.append('Manual: ' + ' '.join(f'T{t}' for t in self.unloaded))
+        return '\n'.join(lines)
+
+class PocketLayoutOptimizer():
+    def __init__(self, planner:ToolChangePlanner, max_passes:int = 50) -> None:
+        self.planner = planner
+        self.max_passes = max_passes
+        rack = planner.rack
+        n = rack.num_pockets
+        z = rack.safe_z
+        xy = [rack.pocket_xy(p) for p in range(1, n + 1)]
+        # travel time between pockets, index 0 = pocket 1
+        self.travel = [[planner.motion.rapid_time((*a, z), (*b, z)) for b in xy] for a in xy]
+
+    @staticmethod
+    def transitions(sequences:list) -> tuple:
+        '''
+            Count how often every tool is used and how often each pair of tools follows each other
+        '''
+        uses = {}
+        first = {}
+        weights = {}
+        for sequence in sequences:
+            previous = 0
+            for tool in sequence:
+                if tool <= 0 or tool == previous:
+                    previous = tool
+                    continue
+                uses[tool] = uses.get(tool, 0) + 1
+                first.setdefault(tool, len(first))
+                if previous > 0:
+                    a, b = (previous, tool) if previous < tool else (tool, previous)
+                    weights[(a, b)] = weights.get((a, b), 0) + 1
+                previous = tool
+        return uses, first, weights
+
+    def cost(self, layout:dict, weights:dict) -> float:
+        '''
+            Rack travel of a layout, pairs with a tool outside the rack are changed by hand and cost nothing here
+        '''
+        total = 0.0
+        for (a, b), w in weights.items():
+            pa = layout.get(a, 0)
+            pb = layout.get(b, 0)
+            if self.planner.rack.in_rack(pa) and self.planner.rack.in_rack(pb):
+                total += w * self.travel[pa - 1][pb - 1]
+        return total
+
+    def optimize(self, sequences:list, current:dict = None) -> LayoutProposal:
+        start = time.perf_counter()
+        n = self.planner.rack.num_pockets
+        uses, first, weights = self.transitions(sequences)
+        # most used tools first, ties keep program order
+        ranked = sorted(uses, key=lambda t: (-uses[t], first[t]))
+        loaded = ranked[:n]
+        unloaded = ranked[n:]
+        loadedset = set(loaded)
+        neighbours = {t: {} for t in loaded}
+        for (a, b), w in weights.items():
+            if a in loadedset and b in loadedset:
+                neighbours[a][b] = w
+                neighbours[b][a] = w
+
+        slots = self.initial_slots(loaded, neighbours, n)
+        # keep the current layout as the starting point when it is already better
+        current = current or {}
+        if loaded and all(self.planner.rack.in_rack(current.get(t, 0)) for t in loaded) \
+                and len({current[t] for t in loaded}) == len(loaded):
+            current_slots = [None] * n
+            for t in loaded:
+                current_slots[current[t] - 1] = t
+            if self.slots_cost(current_slots, neighbours) < self.slots_cost(slots, neighbours):
+                slots = current_slots
+        slots = self.improve(slots, neighbours)
+
+        layout = {t: i + 1 for i, t in enumerate(slots) if t is not None}
+        return LayoutProposal(layout, self.cost(layout, weights), self.cost(current, weights), unloaded,
+                              (time.perf_counter() - start) * 1000)
+
+    def initial_slots(self, loaded:list, neighbours:dict, n:int) -> list:
+        '''
+            Greedy start: begin with the most used tool in the middle of the rack and keep adding the tool
+            most connected to those already placed at whichever free end is cheaper
+        '''
+        slots = [None] * n
+        if not loaded:
+            return slots
+        left = right = (n - 1) // 2
+        slots[left] = loaded[0]
+        placed = {loaded[0]: left}
+        remaining = loaded[1:]
+        while remaining:
+            best = max(remaining, key=lambda t: sum(w for u, w in neighbours[t].items() if u in placed))
+            remaining.remove(best)
+            options = [i for i in (left - 1, right + 1) if 0 <= i < n]
+            i = min(options, key=lambda i: sum(w * self.travel[i][placed[u]]
+                                               for u, w in neighbours[best].items() if u in placed))
+            slots[i] = best
+            placed[best] = i
+            left = min(left, i)
+            right = max(right, i)
+        return slots
+
+    def slots_cost(self, slots:list, neighbours:dict) -> float:
+        pos = {t: i for i, t in enumerate(slots) if t is not None}
+        return sum(w * self.travel[pos[a]][pos[b]] for a in pos for b, w in neighbours[a].items() if a < b)
+
+    def improve(self, slots:list, neighbours:dict) -> list:
+        '''
+            Pairwise swap local search, empty pockets take part so tools can also move into them
+        '''
+        n = len(slots)
+        pos = {t: i for i, t in enumerate(slots) if t is not None}
+        travel = self.travel
+
+        def local(t, i, skip):
+            if t is None:
+                return 0.0
+            return sum(w * travel[i][pos[u]] for u, w in neighbours[t].items() if u != skip)
+
+        for _ in range(self.max_passes):
+            improved = False
+            for i in range(n - 1):
+                for j in range(i + 1, n):
+                    a, b = slots[i], slots[j]
+                    if a is None and b is None:
+                        continue
+                    delta = local(a, j, b) + local(b, i, a) - local(a, i, b) - local(b, j, a)
+                    if delta < -1e-9:
+                        slots[i], slots[j] = b, a
+                        if a is not None:
+                            pos[a] = j
+                        if b is not None:
+                            pos[b] = i
+                        improved = True
+            if not improved:
+                break
+        return slots
+
+def write_tool_table(tooltable:str, layout:dict, num_pockets:int) -> dict:
+    '''
+        Give every tool in tooltable its pocket of layout, only the lines whose P word changes are
+        rewritten and the table is replaced atomically (see atc_tooltable.update_tool_table).
+        Tools of the layout that are not in the table yet are appended. Tools that are not in layout keep their pocket when it is outside the rack and free,
+        otherwise they are given the next free pocket after the rack. Returns the pockets written.
+    '''
+    current = load_tool_pockets(tooltable)
+    taken = set(layout.values())
+    pockets = {}
+    for tool, old in current.items():
+        if tool not in layout and old > num_pockets and old not in taken:
+            pockets[tool] = old
+            taken.add(old)
+    spare = num_pockets + 1
+    for tool in current:
+        if tool in layout:
+            pockets[tool] = layout[tool]
+        elif tool not in pockets:
+            while spare in taken:
+                spare += 1
+            pockets[tool] = spare
+            taken.add(spare)
+    for tool in set(layout) - set(current):
+        pockets[tool] = layout[tool]
+    update_tool_table(tooltable, {tool: {'P': pocket} for tool, pocket in pockets.items()
+                                  if current.get(tool) != pocket})
+    return pockets
@@ -0,0 +1,219 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Logging for the rapid_atc handler. Each subsystem logs to a child of the handler's logger
+    (rapid_atc.mdi, rapid_atc.prefs, ..) and the levels are set from the INI:
+
+        [RAPID_ATC]
+        LOG_LEVEL = INFO
+        LOG_LEVEL_MDI = DEBUG
+        LOG_FILE = rapid_atc.log
+
+    RepeatFilter drops repeats of the same warning or error for LOG_REPEAT_INTERVAL seconds and
+    reports how many were dropped with the next one, RingBuffer keeps the recent records for
+    the GUI and the log file is written from a QueueListener thread, so logging never waits
+    on the disk.
+'''
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+SECTION = 'RAPID_ATC'
+SUBSYSTEMS = ('status', 'mdi', 'prescan', 'prefs', 'params', 'profiler', 'periodic', 'layout', 'cache', 'rack', 'batch')
+FORMAT = '%(asctime)s %(levelname)-8s %(name)s: %(message)s'
+DATEFMT = '%H:%M:%S'
+
+def level_from_name(value:str) -> int:
+    '''
+        DEBUG/INFO/WARNING/ERROR/CRITICAL or a number
+    '''
+    value = str(value).strip().upper()
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value)
+    if not isinstance(level, int):
+        raise ValueError(f'Unknown log level {value}')
+    return level
+
+class RepeatFilter(logging.Filter):
+    '''
+        Lets the first of a run of identical records through and drops the rest for interval
+        seconds. The next one after that carries the number dropped in record.repeats.
+        Records below min_level are never dropped.
+    '''
+    def __init__(self, interval:float = 10.0, min_level:int = logging.WARNING, max_keys:int = 1000,
+                 clock=time.monotonic) -> None:
+        super().__init__()
+        self.interval = interval
+        self.min_level = min_level
+        self.max_keys = max_keys
+        self.clock = clock
+        self.seen = {} # key -> [time let through, dropped since]
+        self.lock = threading.Lock()
+        self.passed = 0
+        self.dropped = 0
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno, record.getMessage())
+        now = self.clock()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                self.dropped += 1
+                return False
+            if entry is None and len(self.seen) >= self.max_keys:
+                self.prune(now)
+            self.seen[key] = [now, 0]
+            self.passed += 1
+        record.repeats = entry[1] if entry else 0
+        if record.repeats:
+            record.msg = f'{record.getMessage()} (repeated {record.repeats} times)'
+            record.args = None
+        return True
+
+    def prune(self, now:float):
+        expired = [key for key, (seen, _) in self.seen.items() if now - seen >= self.interval]
+        for key in expired or list(self.seen)[:len(self.seen) // 2]:
+            del self.seen[key]
+
+class RingBuffer(logging.Handler):
+    '''
+        Keeps the last capacity formatted records, version changes whenever one is added
+    '''
+    def __init__(self, capacity:int = 500, level:int = logging.NOTSET) -> None:
+        super().__init__(level)
+        self.records = deque(maxlen=capacity)
+        self.version = 0
+        self.setFormatter(logging.Formatter(FORMAT, DATEFMT))
+
+    def emit(self, record:logging.LogRecord):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self.records.append((record.levelno, line))
+        self.version += 1
+
+    def lines(self, min_level:int = logging.NOTSET) -> list:
+        return [line for level, line in list(self.records) if level >= min_level]
+
+    def text(self, min_level:int = logging.NOTSET) -> str:
+        return '\n'.join(self.lines(min_level))
+
+    def clear(self):
+        self.records.clear()
+        self.version += 1
+
+class LogHub():
+    '''
+        Owns the repeat filter, ring buffer and log file of base and its subsystem loggers
+    '''
+    def __init__(self, base:logging.Logger, history:int = 500, repeat_interval:float = 10.0) -> None:
+        self.base = base
+        self.repeats = RepeatFilter(interval=repeat_interval)
+        self.ring = RingBuffer(history)
+        self.loggers = {}
+        self.queue_handler = None
+        self.listener = None
+        self.filename = None
+        base.addHandler(self.ring)
+        base.addFilter(self.repeats)
+
+    def getLogger(self, subsystem:str) -> logging.Logger:
+        logger = self.loggers.get(subsystem)
+        if logger is None:
+            # logger filters only see records logged on that logger, so every subsystem gets it
+            logger = self.base.getChild(subsystem)
+            logger.addFilter(self.repeats)
+            self.loggers[subsystem] = logger
+        return logger
+
+    def setLevel(self, level, subsystem:str = None):
+        logger = self.base if subsystem is None else self.getLogger(subsystem)
+        logger.setLevel(level_from_name(level) if isinstance(level, str) else level)
+
+    def configure(self, ini, section:str = SECTION, default_level:str = 'INFO'):
+        '''
+            Read LOG_LEVEL, LOG_LEVEL_<SUBSYSTEM>, LOG_HISTORY and LOG_REPEAT_INTERVAL,
+            ini is anything with find(section, key) like the QtVCP INI object
+        '''
+        def setting(key:str, default, convert):
+            value = ini.find(section, key)
+            if value is None or value == '':
+                return default
+            try:
+                return convert(value)
+            except ValueError as detail:
+                self.base.warning(f'Invalid [{section}] {key} = {value}: {detail}')
+                return default
+        self.setLevel(setting('LOG_LEVEL', level_from_name(default_level), level_from_name))
+        for subsystem in SUBSYSTEMS:
+            self.setLevel(setting(f'LOG_LEVEL_{subsystem.upper()}', logging.NOTSET, level_from_name), subsystem)
+        self.repeats.interval = setting('LOG_REPEAT_INTERVAL', self.repeats.interval, float)
+        history = setting('LOG_HISTORY', self.ring.records.maxlen, int)
+        if history != self.ring.records.maxlen:
+            self.ring.records = deque(self.ring.records, maxlen=history)
+
+    def startFile(self, filename:str, max_bytes:int = 1000000, backups:int = 3):
+        '''
+            Write the log to filename from a background thread, rotating at max_bytes
+        '''
+        self.stopFile()
+        file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups, delay=True)
+        file_handler.setFormatter(logging.Formatter(FORMAT))
+        records = queue.SimpleQueue()
+        self.queue_handler = QueueHandler(records)
+        self.listener = QueueListener(records, file_handler)
+        self.listener.start()
+        self.base.addHandler(self.queue_handler)
+        self.filename = filename
+
+    def stopFile(self):
+        '''
+            Flush what is queued and close the file
+        '''
+        if self.listener is None:
+            return
+        self.base.removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        self.listener = None
+        self.queue_handler = None
+
+    def get_stats(self) -> dict:
+        return {
+            'passed': self.repeats.passed,
+            'dropped': self.repeats.dropped,
+            'buffered': len(self.ring.records),
+            'file': self.filename if self.listener is not None else None,
+        }
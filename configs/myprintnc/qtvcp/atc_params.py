@@ -0,0 +1,401 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    Declarative table of the rapid_atc parameters. One row ties together the preference key,
+    the HAL pin, the widget and its validator range, and ParamRegistry creates the pins,
+    loads the preferences, applies them and binds the widgets from that table.
+    Widgets, the HAL component and the preference object are duck typed, the startup
+    benchmark in sim/tests/test_benchmarks.py drives the registry with stand-ins.
+'''
+
+import logging
+import time
+from enum import StrEnum
+from functools import partial
+
+log = logging.getLogger('rapid_atc.params')
+
+class AtcHalPin(StrEnum):
+    SAFE_Z = 'safe_z'
+    Z_IR_ENGAGE = 'z_ir_engage'
+    NUM_POCKETS = 'num_pockets'
+    POCKET_OFFSET = 'pocket_offset'
+    FIRST_POCKET_X = 'first_pocket_x'
+    FIRST_POCKET_Y = 'first_pocket_y'
+    ENGAGE_Z =  'engage_z'
+    ENGAGE_Z_DROP_OFFSET = 'engage_z_drop_offset'
+    ALIGN_AXIS = 'align_axis'
+    #ALIGN_DIR = 'align_dir'
+    IR_HAL_DPIN = 'ir_hal_dpin'
+    COVER_HAL_DPIN = 'cover_hal_dpin'
+    DROP_RATE = 'drop_feed_rate'
+    PICKUP_RATE = 'pickup_feed_rate'
+    SPINDLE_SPEED_PICKUP = 'spindle_speed_pickup'
+    SPINDLE_SPEED_DROP = 'spindle_speed_drop'
+    COVER_DWELL = 'cover_dwell'
+    COVER_SETTLE = 'cover_settle'
+    SPINUP_DWELL = 'spinup_dwell'
+    SPINDLE_STOP_DWELL = 'spindle_stop_dwell'
+    IR_SETTLE_DWELL = 'ir_settle_dwell'
+    ENGAGE_RETRIES = 'engage_retries'
+    EVENT_WAITS = 'event_waits'
+    SENSOR_TIMEOUT = 'sensor_timeout'
+    AT_SPEED_DPIN = 'at_speed_dpin'
+    COVER_OPEN_DPIN = 'cover_open_dpin'
+    X_MANUAL_CHANGE_POS = 'x_manual_change_pos'
+    Y_MANUAL_CHANGE_POS = 'y_manual_change_pos'
+    CURRENT_TOOL_POCKET = 'current_tool_pocket'
+    #TOOL_INDEX = 'tool_'
+    IR_ENABLED = 'ir_enabled'
+    COVER_ENABLED = 'cover_enabled'
+    DUST_COVER_STATE = 'dust_cover_state'
+    ATC_PHASE = 'atc_phase'
+    PLAN_FROM_POCKET = 'plan_from_pocket'
+    PLAN_TO_POCKET = 'plan_to_pocket'
+    PLAN_DIRECT = 'plan_direct'
+    PLAN_TRAVERSE_Z = 'plan_traverse_z'
+    PLAN_X = 'plan_x'
+    PLAN_Y = 'plan_y'
+    ATC_PHASE_POCKET = 'atc_phase_pocket'
+    PRESTAGE = 'prestage'
+    PROBE_CACHED = 'probe_cached'
+    PROBE_CACHED_TOOL = 'probe_cached_tool'
+    PROBE_WINDOW = 'probe_window'
+    PROBE_PRIOR_TOOL = 'probe_prior_tool'
+    PROBE_PRIOR_LENGTH = 'probe_prior_length'
+    PROBE_PRIOR_Z_OFFSET = 'probe_prior_z_offset'
+    PROBE_CHECK_REQUEST = 'probe_check_request'
+    PROBE_CHECK_ACK = 'probe_check_ack'
+    RACK_CHECK = 'rack_check'
+    RACK_CHECK_REQUEST = 'rack_check_request'
+    RACK_CHECK_ACK = 'rack_check_ack'
+    def __str__(self) -> str:
+        return self.value
+
+class ConfigElement(StrEnum):
+    ATC_SECTION = 'RAPID_ATC'
+    NUM_POCKETS = 'num_pockets'
+    POCKET_OFFSET = 'pocket_offset'
+    FIRST_POCKET_X = 'first_pocket_x'
+    FIRST_POCKET_Y = 'first_pocket_y'
+    Z_ENGAGE = 'z_engage'
+    Z_ENGAGE_DROP_OFFSET = 'z_engage_drop_offset'
+    Z_IR_ENGAGE = 'z_ir_engage'
+    COVER_HAL_DPIN = 'cover_hal_dpin'
+    IR_HAL_DPIN = 'ir_hal_dpin'
+    Z_SAFE_CLEARANCE = 'z_safe_clearance'
+    X_MANUAL_CHANGE_POS = 'x_manual_change_pos'
+    Y_MANUAL_CHANGE_POS = 'y_manual_change_pos'
+    ALIGN_AXIS = 'align_axis'
+    #ALIGN_DIR = 'align_dir'
+    PICKUP_RATE = 'pickup_rate'
+    DROP_RATE = 'drop_rate'
+    SPINDLE_SPEED_PICKUP = 'spindle_speed_pickup'
+    SPINDLE_SPEED_DROP = 'spindle_speed_drop'
+    COVER_DWELL = 'cover_dwell'
+    COVER_SETTLE = 'cover_settle'
+    SPINUP_DWELL = 'spinup_dwell'
+    SPINDLE_STOP_DWELL = 'spindle_stop_dwell'
+    IR_SETTLE_DWELL = 'ir_settle_dwell'
+    ENGAGE_RETRIES = 'engage_retries'
+    EVENT_WAITS = 'event_waits'
+    SENSOR_TIMEOUT = 'sensor_timeout'
+    AT_SPEED_DPIN = 'at_speed_dpin'
+    COVER_OPEN_DPIN = 'cover_open_dpin'
+    IR_ENABLED = 'ir_enabled'
+    COVER_ENABLED = 'cover_enabled'
+    SLOW_REFRESH_MS = 'slow_refresh_ms'
+    ALLOW_DIRECT_TRAVERSE = 'allow_direct_traverse'
+    TRAVERSE_Z = 'traverse_z'
+    PRESTAGE = 'prestage'
+    PROBE_CACHE = 'probe_cache'
+    PROBE_CACHE_MINUTES = 'probe_cache_minutes'
+    PROBE_CACHE_CHANGES = 'probe_cache_changes'
+    PROBE_WINDOW = 'probe_window'
+    
+    def __str__(self) -> str:
+        return self.value
+
+FLOAT = 'float' # stored as the text that was typed, applied as float
+INT = 'int'
+BOOL = 'bool'
+AXIS = 'axis' # 'X' / 'Y' stored, pin 0 / 1, one checkable button per choice
+
+PIN_TYPES = {FLOAT: 'HAL_FLOAT', INT: 'HAL_S32', BOOL: 'HAL_BIT', AXIS: 'HAL_BIT'}
+PREF_TYPES = {FLOAT: str, INT: int, BOOL: bool, AXIS: str}
+
+'''
+    One parameter. pref is None for pins that are not stored (status/plan pins),
+    pin is None for preferences that only drive the handler (attr / on_change).
+'''
+class AtcParam():
+    __slots__ = ('pref', 'pin', 'kind', 'default', 'widget', 'bottom', 'top', 'decimals',
+                 'pin_dir', 'attr', 'on_change', 'default_from')
+
+    def __init__(self, pref:str, pin:str, kind:str, default=None, widget=None, bottom:float = None,
+                 top:float = None, decimals:int = 0, pin_dir:str = 'HAL_IN', attr:str = None,
+                 on_change:str = None, default_from:str = None) -> None:
+        self.pref = pref
+        self.pin = pin
+        self.kind = kind
+        self.default = default
+        self.widget = widget
+        self.bottom = bottom
+        self.top = top
+        self.decimals = decimals
+        self.pin_dir = pin_dir
+        self.attr = attr
+        self.on_change = on_change
+        self.default_from = default_from
+
+    @property
+    def key(self) -> str:
+        return self.pref or self.pin
+
+    def convert(self, value):
+        if self.kind == FLOAT:
+            return float(value)
+        if self.kind == INT:
+            return int(float(value)) if isinstance(value, str) else int(value)
+        if self.kind == BOOL:
+            return value.strip().lower() in ('1', 'yes', 'true', 'on') if isinstance(value, str) else bool(value)
+        value = str(value).upper()
+        if value not in ('X', 'Y'):
+            raise ValueError(f'{self.key}: expected X or Y, got {value}')
+        return value
+
+    def pin_value(self, value):
+        if self.kind == AXIS:
+            return 0 if value == 'X' else 1
+        if self.kind == BOOL:
+            return 1 if value else 0
+        return value
+
+def build_params() -> list:
+    '''
+        The parameter table. Pin order is the order the pins are created in.
+    '''
+    length = dict(bottom=-5000, top=5000, decimals=3)
+    dwell = dict(bottom=0, top=60, decimals=2)
+    rate = dict(bottom=0, top=5000, decimals=0)
+    P = AtcParam
+    return [
+        P(ConfigElement.Z_SAFE_CLEARANCE, AtcHalPin.SAFE_Z, FLOAT, '0', 'leZSafeClearance', **length),
+        P(ConfigElement.Z_IR_ENGAGE, AtcHalPin.Z_IR_ENGAGE, FLOAT, '0', 'leLocZIREngage', **length),
+        P(ConfigElement.NUM_POCKETS, AtcHalPin.NUM_POCKETS, INT, 4, 'leNoPockets'),
+        P(ConfigElement.POCKET_OFFSET, AtcHalPin.POCKET_OFFSET, FLOAT, '45', 'lePocketOffset', **length),
+        P(ConfigElement.FIRST_POCKET_X, AtcHalPin.FIRST_POCKET_X, FLOAT, '0', 'leLocPocketOneX', **length),
+        P(ConfigElement.FIRST_POCKET_Y, AtcHalPin.FIRST_POCKET_Y, FLOAT, '0', 'leLocPocketOneY', **length),
+        P(ConfigElement.X_MANUAL_CHANGE_POS, AtcHalPin.X_MANUAL_CHANGE_POS, FLOAT, '0', 'leXManualChangePos', **length),
+        P(ConfigElement.Y_MANUAL_CHANGE_POS, AtcHalPin.Y_MANUAL_CHANGE_POS, FLOAT, '0', 'leYManualChangePos', **length),
+        P(ConfigElement.Z_ENGAGE, AtcHalPin.ENGAGE_Z, FLOAT, '0', 'leLocZEngage', **length),
+        P(ConfigElement.Z_ENGAGE_DROP_OFFSET, AtcHalPin.ENGAGE_Z_DROP_OFFSET, FLOAT, '0', 'leZToolDropOffset', **length),
+        P(ConfigElement.ALIGN_AXIS, AtcHalPin.ALIGN_AXIS, AXIS, 'X', ('pbXAxis', 'pbYAxis')),
+        P(ConfigElement.DROP_RATE, AtcHalPin.DROP_RATE, INT, 1800, 'leSFDropRate', **rate),
+        P(ConfigElement.PICKUP_RATE, AtcHalPin.PICKUP_RATE, INT, 1800, 'leSFPickUpRate', **rate),
+        P(ConfigElement.SPINDLE_SPEED_PICKUP, AtcHalPin.SPINDLE_SPEED_PICKUP, INT, 1500, 'leSpindleSpeedPickup', **rate),
+        P(ConfigElement.SPINDLE_SPEED_DROP, AtcHalPin.SPINDLE_SPEED_DROP, INT, 1500, 'leSpindleSpeedDrop', **rate),
+        P(ConfigElement.COVER_DWELL, AtcHalPin.COVER_DWELL, FLOAT, '2.0', 'leCoverDwell', **dwell),
+        P(ConfigElement.COVER_SETTLE, AtcHalPin.COVER_SETTLE, FLOAT, '2.0', 'leCoverSettle', **dwell),
+        P(ConfigElement.SPINUP_DWELL, AtcHalPin.SPINUP_DWELL, FLOAT, '2.0', 'leSpinupDwell', **dwell),
+        P(ConfigElement.SPINDLE_STOP_DWELL, AtcHalPin.SPINDLE_STOP_DWELL, FLOAT, '2.0', 'leSpindleStopDwell', **dwell),
+        P(ConfigElement.IR_SETTLE_DWELL, AtcHalPin.IR_SETTLE_DWELL, FLOAT, '2.0', 'leIRSettleDwell', **dwell),
+        P(ConfigElement.ENGAGE_RETRIES, AtcHalPin.ENGAGE_RETRIES, INT, 2, 'leEngageRetries', bottom=1, top=10),
+        P(ConfigElement.EVENT_WAITS, AtcHalPin.EVENT_WAITS, BOOL, False, 'pbEventWaits'),
+        P(ConfigElement.SENSOR_TIMEOUT, AtcHalPin.SENSOR_TIMEOUT, FLOAT, '5.0', 'leSensorTimeout', **dwell),
+        P(ConfigElement.AT_SPEED_DPIN, AtcHalPin.AT_SPEED_DPIN, INT, 1, 'leAtSpeedDPin'),
+        P(ConfigElement.COVER_OPEN_DPIN, AtcHalPin.COVER_OPEN_DPIN, INT, -1, 'leCoverOpenDPin'),
+        P(None, AtcHalPin.CURRENT_TOOL_POCKET, INT),
+        P(ConfigElement.IR_ENABLED, AtcHalPin.IR_ENABLED, BOOL, True, 'btn_ir_enabled'),
+        P(ConfigElement.COVER_ENABLED, AtcHalPin.COVER_ENABLED, BOOL, True, 'btnCoverEnabled'),
+        P(ConfigElement.IR_HAL_DPIN, AtcHalPin.IR_HAL_DPIN, INT, 3, 'leIRDPinInput', on_change='bindIRPin'),
+        P(ConfigElement.COVER_HAL_DPIN, AtcHalPin.COVER_HAL_DPIN, INT, 2, 'leCoverDPinInput', pin_dir='HAL_OUT',
+          on_change='bindCoverPin'),
+        P(None, AtcHalPin.DUST_COVER_STATE, BOOL, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.ATC_PHASE, FLOAT),
+        P(None, AtcHalPin.ATC_PHASE_POCKET, FLOAT),
+        P(None, AtcHalPin.PLAN_FROM_POCKET, INT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PLAN_TO_POCKET, INT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PLAN_DIRECT, BOOL, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PLAN_TRAVERSE_Z, FLOAT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PLAN_X, FLOAT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PLAN_Y, FLOAT, pin_dir='HAL_OUT'),
+        P(ConfigElement.ALLOW_DIRECT_TRAVERSE, None, BOOL, False, 'pbAllowDirectTraverse', attr='allowDirectTraverse'),
+        P(ConfigElement.TRAVERSE_Z, None, FLOAT, None, 'leTraverseZ', attr='traverseZ',
+          default_from=ConfigElement.Z_IR_ENGAGE, **length),
+        P(ConfigElement.PRESTAGE, AtcHalPin.PRESTAGE, BOOL, False, 'pbPrestage'),
+        P(None, AtcHalPin.PROBE_CACHED, BOOL, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PROBE_CACHED_TOOL, INT, pin_dir='HAL_OUT'),
+        P(ConfigElement.PROBE_CACHE, None, BOOL, False, 'pbProbeCache', attr='probeCacheEnabled'),
+        P(ConfigElement.PROBE_CACHE_MINUTES, None, FLOAT, '240', 'leProbeCacheMinutes', bottom=0, top=10080,
+          decimals=1, on_change='setProbeCacheMinutes'),
+        P(ConfigElement.PROBE_CACHE_CHANGES, None, INT, 20, 'leProbeCacheChanges', bottom=0, top=1000,
+          on_change='setProbeCacheChanges'),
+        P(ConfigElement.PROBE_WINDOW, AtcHalPin.PROBE_WINDOW, FLOAT, '0', 'leProbeWindow', bottom=0, top=50, decimals=2),
+        P(None, AtcHalPin.PROBE_PRIOR_TOOL, INT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PROBE_PRIOR_LENGTH, FLOAT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PROBE_PRIOR_Z_OFFSET, FLOAT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.PROBE_CHECK_REQUEST, FLOAT),
+        P(None, AtcHalPin.PROBE_CHECK_ACK, FLOAT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.RACK_CHECK, INT, pin_dir='HAL_OUT'),
+        P(None, AtcHalPin.RACK_CHECK_REQUEST, FLOAT),
+        P(None, AtcHalPin.RACK_CHECK_ACK, FLOAT, pin_dir='HAL_OUT'),
+        P(ConfigElement.SLOW_REFRESH_MS, None, INT, 500, on_change='setSlowRefresh'),
+    ]
+
+class ParamRegistry():
+    def __init__(self, params:list, section:str) -> None:
+        self.params = params
+        self.section = section
+        self.by_key = {p.key: p for p in params}
+        self.stored = [p for p in params if p.pref is not None]
+        self.values = {}
+        self.texts = {} # FLOAT preferences keep the text as typed
+        self.prefs = None
+        self.owner = None
+        self.set_pin = None
+        self.widgets = None
+        self.timings = {}
+
+    def __getitem__(self, key:str):
+        return self.values[key]
+
+    def get(self, key:str, default=None):
+        return self.values.get(key, default)
+
+    def create_pins(self, comp, hal):
+        start = time.perf_counter()
+        for p in self.params:
+            if p.pin is not None:
+                comp.newpin(p.pin, getattr(hal, PIN_TYPES[p.kind]), getattr(hal, p.pin_dir))
+        self.timings['create_pins_ms'] = (time.perf_counter() - start) * 1000.0
+
+    def load(self, prefs):
+        '''
+            Read every stored parameter in one pass, invalid values fall back to the default
+        '''
+        start = time.perf_counter()
+        self.prefs = prefs
+        for p in self.stored:
+            default = p.default
+            if p.default_from is not None:
+                default = self.texts.get(p.default_from, self.values.get(p.default_from))
+            raw = prefs.getpref(p.pref, default, PREF_TYPES[p.kind], self.section)
+            try:
+                value = p.convert(raw)
+            except (TypeError, ValueError):
+                log.warning(f'Invalid preference {p.pref} = {raw}, using {default}')
+                raw = default
+                value = p.convert(default)
+            self.values[p.key] = value
+            if p.kind == FLOAT:
+                self.texts[p.key] = str(raw)
+        self.timings['load_ms'] = (time.perf_counter() - start) * 1000.0
+
+    def apply(self, set_pin, owner):
+        '''
+            Push the loaded values to their pins and handler attributes
+        '''
+        start = time.perf_counter()
+        self.set_pin = set_pin
+        self.owner = owner
+        for p in self.stored:
+            self.push(p, self.values[p.key])
+        self.timings['apply_ms'] = (time.perf_counter() - start) * 1000.0
+
+    def push(self, p:AtcParam, value):
+        if p.pin is not None:
+            self.set_pin(p.pin, p.pin_value(value))
+        if p.attr is not None:
+            setattr(self.owner, p.attr, value)
+        if p.on_change is not None:
+            getattr(self.owner, p.on_change)(value)
+
+    def bind(self, widgets, validator=None):
+        '''
+            Show the values in their widgets, install validators made by validator(param) and connect
+            editingFinished (line edits) / clicked (checkable buttons) to commit()
+        '''
+        start = time.perf_counter()
+        self.widgets = widgets
+        for p in self.stored:
+            if p.widget is None:
+                continue
+            if p.kind == AXIS:
+                for choice, name in zip(('X', 'Y'), p.widget):
+                    getattr(widgets, name).clicked.connect(partial(self.set, p.key, choice))
+            elif p.kind == BOOL:
+                button = getattr(widgets, p.widget)
+                button.clicked.connect(partial(self.commit_checked, p, button))
+            else:
+                edit = getattr(widgets, p.widget)
+                if validator is not None and p.bottom is not None:
+                    edit.setValidator(validator(p))
+                edit.editingFinished.connect(partial(self.commit_text, p, edit))
+            self.show(p)
+        self.timings['bind_ms'] = (time.perf_counter() - start) * 1000.0
+
+    def show(self, p:AtcParam):
+        if self.widgets is None or p.widget is None:
+            return
+        value = self.values[p.key]
+        if p.kind == AXIS:
+            for choice, name in zip(('X', 'Y'), p.widget):
+                button = getattr(self.widgets, name)
+                button.setChecked(value == choice)
+                button.setEnabled(value != choice)
+        elif p.kind == BOOL:
+            getattr(self.widgets, p.widget).setChecked(value)
+        else:
+            getattr(self.widgets, p.widget).setText(self.texts.get(p.key, str(value)))
+
+    def commit_text(self, p:AtcParam, edit, *args):
+        self.set(p.key, edit.text())
+
+    def commit_checked(self, p:AtcParam, button, *args):
+        self.set(p.key, button.isChecked())
+
+    def set(self, key:str, value, *args) -> bool:
+        '''
+            Set a parameter from a widget or from code: preference, pin, attribute and widget.
+            Returns False (and restores the widget) when the value does not convert.
+        '''
+        p = self.by_key[key]
+        try:
+            converted = p.convert(value)
+        except (TypeError, ValueError):
+            log.warning(f'Invalid value for {key}: {value}')
+            self.show(p)
+            return False
+        self.values[key] = converted
+        if p.pref is not None:
+            if p.kind == FLOAT:
+                text = value if isinstance(value, str) else str(value)
+                self.texts[key] = text
+                self.prefs.putpref(p.pref, text, str, self.section)
+            else:
+                self.prefs.putpref(p.pref, converted, PREF_TYPES[p.kind], self.section)
+            log.debug(f'SETTING {p.pref} = {converted} in preferences')
+        self.push(p, converted)
+        self.show(p)
+        return True
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    Rack geometry, motion time estimates and the tool change planner.
+    This module has no LinuxCNC/HAL/Qt dependencies so it can also be run offline:
+
+        python3 atc_planner.py --ini ../myprintnc.ini --pref ../qtdragon.pref 1 2 3 1
+'''
+
+import argparse
+import configparser
+import math
+from os import path
+
+from atc_tooltable import iter_tools
+
+def read_ini(inifile:str) -> dict:
+    '''
+        Minimal LinuxCNC INI reader, {(section, key): value} with the first value of repeated keys.
+        configparser can not be used, LinuxCNC INI files repeat keys and continue lines with a backslash
+    '''
+    values = {}
+    section = ''
+    with open(inifile, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line[0] in '#;':
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                section = line[1:-1]
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                values.setdefault((section, key.strip()), value.split('#', 1)[0].strip())
+    return values
+
+'''
+    RackGeometry mirrors the rack related rapid_atc pins.
+    Z values are machine coordinates (G53), align_axis 0 = pockets along X, 1 = along Y.
+'''
+class RackGeometry():
+    def __init__(self, num_pockets:int = 4, first_pocket_x:float = 0.0, first_pocket_y:float = 0.0,
+                 pocket_offset:float = 45.0, align_axis:int = 0, safe_z:float = 0.0,
+                 z_ir_engage:float = 0.0, engage_z:float = 0.0, traverse_z:float = 0.0,
+                 allow_direct:bool = False) -> None:
+        self.num_pockets = int(num_pockets)
+        self.first_pocket_x = float(first_pocket_x)
+        self.first_pocket_y = float(first_pocket_y)
+        self.pocket_offset = float(pocket_offset)
+        self.align_axis = int(align_axis)
+        self.safe_z = float(safe_z)
+        self.z_ir_engage = float(z_ir_engage)
+        self.engage_z = float(engage_z)
+        self.traverse_z = float(traverse_z)
+        self.allow_direct = bool(allow_direct)
+
+    def in_rack(self, pocket:int) -> bool:
+        return 1 <= pocket <= self.num_pockets
+
+    def pocket_xy(self, pocket:int) -> tuple:
+        # same formula as _drop_tool.ngc / _pickup_tool.ngc
+        delta = (pocket - 1) * self.pocket_offset
+        if self.align_axis == 0:
+            return (self.first_pocket_x + delta, self.first_pocket_y)
+        return (self.first_pocket_x, self.first_pocket_y + delta)
+
+    def direct_traverse_ok(self) -> bool:
+        # the traverse height must be between the IR engage height and safe Z
+        return self.allow_direct and self.z_ir_engage <= self.traverse_z <= self.safe_z
+
+'''
+    MotionModel estimates rapid (G0) move times from the INI axis limits using a
+    trapezoidal velocity profile per axis, limited by the [TRAJ] vector velocity.
+'''
+class MotionModel():
+    def __init__(self, max_vel:tuple = (237.5, 150.0, 50.0), max_accel:tuple = (500.0, 500.0, 175.0),
+                 traj_max_vel:float = 100.0) -> None:
+        self.max_vel = max_vel
+        self.max_accel = max_accel
+        self.traj_max_vel = traj_max_vel
+
+    @staticmethod
+    def axis_time(dist:float, vel:float, accel:float) -> float:
+        dist = abs(dist)
+        if dist == 0 or vel <= 0 or accel <= 0:
+            return 0.0
+        if dist > vel * vel / accel:
+            return dist / vel + vel / accel
+        return 2.0 * math.sqrt(dist / accel)
+
+    def rapid_time(self, start:tuple, end:tuple) -> float:
+        deltas = [e - s for s, e in zip(start, end)]
+        t = max(self.axis_time(d, v, a) for d, v, a in zip(deltas, self.max_vel, self.max_accel))
+        length = math.sqrt(sum(d * d for d in deltas))
+        return max(t, self.axis_time(length, self.traj_max_vel, min(self.max_accel)))
+
+    @classmethod
+    def from_ini(cls, inifile:str):
+        ini = read_ini(inifile)
+        get = lambda sec, key, d: float(ini.get((sec, key), d))
+        vel = tuple(get(f'AXIS_{a}', 'MAX_VELOCITY', 50.0) for a in 'XYZ')
+        accel = tuple(get(f'AXIS_{a}', 'MAX_ACCELERATION', 100.0) for a in 'XYZ')
+        traj = get('TRAJ', 'MAX_LINEAR_VELOCITY', max(vel))
+        return cls(vel, accel, traj)
+
+'''
+    Dwell times and feed rates used by the macros, mirrors the timing rapid_atc pins.
+    Feed rates are in machine units per minute.
+'''
+class MacroTimings():
+    def __init__(self, cover_enabled:bool = True, cover_dwell:float = 2.0, cover_settle:float = 2.0,
+                 spinup_dwell:float = 2.0, spindle_stop_dwell:float = 2.0, ir_settle_dwell:float = 0.0,
+                 drop_feed_rate:float = 1000.0, pickup_feed_rate:float = 1000.0, prestage:bool = False) -> None:
+        self.cover_enabled = cover_enabled
+        self.cover_dwell = cover_dwell
+        self.cover_settle = cover_settle
+        self.spinup_dwell = spinup_dwell
+        self.spindle_stop_dwell = spindle_stop_dwell
+        self.ir_settle_dwell = ir_settle_dwell
+        self.drop_feed_rate = drop_feed_rate
+        self.pickup_feed_rate = pickup_feed_rate
+        self.prestage = prestage
+
+    def cover_open(self) -> float:
+        return (self.cover_dwell if self.cover_enabled else 0.0) + self.cover_settle
+
+    def cover_close(self) -> float:
+        return self.cover_dwell if self.cover_enabled else 0.0
+
+    def cover_between(self) -> float:
+        '''
+            Cover time between a drop and the pickup at safe Z, a pre-staged change keeps the cover open
+        '''
+        return 0.0 if self.prestage else self.cover_close() + self.cover_open()
+
+'''
+    A planned tool change. waypoints are the (x, y, z) rapid targets between the
+    engage of the drop pocket and the engage of the pickup pocket.
+'''
+class ChangePlan():
+    def __init__(self, from_pocket:int, to_pocket:int, direct:bool, waypoints:list,
+                 seconds:float, standard_seconds:float) -> None:
+        self.from_pocket = from_pocket
+        self.to_pocket = to_pocket
+        self.direct = direct
+        self.waypoints = waypoints
+        self.seconds = seconds
+        self.standard_seconds = standard_seconds
+
+    @property
+    def saved(self) -> float:
+        return self.standard_seconds - self.seconds
+
+    def __repr__(self) -> str:
+        return f'ChangePlan({self.from_pocket}->{self.to_pocket}, direct={self.direct}, ' \
+               f'{self.seconds:.2f}s, saved {self.saved:.2f}s)'
+
+'''
+    ToolChangePlanner compares the standard macro path (drop, safe Z, close cover,
+    XY at safe Z, open cover, pickup) with a direct XY traverse at traverse_z that keeps
+    the cover open, and picks the faster safe option. A pre-staged standard path leaves
+    the cover open at safe Z, see MacroTimings.cover_between().
+    Only the part that differs between the paths is timed, engage loops are the same for both.
+'''
+class ToolChangePlanner():
+    def __init__(self, rack:RackGeometry, motion:MotionModel = None, timings:MacroTimings = None) -> None:
+        self.rack = rack
+        self.motion = motion or MotionModel()
+        self.timings = timings or MacroTimings()
+
+    def path_time(self, waypoints:list) -> float:
+        return sum(self.motion.rapid_time(a, b) for a, b in zip(waypoints, waypoints[1:]))
+
+    def standard_path(self, from_pocket:int, to_pocket:int) -> tuple:
+        r = self.rack
+        fx, fy = r.pocket_xy(from_pocket)
+        tx, ty = r.pocket_xy(to_pocket)
+        waypoints = [(fx, fy, r.z_ir_engage), (fx, fy, r.safe_z), (tx, ty, r.safe_z), (tx, ty, r.z_ir_engage)]
+        seconds = self.path_time(waypoints) + self.timings.cover_between()
+        return waypoints, seconds
+
+    def direct_path(self, from_pocket:int, to_pocket:int) -> tuple:
+        r = self.rack
+        fx, fy = r.pocket_xy(from_pocket)
+        tx, ty = r.pocket_xy(to_pocket)
+        waypoints = [(fx, fy, r.z_ir_engage), (fx, fy, r.traverse_z), (tx, ty, r.traverse_z), (tx, ty, r.z_ir_engage)]
+        return waypoints, self.path_time(waypoints)
+
+    def plan(self, from_pocket:int, to_pocket:int) -> ChangePlan:
+        standard, standard_seconds = self.standard_path(from_pocket, to_pocket)
+        if self.rack.direct_traverse_ok() and self.rack.in_rack(from_pocket) and self.rack.in_rack(to_pocket) \
+                and from_pocket != to_pocket:
+            direct, direct_seconds = self.direct_path(from_pocket, to_pocket)
+            if direct_seconds < standard_seconds:
+                return ChangePlan(from_pocket, to_pocket, True, direct, direct_seconds, standard_seconds)
+        return ChangePlan(from_pocket, to_pocket, False, standard, standard_seconds, standard_seconds)
+
+    def engage_time(self, pickup:bool) -> float:
+        '''
+            One engage attempt at z_ir_engage: spin up, feed to engage_z, rapid back and wait for the spindle to stop
+        '''
+        r = self.rack
+        t = self.timings
+        feed = t.pickup_feed_rate if pickup else t.drop_feed_rate
+        plunge = abs(r.z_ir_engage - r.engage_z) * 60.0 / feed if feed > 0 else 0.0
+        seconds = t.spinup_dwell + plunge + self.motion.axis_time(r.z_ir_engage - r.engage_z, self.motion.max_vel[2],
+                                                                 self.motion.max_accel[2])
+        return seconds + t.spindle_stop_dwell + (t.ir_settle_dwell if pickup else 0.0)
+
+    def change_time(self, from_pocket:int, to_pocket:int) -> float:
+        '''
+            Estimated time of a whole tool change, from above the drop pocket at safe Z
+            until the new tool is back at safe Z. Pockets outside the rack are changed by hand
+            and only the rack part of the change is counted.
+        '''
+        r = self.rack
+        t = self.timings
+        dive = self.motion.axis_time(r.safe_z - r.z_ir_engage, self.motion.max_vel[2], self.motion.max_accel[2])
+        drop = r.in_rack(from_pocket)
+        pickup = r.in_rack(to_pocket)
+        if drop and pickup:
+            if from_pocket == to_pocket:
+                return 0.0
+            return t.cover_open() + dive + self.engage_time(False) + self.plan(from_pocket, to_pocket).seconds \
+                + self.engage_time(True) + dive + t.cover_close()
+        if drop or pickup:
+            return t.cover_open() + dive + self.engage_time(pickup) + dive + t.cover_close()
+        return 0.0
+
+    def simulate(self, pockets:list) -> list:
+        '''
+            Plan every change in a pocket sequence, the spindle starts empty
+        '''
+        plans = []
+        for a, b in zip(pockets, pockets[1:]):
+            if a == b or not self.rack.in_rack(a) or not self.rack.in_rack(b):
+                continue
+            plans.append(self.plan(a, b))
+        return plans
+
+def load_rack_prefs(preffile:str) -> tuple:
+    '''
+        Read RackGeometry and MacroTimings from the [RAPID_ATC] section of qtdragon.pref
+    '''
+    prefs = configparser.ConfigParser(strict=False, interpolation=None)
+    prefs.read(preffile)
+    sec = prefs['RAPID_ATC'] if prefs.has_section('RAPID_ATC') else {}
+    get = lambda k, d: float(sec.get(k, d))
+    rack = RackGeometry(
+        num_pockets=int(get('num_pockets', 4)),
+        first_pocket_x=get('first_pocket_x', 0),
+        first_pocket_y=get('first_pocket_y', 0),
+        pocket_offset=get('pocket_offset', 45),
+        align_axis=0 if str(sec.get('align_axis', 'X')).lower() == 'x' else 1,
+        safe_z=get('z_safe_clearance', 0),
+        z_ir_engage=get('z_ir_engage', 0),
+        engage_z=get('z_engage', 0),
+        traverse_z=get('traverse_z', sec.get('z_ir_engage', 0)),
+        allow_direct=str(sec.get('allow_direct_traverse', 'False')).lower() == 'true')
+    timings = MacroTimings(
+        cover_enabled=str(sec.get('cover_enabled', 'True')).lower() == 'true',
+        cover_dwell=get('cover_dwell', 2.0),
+        cover_settle=get('cover_settle', 2.0),
+        spinup_dwell=get('spinup_dwell', 2.0),
+        spindle_stop_dwell=get('spindle_stop_dwell', 2.0),
+        ir_settle_dwell=get('ir_settle_dwell', 0.0),
+        drop_feed_rate=get('drop_rate', 1000.0),
+        pickup_feed_rate=get('pickup_rate', 1000.0),
+        prestage=str(sec.get('prestage', 'False')).lower() == 'true')
+    return rack, timings
+
+def load_tool_pockets(tooltable:str) -> dict:
+    '''
+        tool -> pocket map from a LinuxCNC tool table
+    '''
+    return {record.tool: record.pocket for record in iter_tools(tooltable)}
+
+def main(argv=None):
+    here = path.dirname(path.abspath(__file__))
+    config = path.dirname(here)
+    parser = argparse.ArgumentParser(description='Simulate a tool sequence and report the time saved by the tool change planner')
+    parser.add_argument('--ini', default=path.join(config, 'myprintnc.ini'))
+    parser.add_argument('--pref', default=path.join(config, 'qtdragon.pref'))
+    parser.add_argument('--tool-table', default=path.join(config, 'tool.tbl'))
+    parser.add_argument('--traverse-z', type=float, help='override traverse_z and allow direct traverse')
+    parser.add_argument('--pockets', action='store_true', help='the sequence is pocket numbers, not tool numbers')
+    parser.add_argument('sequence', nargs='+', type=int)
+    args = parser.parse_args(argv)
+
+    rack, timings = load_rack_prefs(args.pref)
+    if args.traverse_z is not None:
+        rack.traverse_z = args.traverse_z
+        rack.allow_direct = True
+    if args.pockets:
+        pockets = args.sequence
+    else:
+        tool_pockets = load_tool_pockets(args.tool_table)
+        pockets = [tool_pockets.get(t, -1) for t in args.sequence]
+    planner = ToolChangePlanner(rack, MotionModel.from_ini(args.ini), timings)
+    plans = planner.simulate(pockets)
+    for p in plans:
+        print(p)
+    saved = sum(p.saved for p in plans)
+    print(f'{len(plans)} rack changes, standard {sum(p.standard_seconds for p in plans):.2f}s, '
+          f'planned {sum(p.seconds for p in plans):.2f}s, saved {saved:.2f}s')
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,204 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    Program pre-scan: list the M6 tool changes of an NGC file before cycle start,
+    map them to rack pockets and estimate the ATC time with the tool change planner.
+    The file is streamed line by line, parse results are cached by the file's SHA-1.
+'''
+
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from os import path
+
+from atc_planner import ToolChangePlanner
+
+COMMENT = re.compile(rb'\([^)]*\)')
+WORD = re.compile(rb'([TMQ])([+-]?[0-9.#\[<]*)')
+
+class ScanCancelled(Exception):
+    pass
+
+'''
+    One M6 found in the program. pocket is -1 for tools that are not in the tool table.
+'''
+class ToolChange():
+    __slots__ = ('line', 'tool', 'pocket', 'in_rack', 'seconds')
+
+    def __init__(self, line:int, tool:int, pocket:int = -1, in_rack:bool = False, seconds:float = 0.0) -> None:
+        self.line = line
+        self.tool = tool
+        self.pocket = pocket
+        self.in_rack = in_rack
+        self.seconds = seconds
+
+    def __repr__(self) -> str:
+        where = f'P{self.pocket}' if self.in_rack else 'MANUAL'
+        return f'line {self.line}: T{self.tool} M6 -> {where} {self.seconds:.1f}s'
+
+'''
+    The result of a scan. changes is filled in by ProgramScanner.evaluate() for the
+    current tool table and rack, the parsed tool list itself is cached by sha1.
+'''
+class ProgramScan():
+    def __init__(self, filename:str, sha1:str, size:int, lines:int, tools:list, unresolved:list) -> None:
+        self.filename = filename
+        self.sha1 = sha1
+        self.size = size
+        self.lines = lines
+        self.tools = tools # [(line, tool)] in program order, tool 0 = unload
+        self.unresolved = unresolved # line numbers of M6 with a T word that is not a plain number
+        self.changes = []
+        self.missing = []
+        self.seconds = 0.0
+        self.scan_ms = 0.0
+        self.cached = False
+
+    def format_summary(self) -> str:
+        lines = [f'{path.basename(self.filename)}: {len(self.changes)} tool changes, '
+                 f'estimated ATC time {self.seconds:.1f}s'
+                 f'{" (cached)" if self.cached else ""}, scan {self.scan_ms:.0f}ms']
+        if self.missing:
+            lines.append('NOT IN RACK: ' + ' '.join(f'T{t}' for t in self.missing))
+        if self.unresolved:
+            lines.append('T word not a number on line(s): ' + ' '.join(str(n) for n in self.unresolved[:20]))
+        lines.extend(repr(c) for c in self.changes)
+        return '\n'.join(lines)
+
+class ProgramScanner():
+    def __init__(self, cache_size:int = 8, chunk_size:int = 1 << 20) -> None:
+        self.cache = OrderedDict() # sha1 -> ProgramScan, least recently used first
+        self.hashes = {} # (filename, mtime_ns, size, ino) -> sha1
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+
+    def file_hash(self, filename:str, cancelled=None) -> str:
+        st = os.stat(filename)
+        key = (filename, st.st_mtime_ns, st.st_size, st.st_ino)
+        sha1 = self.hashes.get(key)
+        if sha1 is None:
+            h = hashlib.sha1()
+            with open(filename, 'rb') as file:
+                while chunk := file.read(self.chunk_size):
+                    if cancelled is not None and cancelled():
+                        raise ScanCancelled(filename)
+                    h.update(chunk)
+            sha1 = h.hexdigest()
+            self.hashes[key] = sha1
+        return sha1
+
+    def parse(self, filename:str, sha1:str, cancelled=None) -> ProgramScan:
+        '''
+            Stream the program and collect the tool of every M6. The T word may be on an
+            earlier line than the M6, M61 Qn sets the tool without a change.
+        '''
+        tools = []
+        unresolved = []
+        selected = None
+        lineno = 0
+        with open(filename, 'rb') as file:
+            for lineno, line in enumerate(file, 1):
+                if cancelled is not None and lineno & 0xffff == 0 and cancelled():
+                    raise ScanCancelled(filename)
+                # cheap test first, almost all lines of a program are moves
+                if b'M' not in line and b'm' not in line and b'T' not in line and b't' not in line:
+                    continue
+                line = line.split(b';', 1)[0]
+                if b'(' in line:
+                    line = COMMENT.sub(b'', line)
+                words = WORD.findall(line.upper().replace(b' ', b'').replace(b'\t', b''))
+                change = False
+                q = None
+                m61 = False
+                for letter, value in words:
+                    if not value:
+                        continue # a letter of an O-word name or parameter, not a word
+                    if letter == b'T':
+                        selected = int(float(value)) if _is_number(value) else -1
+                    elif letter == b'Q':
+                        q = value
+                    elif _is_number(value):
+                        code = float(value)
+                        if code == 6:
+                            change = True
+                        elif code == 61:
+                            m61 = True
+                if change:
+                    if selected is None or selected < 0:
+                        unresolved.append(lineno)
+                    else:
+                        tools.append((lineno, selected))
+                elif m61 and q is not None and _is_number(q):
+                    selected = int(float(q))
+        return ProgramScan(filename, sha1, path.getsize(filename), lineno, tools, unresolved)
+
+    def scan(self, filename:str, cancelled=None) -> ProgramScan:
+        start = time.perf_counter()
+        sha1 = self.file_hash(filename, cancelled)
+        result = self.cache.get(sha1)
+        if result is not None:
+            self.cache.move_to_end(sha1)
+            result.cached = True
+        else:
+            result = self.parse(filename, sha1, cancelled)
+            self.cache[sha1] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        result.filename = filename
+        result.scan_ms = (time.perf_counter() - start) * 1000
+        return result
+
+    @staticmethod
+    def evaluate(result:ProgramScan, pocket_of, planner:ToolChangePlanner, current_tool:int = 0) -> ProgramScan:
+        '''
+            Map the tools to pockets with pocket_of(tool) and estimate the ATC time of every change,
+            starting with current_tool in the spindle
+        '''
+        rack = planner.rack
+        pocket = lambda t: pocket_of(t) if t > 0 else 0
+        changes = []
+        missing = set()
+        current = current_tool
+        for lineno, tool in result.tools:
+            if tool == current:
+                continue
+            to_pocket = pocket(tool)
+            in_rack = rack.in_rack(to_pocket)
+            if tool > 0 and not in_rack:
+                missing.add(tool)
+            seconds = planner.change_time(pocket(current), to_pocket)
+            changes.append(ToolChange(lineno, tool, to_pocket, in_rack, seconds))
+            current = tool
+        result.changes = changes
+        result.missing = sorted(missing)
+        result.seconds = sum(c.seconds for c in changes)
+        return result
+
+def _is_number(value:bytes) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
@@ -0,0 +1,200 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Rack pocket occupancy. Which tool sits in which pocket is kept in a list indexed by pocket
+    (EMPTY, UNKNOWN or the tool number) with a tool -> pocket index next to it, so checking a
+    drop or pickup pocket before the ATC moves is a couple of list lookups. The state survives
+    a restart in a small binary file that only the handler writes.
+'''
+
+import struct
+import zlib
+
+from atc_tooltable import write_atomic
+
+EMPTY = 0
+UNKNOWN = -1
+
+# result of check_drop / check_pickup, published on rapid_atc.rack_check
+RACK_OK = 0
+DROP_OCCUPIED = 1
+PICKUP_EMPTY = 2
+PICKUP_OTHER = 3
+
+MESSAGES = {
+    RACK_OK: 'ok',
+    DROP_OCCUPIED: 'drop pocket already holds a tool',
+    PICKUP_EMPTY: 'pickup pocket is empty',
+    PICKUP_OTHER: 'pickup pocket holds another tool',
+}
+
+'''
+    The state file is a header (magic, version, sequence number, pocket count), one signed
+    32 bit word per pocket and a CRC32 of everything before it. It is written to a temporary
+    file, flushed to disk and renamed over the old one, so a crash leaves either the old or the
+    new state. A file that is short or fails the CRC is ignored and the rack is seeded again.
+'''
+MAGIC = b'RKOC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+CRC = struct.Struct('<I')
+
+class RackOccupancy():
+    def __init__(self, statepath:str = None, num_pockets:int = 0) -> None:
+        self.statepath = statepath
+        self.pockets = [UNKNOWN] * (num_pockets + 1) # index 0 is not a pocket
+        self.where = {} # tool -> pocket
+        self.version = 0 # bumped on every change, the handler redraws / rechecks on it
+        self.sequence = 0 # saves since the file was created
+
+    @property
+    def num_pockets(self) -> int:
+        return len(self.pockets) - 1
+
+    def in_rack(self, pocket:int) -> bool:
+        return 0 < pocket < len(self.pockets)
+
+    def tool_at(self, pocket:int) -> int:
+        return self.pockets[pocket] if self.in_rack(pocket) else UNKNOWN
+
+    def pocket_of(self, tool:int) -> int:
+        return self.where.get(tool, 0)
+
+    def set(self, pocket:int, tool:int) -> bool:
+        '''
+            Put tool (or EMPTY/UNKNOWN) in pocket, a tool is only ever in one pocket
+        '''
+        if not self.in_rack(pocket) or self.pockets[pocket] == tool:
+            return False
+        old = self.pockets[pocket]
+        if old > 0 and self.where.get(old) == pocket:
+            del self.where[old]
+        if tool > 0:
+            other = self.where.get(tool)
+            if other is not None:
+                self.pockets[other] = EMPTY
+            self.where[tool] = pocket
+        self.pockets[pocket] = tool
+        self.version += 1
+        return True
+
+    def dropped(self, pocket:int, tool:int) -> bool:
+        return self.set(pocket, tool)
+
+    def picked(self, pocket:int) -> bool:
+        return self.set(pocket, EMPTY)
+
+    def removed(self, tool:int) -> bool:
+        '''
+            tool is in the spindle or off the machine, whichever pocket it was in is empty now
+        '''
+        pocket = self.where.get(tool)
+        return pocket is not None and self.set(pocket, EMPTY)
+
+    def resize(self, num_pockets:int) -> bool:
+        if num_pockets == self.num_pockets or num_pockets < 0:
+            return False
+        for pocket in range(num_pockets + 1, len(self.pockets)):
+            self.set(pocket, EMPTY)
+        del self.pockets[num_pockets + 1:]
+        self.pockets.extend([UNKNOWN] * (num_pockets + 1 - len(self.pockets)))
+        self.version += 1
+        return True
+
+    def seed(self, pocket_tools:dict, spindle_tool:int = 0, pockets=None):
+        '''
+            What the tool table says: every pocket holds the tool assigned to it, except the pocket
+            of the tool in the spindle. pockets limits it to some pockets, e.g. the ones added by resize
+        '''
+        for pocket in (range(1, len(self.pockets)) if pockets is None else pockets):
+            tool = pocket_tools.get(pocket, EMPTY)
+            self.set(pocket, EMPTY if tool == spindle_tool and tool > 0 else tool)
+
+    def check_drop(self, pocket:int) -> int:
+        '''
+            RACK_OK unless pocket is known to hold a tool
+        '''
+        return DROP_OCCUPIED if self.tool_at(pocket) > 0 else RACK_OK
+
+    def check_pickup(self, pocket:int, tool:int) -> int:
+        '''
+            RACK_OK unless pocket is known to be empty or to hold a tool other than tool
+        '''
+        held = self.tool_at(pocket)
+        if held == EMPTY:
+            return PICKUP_EMPTY
+        if held > 0 and held != tool:
+            return PICKUP_OTHER
+        return RACK_OK
+
+    def pack(self) -> bytes:
+        n = self.num_pockets
+        data = HEADER.pack(MAGIC, VERSION, n, self.sequence) + struct.pack(f'<{n}i', *self.pockets[1:])
+        return data + CRC.pack(zlib.crc32(data))
+
+    def unpack(self, data:bytes) -> bool:
+        if len(data) < HEADER.size + CRC.size:
+            return False
+        magic, version, n, sequence = HEADER.unpack_from(data)
+        size = HEADER.size + 4 * n
+        if magic != MAGIC or version != VERSION or len(data) != size + CRC.size \
+                or CRC.unpack_from(data, size)[0] != zlib.crc32(data[:size]):
+            return False
+        self.pockets = [UNKNOWN] + list(struct.unpack_from(f'<{n}i', data, HEADER.size))
+        self.where = {tool: pocket for pocket, tool in enumerate(self.pockets) if pocket > 0 and tool > 0}
+        self.sequence = sequence
+        self.version += 1
+        return True
+
+    def load(self) -> bool:
+        '''
+            False when there is no usable state file, the caller seeds the rack then
+        '''
+        if self.statepath is None:
+            return False
+        try:
+            with open(self.statepath, 'rb') as file:
+                return self.unpack(file.read())
+        except OSError:
+            return False
+
+    def save(self):
+        if self.statepath is None:
+            return
+        self.sequence += 1
+        write_atomic(self.statepath, self.pack())
+
+    def format_rack(self, spindle_tool:int = None) -> str:
+        '''
+            One column per pocket, T<n> for a tool, -- for empty and ? for unknown
+        '''
+        def cell(tool:int) -> str:
+            return '--' if tool == EMPTY else '?' if tool == UNKNOWN else f'T{tool}'
+
+        pockets = range(1, len(self.pockets))
+        lines = ['POCKET ' + ''.join(f'{p:>5}' for p in pockets),
+                 'TOOL   ' + ''.join(f'{cell(self.pockets[p]):>5}' for p in pockets)]
+        if spindle_tool is not None:
+            lines.append(f'SPINDLE {cell(spindle_tool) if spindle_tool > 0 else "EMPTY"}')
+        return '\n'.join(lines)
@@ -0,0 +1,148 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Tool length measurement cache. The length measured by _auto_probe_tool is remembered per
+    tool and pocket with the time and the change count of the measurement, and the next change
+    to that tool can skip the probe while the entry is still trusted: same pocket, same length in
+    the tool table, same work Z offset, younger than max_age and fewer than max_changes changes ago,
+    and not invalidated by a manual tool change (M61). The probe result #5063 is a work coordinate,
+    so a length is only what the probe would measure again while the G5x + G92 Z offset is the one
+    it was measured with.
+'''
+
+import json
+import time
+
+from atc_tooltable import write_atomic
+
+LENGTH_TOLERANCE = 1e-4
+
+class CacheEntry():
+    __slots__ = ('tool', 'pocket', 'length', 'measured', 'change', 'invalid', 'z_offset')
+
+    def __init__(self, tool:int, pocket:int, length:float, measured:float, change:int, invalid:str = None,
+                 z_offset:float = 0.0) -> None:
+        self.tool = tool
+        self.pocket = pocket
+        self.length = length
+        self.measured = measured
+        self.change = change
+        self.invalid = invalid # why the entry may not be used, e.g. 'M61'
+        self.z_offset = z_offset # G5x + G92 Z offset the length was measured against
+
+    def to_json(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+'''
+    ToolLengthCache keeps the entries and the number of completed tool changes in one small
+    JSON file, rewritten atomically (temporary file + os.replace) whenever either changes.
+    max_age is in seconds and max_changes counts changes, 0 disables that rule.
+'''
+class ToolLengthCache():
+    def __init__(self, cachepath:str = None, max_age:float = 0.0, max_changes:int = 0) -> None:
+        self.cachepath = cachepath
+        self.max_age = max_age
+        self.max_changes = max_changes
+        self.entries = {}
+        self.changes = 0
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if self.cachepath is None:
+            return
+        try:
+            with open(self.cachepath, 'r') as file:
+                data = json.load(file)
+            self.changes = int(data.get('changes', 0))
+            for item in data.get('tools', []):
+                entry = CacheEntry(**item)
+                self.entries[entry.tool] = entry
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def save(self):
+        if self.cachepath is None:
+            return
+        data = {'changes': self.changes, 'tools': [e.to_json() for e in self.entries.values()]}
+        write_atomic(self.cachepath, json.dumps(data, separators=(',', ':')))
+
+    def count_change(self):
+        self.changes += 1
+
+    def record(self, tool:int, pocket:int, length:float, z_offset:float = 0.0, now:float = None) -> CacheEntry:
+        '''
+            A fresh measurement, counted as a miss
+        '''
+        now = time.time() if now is None else now
+        entry = self.entries[tool] = CacheEntry(tool, pocket, length, round(now, 3), self.changes,
+                                                z_offset=z_offset)
+        self.misses += 1
+        return entry
+
+    def hit(self):
+        self.hits += 1
+
+    def invalidate(self, tool:int, reason:str) -> bool:
+        entry = self.entries.get(tool)
+        if entry is None or entry.invalid:
+            return False
+        entry.invalid = reason
+        return True
+
+    def measured_z_offset(self, tool:int, length:float):
+        '''
+            The work Z offset length was measured at, None when length is not the cached measurement of tool
+        '''
+        entry = self.entries.get(tool)
+        if entry is None or length is None or abs(entry.length - length) > LENGTH_TOLERANCE:
+            return None
+        return entry.z_offset
+
+    def check(self, tool:int, pocket:int, length:float, z_offset:float = None, now:float = None) -> str:
+        '''
+            None when the cached length of tool can be used instead of probing, otherwise the reason it can not.
+            z_offset None skips the work offset rule.
+        '''
+        entry = self.entries.get(tool)
+        if entry is None:
+            return 'not measured'
+        if entry.invalid:
+            return entry.invalid
+        if entry.pocket != pocket:
+            return f'moved from pocket {entry.pocket}'
+        if length is None or abs(entry.length - length) > LENGTH_TOLERANCE:
+            return 'tool table length changed'
+        if z_offset is not None and abs(entry.z_offset - z_offset) > LENGTH_TOLERANCE:
+            return 'work Z offset changed'
+        now = time.time() if now is None else now
+        if self.max_age > 0 and now - entry.measured > self.max_age:
+            return 'expired'
+        if self.max_changes > 0 and self.changes - entry.change >= self.max_changes:
+            return f'{self.changes - entry.change} changes ago'
+        return None
+
+    def get_stats(self) -> dict:
+        return {'entries': len(self.entries), 'changes': self.changes, 'hits': self.hits, 'misses': self.misses}
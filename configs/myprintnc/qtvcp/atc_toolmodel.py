@@ -0,0 +1,286 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    The tool library table of the ATC page. ToolLibraryModel shows the ToolTableReader records,
+    with three things that keep it fast for a library of 1000+ tools:
+
+        - rows are handed to the view in batches as it scrolls (canFetchMore/fetchMore)
+        - the filter (tool number, pocket, comment words, rack only) is answered from a
+          ToolIndex instead of looking at every record
+        - refresh() compares the table with what is shown and applies the difference as row
+          inserts, removes and dataChanged, the view never repaints the whole table
+
+    It only needs QtCore, not LinuxCNC or a display.
+'''
+
+from bisect import bisect_left
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt
+
+from atc_tooltable import COMMENT
+
+BATCH = 100
+
+class ToolIndex():
+    '''
+        The tools sorted by number, with pocket -> tools and comment word -> tools
+    '''
+    def __init__(self, records:dict = None) -> None:
+        self.rebuild(records or {})
+
+    def rebuild(self, records:dict):
+        self.tools = sorted(records)
+        self.known = set(records)
+        self.by_pocket = {}
+        self.by_word = {}
+        for tool, record in records.items():
+            self.by_pocket.setdefault(record.pocket, set()).add(tool)
+            for word in record.comment.lower().split():
+                self.by_word.setdefault(word, set()).add(tool)
+        self.words = sorted(self.by_word)
+
+    def matches(self, term:str) -> set:
+        '''
+            Tools matching one search term: T<n> is a tool, P<n> a pocket, a plain number either
+            of them, anything else the start of a word of the comment
+        '''
+        term = term.lower()
+        if term[:1] in ('t', 'p') and term[1:].isdigit():
+            n = int(term[1:])
+            return ({n} & self.known) if term[0] == 't' else set(self.by_pocket.get(n, ()))
+        if term.isdigit():
+            n = int(term)
+            return ({n} & self.known) | self.by_pocket.get(n, set())
+        found = set()
+        for i in range(bisect_left(self.words, term), len(self.words)):
+            if not self.words[i].startswith(term):
+                break
+            found |= self.by_word[self.words[i]]
+        return found
+
+    def select(self, text:str = '', max_pocket:int = None) -> list:
+        '''
+            The tools matching every term of text, and in pockets 1..max_pocket when it is given
+        '''
+        selected = None
+        for term in text.split():
+            found = self.matches(term)
+            selected = found if selected is None else selected & found
+        if max_pocket is not None:
+            rack = set()
+            for pocket in range(1, max_pocket + 1):
+                rack |= self.by_pocket.get(pocket, set())
+            selected = rack if selected is None else selected & rack
+        return list(self.tools) if selected is None else sorted(selected)
+
+'''
+    Columns: the tool number (with the check box used by the tool buttons), then the tool table
+    words that can be edited in place. An edit is not applied to the model, it is emitted as
+    toolEdited(tool, letter, value) and shows up through refresh() once the table is written.
+'''
+class ToolLibraryModel(QtCore.QAbstractTableModel):
+    COLUMNS = (('Tool', 'T'), ('Pocket', 'P'), ('Z', 'Z'), ('Diameter', 'D'), ('Comment', COMMENT))
+    toolEdited = QtCore.pyqtSignal(int, str, object)
+
+    def __init__(self, reader, batch:int = BATCH, parent=None) -> None:
+        super().__init__(parent)
+        self.reader = reader
+        self.batch = batch
+        self.toolIndex = ToolIndex(reader.tools)
+        self.filterText = ''
+        self.rackOnly = False
+        self.numPockets = 0
+        self.rows = self.toolIndex.select()
+        self.loaded = min(batch, len(self.rows)) # rows the view knows about
+        self.checked = set()
+        self.shown = self.snapshot()
+
+    def snapshot(self) -> dict:
+        return {tool: (r.pocket, r.z, r.diameter, r.comment) for tool, r in self.reader.tools.items()}
+
+    # QAbstractTableModel
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()) -> bool:
+        return not parent.isValid() and self.loaded < len(self.rows)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        count = min(self.batch, len(self.rows) - self.loaded)
+        if parent.isValid() or count <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def headerData(self, section:int, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section][0]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        return flags | (Qt.ItemIsUserCheckable if index.column() == 0 else Qt.ItemIsEditable)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.loaded:
+            return None
+        tool = self.rows[index.row()]
+        column = index.column()
+        if role == Qt.CheckStateRole and column == 0:
+            return Qt.Checked if tool in self.checked else Qt.Unchecked
+        if role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        record = self.reader.tools.get(tool)
+        if record is None:
+            return None
+        letter = self.COLUMNS[column][1]
+        if letter == COMMENT:
+            return record.comment
+        value = record.get(letter)
+        if value is None:
+            return ''
+        return f'{value:.4f}' if isinstance(value, float) and role == Qt.DisplayRole else value
+
+    def setData(self, index, value, role=Qt.EditRole) -> bool:
+        if not index.isValid() or index.row() >= self.loaded:
+            return False
+        tool = self.rows[index.row()]
+        if role == Qt.CheckStateRole and index.column() == 0:
+            if value == Qt.Checked:
+                self.checked.add(tool)
+            else:
+                self.checked.discard(tool)
+            self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+            return True
+        if role != Qt.EditRole or index.column() == 0:
+            return False
+        letter = self.COLUMNS[index.column()][1]
+        try:
+            if letter == COMMENT:
+                value = str(value).strip()
+            elif letter == 'P':
+                value = int(value)
+                # a negative pocket drops the tool on the next load, a shared rack pocket breaks
+                # pocket -> tool, any number of tools can be off the rack in P0
+                if value < 0 or (value > 0 and self.toolIndex.by_pocket.get(value, set()) - {tool}):
+                    return False
+            else:
+                value = float(value) if str(value).strip() else None
+        except ValueError:
+            return False
+        self.toolEdited.emit(tool, letter, value)
+        return True
+
+    # filter
+    def setFilter(self, text:str = None, rack_only:bool = None, num_pockets:int = None):
+        '''
+            Change any of the filter text, rack only and the rack size, the view is reset
+        '''
+        text = self.filterText if text is None else text
+        rack_only = self.rackOnly if rack_only is None else bool(rack_only)
+        num_pockets = self.numPockets if num_pockets is None else int(num_pockets)
+        if (text, rack_only) == (self.filterText, self.rackOnly) and (num_pockets == self.numPockets or not rack_only):
+            self.numPockets = num_pockets
+            return
+        self.filterText, self.rackOnly, self.numPockets = text, rack_only, num_pockets
+        self.beginResetModel()
+        self.rows = self.select()
+        self.loaded = min(self.batch, len(self.rows))
+        self.endResetModel()
+
+    def select(self) -> list:
+        return self.toolIndex.select(self.filterText, self.numPockets if self.rackOnly else None)
+
+    # check boxes
+    def checkedTools(self) -> list:
+        return sorted(self.checked)
+
+    def setChecked(self, tools):
+        self.checked = set(tools) & self.toolIndex.known
+        if self.loaded:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.loaded - 1, 0), [Qt.CheckStateRole])
+
+    # incremental updates
+    def refresh(self):
+        '''
+            Bring the rows in line with the reader: remove and insert the rows of the tools that
+            left or joined the selection and signal dataChanged for the ones whose values changed
+        '''
+        self.toolIndex.rebuild(self.reader.tools)
+        shown = self.snapshot()
+        rows = self.select()
+        keep = set(rows)
+        row = len(self.rows) - 1
+        while row >= 0:
+            if self.rows[row] in keep:
+                row -= 1
+                continue
+            last = row
+            while row >= 0 and self.rows[row] not in keep:
+                row -= 1
+            self.removeRun(row + 1, last)
+        present = set(self.rows)
+        row = 0
+        while row < len(rows):
+            if rows[row] in present:
+                row += 1
+                continue
+            first = row
+            while row < len(rows) and rows[row] not in present:
+                row += 1
+            self.insertRun(first, rows[first:row])
+        last_column = len(self.COLUMNS) - 1
+        for row in range(self.loaded):
+            tool = self.rows[row]
+            if tool in self.shown and self.shown[tool] != shown[tool]:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, last_column))
+        self.checked &= self.toolIndex.known
+        self.shown = shown
+
+    def removeRun(self, first:int, last:int):
+        if first >= self.loaded:
+            del self.rows[first:last + 1]
+            return
+        visible = min(last, self.loaded - 1)
+        self.beginRemoveRows(QtCore.QModelIndex(), first, visible)
+        del self.rows[first:last + 1]
+        self.loaded -= visible - first + 1
+        self.endRemoveRows()
+
+    def insertRun(self, first:int, tools:list):
+        # rows past the fetched ones arrive with fetchMore, except at the very end of the table
+        if first > self.loaded or (first == self.loaded and self.loaded < len(self.rows)):
+            self.rows[first:first] = tools
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(tools) - 1)
+        self.rows[first:first] = tools
+        self.loaded += len(tools)
+        self.endInsertRows()
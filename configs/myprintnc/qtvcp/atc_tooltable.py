@@ -0,0 +1,242 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    LinuxCNC tool table (tool.tbl) reader and writer. Every column of the format is kept:
+
+        T<tool> P<pocket> X Y Z A B C U V W <offsets> D<diameter> I<front angle> J<back angle>
+        Q<orientation> ;comment
+
+    Everything after the first ; is the comment, it may contain further ; characters. Blank
+    and comment-only lines are skipped, malformed lines are reported and skipped rather than
+    failing the whole table. Tables are read a line at a time, and update_tool_table rewrites
+    only the lines of the tools it changes, the others are copied as they are.
+'''
+
+import os
+import stat
+import tempfile
+from os import path
+
+# word letter -> ToolRecord slot, in the order LinuxCNC writes them
+OFFSETS = 'XYZABCUVW'
+COLUMNS = {'T': 'tool', 'P': 'pocket', **{c: c.lower() for c in OFFSETS},
+           'D': 'diameter', 'I': 'frontangle', 'J': 'backangle', 'Q': 'orientation'}
+INTEGER = 'TPQ'
+COMMENT = ';' # key of the comment in the values of update_line / update_tool_table
+INTEGER_SLOTS = {COLUMNS[letter] for letter in INTEGER}
+SLOTS = {**COLUMNS, **{letter.lower(): slot for letter, slot in COLUMNS.items()}}
+
+class ToolTableError(ValueError):
+    pass
+
+class ToolRecord():
+    '''
+        One tool, a column missing from the line is None
+    '''
+    __slots__ = ('tool', 'pocket', 'x', 'y', 'z', 'a', 'b', 'c', 'u', 'v', 'w',
+                 'diameter', 'frontangle', 'backangle', 'orientation', 'comment', 'lineno')
+
+    def __init__(self, tool:int, pocket:int = 0, x:float = None, y:float = None, z:float = None,
+                 a:float = None, b:float = None, c:float = None, u:float = None, v:float = None, w:float = None,
+                 diameter:float = None, frontangle:float = None, backangle:float = None, orientation:int = None,
+                 comment:str = '', lineno:int = None) -> None:
+        self.tool = tool
+        self.pocket = pocket
+        self.x, self.y, self.z = x, y, z
+        self.a, self.b, self.c = a, b, c
+        self.u, self.v, self.w = u, v, w
+        self.diameter = diameter
+        self.frontangle = frontangle
+        self.backangle = backangle
+        self.orientation = orientation
+        self.comment = comment
+        self.lineno = lineno
+
+    def __repr__(self) -> str:
+        return f'<ToolRecord {format_words(self.words())}>'
+
+    def get(self, letter:str):
+        return getattr(self, COLUMNS[letter.upper()])
+
+    def set(self, letter:str, value):
+        setattr(self, COLUMNS[letter.upper()], value)
+
+    def words(self) -> list:
+        '''
+            (letter, value) of the columns present, in LinuxCNC order
+        '''
+        return [(letter, value) for letter, value in ((l, self.get(l)) for l in COLUMNS) if value is not None]
+
+def format_value(letter:str, value) -> str:
+    return f'{letter}{int(value)}' if letter in INTEGER else f'{letter}{float(value):+f}'
+
+def format_words(words:list, comment:str = '') -> str:
+    '''
+        The layout of tool.tbl, T and P padded to a column
+    '''
+    text = ' '.join(f'{format_value(l, v):<4}' if l in 'TP' else format_value(l, v) for l, v in words)
+    return f'{text} ;{comment}' if comment else text.rstrip()
+
+def format_record(record:ToolRecord) -> str:
+    return format_words(record.words(), record.comment) + '\n'
+
+def split_line(line:str) -> tuple:
+    '''
+        ([(letter, value)], comment) of one line, the values as they are written
+    '''
+    params, sep, comment = line.partition(';')
+    words = []
+    for word in params.split():
+        letter = word[0].upper()
+        if letter not in COLUMNS or len(word) < 2:
+            raise ToolTableError(f'unknown word {word!r}')
+        words.append((letter, word[1:]))
+    return words, comment.strip()
+
+def parse_line(line:str, lineno:int = None) -> ToolRecord:
+    '''
+        The tool on line, None for a blank or comment-only line, ToolTableError when it is malformed
+    '''
+    params, _, comment = line.partition(';')
+    words = params.split()
+    if not words:
+        return None
+    if words[0][0] not in 'Tt':
+        raise ToolTableError('line does not start with a T word')
+    values = {}
+    for word in words:
+        slot = SLOTS.get(word[0])
+        if slot is None or len(word) < 2:
+            raise ToolTableError(f'unknown word {word!r}')
+        if slot in values:
+            raise ToolTableError(f'{word[0].upper()} given twice')
+        try:
+            values[slot] = int(word[1:]) if slot in INTEGER_SLOTS else float(word[1:])
+        except ValueError:
+            raise ToolTableError(f'bad number {word}') from None
+    if values['tool'] <= 0 or values.get('pocket', -1) < 0:
+        raise ToolTableError('a tool needs a tool number above 0 and a pocket')
+    return ToolRecord(comment=comment.strip(), lineno=lineno, **values)
+
+def iter_tools(tooltable:str, errors:list = None):
+    '''
+        Yield the tools of tooltable one at a time. Malformed lines are skipped, with
+        (line number, line, reason) appended to errors when it is given.
+    '''
+    with open(tooltable, 'r') as file:
+        for lineno, line in enumerate(file, 1):
+            try:
+                record = parse_line(line, lineno)
+            except ToolTableError as e:
+                if errors is not None:
+                    errors.append((lineno, line.rstrip('\n'), str(e)))
+                continue
+            if record is not None:
+                yield record
+
+def load_tools(tooltable:str, errors:list = None) -> dict:
+    '''
+        {tool: ToolRecord}, a later line for the same tool replaces an earlier one like in LinuxCNC
+    '''
+    return {record.tool: record for record in iter_tools(tooltable, errors)}
+
+def update_line(line:str, values:dict) -> str:
+    '''
+        line with the columns in values ({letter: value}, None removes the column) replaced in
+        place, new columns appended and the comment kept unless values has a COMMENT
+    '''
+    words, comment = split_line(line)
+    values = {l.upper(): v for l, v in values.items()}
+    comment = values.pop(COMMENT, comment)
+    out = [(l, values.pop(l) if l in values else v) for l, v in words]
+    out.extend(values.items())
+    return format_words([(l, v) for l, v in out if v is not None], comment) + '\n'
+
+def write_atomic(filename:str, data):
+    '''
+        Write data (text, bytes or an iterable of lines) to a temporary file next to filename, flush
+        it to disk and rename it over filename, so readers see either the old file or the new one.
+        A symlink is followed and stays a symlink, the file keeps its permissions (mkstemp would
+        leave it 0600) and a new file gets 0644.
+    '''
+    target = path.realpath(filename)
+    try:
+        mode = stat.S_IMODE(os.stat(target).st_mode)
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(prefix=f'.{path.basename(target)}.', suffix='.tmp', dir=path.dirname(target))
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as file:
+            if isinstance(data, (str, bytes)):
+                file.write(data)
+            else:
+                file.writelines(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def update_tool_table(tooltable:str, changes:dict) -> set:
+    '''
+        Apply changes, {tool: {letter: value}}, to tooltable. Only the lines of those tools are
+        rewritten, tools that are not in the table are appended (they need a P value) and a tool
+        whose values are None is deleted. Returns the tools that were appended.
+    '''
+    found = set()
+
+    def lines():
+        with open(tooltable, 'r') as file:
+            for line in file:
+                try:
+                    record = parse_line(line)
+                except ToolTableError:
+                    record = None
+                if record is not None and record.tool in changes:
+                    found.add(record.tool)
+                    if changes[record.tool] is not None:
+                        yield update_line(line, changes[record.tool])
+                else:
+                    yield line
+        for tool in sorted(set(changes) - found):
+            if changes[tool] is not None:
+                yield format_record(new_record(tool, changes[tool]))
+
+    write_atomic(tooltable, lines())
+    return {tool for tool in set(changes) - found if changes[tool] is not None}
+
+def new_record(tool:int, values:dict) -> ToolRecord:
+    record = ToolRecord(tool, comment=values.get(COMMENT, ''))
+    for letter, value in values.items():
+        if letter != COMMENT:
+            record.set(letter, value)
+    return record
+
+def write_tools(tooltable:str, records):
+    '''
+        Write a whole table from ToolRecords, in the order given
+    '''
+    write_atomic(tooltable, (format_record(record) for record in records))
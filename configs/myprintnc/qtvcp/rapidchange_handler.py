@@ -22,132 +22,891 @@
 # SOFTWARE.
 
 from enum import StrEnum
+import os
 from os import path
-import debugpy
 import linuxcnc
 import sys
+import time
+import queue
+import threading
+import json
+import io
+import configparser
+from collections import deque
 import hal
 #from subprocess import PIPE, Popen
 #import emccanon
 
-# 5678 is the default attach port in the VS Code debug configurations. Unless a host and port are specified, host defaults to 127.0.0.1
-debugpy.listen(('0.0.0.0',5678))
-#print("Waiting for debugger attach")
-#debugpy.wait_for_client()
-#debugpy.breakpoint()
-#print('break on this line')
-
 # Set up logging
 from qtvcp import logger
 from qtvcp.core import Info, Status, Qhal, Action
 
-from PyQt5 import QtGui
+from PyQt5 import QtGui, QtCore
+
+from atc_planner import RackGeometry, MotionModel, MacroTimings, ToolChangePlanner
+from atc_prescan import ProgramScanner, ScanCancelled
+from atc_layout import PocketLayoutOptimizer, write_tool_table
+from atc_params import AtcHalPin, ConfigElement, ParamRegistry, build_params
+from atc_log import LogHub
+from atc_toolcache import ToolLengthCache
+from atc_tooltable import COMMENT, load_tools, new_record, update_tool_table, write_atomic
+from atc_toolmodel import ToolLibraryModel
+from atc_rack import RackOccupancy, EMPTY, UNKNOWN, RACK_OK, MESSAGES as RACK_MESSAGES
+from atc_batch import BatchPlanner, BatchRun, BatchStep, VERIFY, MEASURE, CYCLE
 
-log = logger.getLogger(__name__)
+# every subsystem logs to a child of rapid_atc, levels come from [RAPID_ATC] LOG_LEVEL(_<SUBSYSTEM>)
+LOGS = LogHub(logger.getLogger('rapid_atc'))
+log = LOGS.base
+status_log = LOGS.getLogger('status')
+mdi_log = LOGS.getLogger('mdi')
+prescan_log = LOGS.getLogger('prescan')
+prefs_log = LOGS.getLogger('prefs')
+profiler_log = LOGS.getLogger('profiler')
+periodic_log = LOGS.getLogger('periodic')
+layout_log = LOGS.getLogger('layout')
+cache_log = LOGS.getLogger('cache')
+rack_log = LOGS.getLogger('rack')
+batch_log = LOGS.getLogger('batch')
 
 INFO = Info()
 STATUS = Status()
 QHAL = Qhal()
 ACTION = Action()
 
-# Set the log level for this module
-log.setLevel(logger.DEBUG) # One of DEBUG, INFO, WARNING, ERROR, CRITICAL
+'''
+    Debugger attach is opt-in, debugpy is only imported (and a port opened) when it is asked for
+    with [RAPID_ATC] DEBUGPY = 1 in the INI or RAPID_ATC_DEBUGPY=1 in the environment. The
+    environment variable may also be host:port and overrides the INI, 0 turns it off.
+    5678 is the default attach port in the VS Code debug configurations.
+'''
+DEBUGPY_ENV = 'RAPID_ATC_DEBUGPY'
+
+def debugpy_address(ini) -> tuple:
+    host = ini.find('RAPID_ATC', 'DEBUGPY_HOST') or '127.0.0.1'
+    port = int(ini.find('RAPID_ATC', 'DEBUGPY_PORT') or 5678)
+    setting = os.environ.get(DEBUGPY_ENV)
+    if setting is None:
+        setting = ini.find('RAPID_ATC', 'DEBUGPY') or '0'
+    setting = setting.strip()
+    if ':' in setting:
+        host, port = setting.rsplit(':', 1)
+        return (host or '127.0.0.1', int(port))
+    if setting.lower() in ('', '0', 'no', 'false', 'off'):
+        return None
+    return (host, port)
+
+def start_debugpy(ini) -> bool:
+    try:
+        address = debugpy_address(ini)
+    except ValueError as detail:
+        log.error(f'Bad debugpy setting: {detail}')
+        return False
+    if address is None:
+        return False
+    try:
+        import debugpy
+        debugpy.listen(address)
+    except Exception as detail: # ImportError, or the port is already taken
+        log.error(f'Unable to start debugpy on {address[0]}:{address[1]}: {detail}')
+        return False
+    log.info(f'debugpy listening on {address[0]}:{address[1]}')
+    if (ini.find('RAPID_ATC', 'DEBUGPY_WAIT') or '0') == '1':
+        log.info('Waiting for debugger attach')
+        debugpy.wait_for_client()
+    return True
+
+LOGS.configure(INFO.INI)
+
+start_debugpy(INFO.INI)
 
 key_index = 0
 comp_input_index = 1
 default_value = 2
 
-class ToolEntry():
-    def __init__(self, line:str) -> None:
-        self.params, self.comment = line.split(';')
-        self.params = self.params.split()
-        self.id = self.params[0]
-        self.pocket = self.params[1]
-        
 '''
     ToolTableReader bypasses a bug in LinuxCNC that prevents tool pockets from being identified.
+    The table is only re-parsed when the file's mtime, size or inode changes, so calling
+    load_tool_db() on an unchanged table costs a single stat() call. update() changes single
+    tools through atc_tooltable, only their lines are rewritten.
 '''
 class ToolTableReader():
     def __init__(self, tooldb:str) -> None:
-        self.tools = []
+        self.tools = {} # tool -> atc_tooltable.ToolRecord
+        self.tool_to_pocket = {}
+        self.pocket_to_tool = {}
+        self.tool_to_length = {}
         self.tooldbpath = tooldb
+        self.signature = None
+        self.reload_count = 0
+        self.errors = [] # (line number, line, reason) of the malformed lines
         self.load_tool_db()
+
+    def file_signature(self):
+        st = os.stat(self.tooldbpath)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
     
-    def load_tool_db(self):
-        self.tools.clear()
-        file = open(self.tooldbpath, 'r')
-        lns = file.readlines()
-        for line in lns:
-            self.tools.append(ToolEntry(line))
+    def load_tool_db(self, force:bool = False) -> bool:
+        try:
+            sig = self.file_signature()
+        except OSError as detail:
+            status_log.error(f'Unable to stat tool table {self.tooldbpath}: {detail}')
+            return False
+        if not force and sig == self.signature:
+            return False
+        errors = []
+        try:
+            tools = load_tools(self.tooldbpath, errors)
+        except OSError as detail:
+            status_log.error(f'Unable to read tool table {self.tooldbpath}: {detail}')
+            return False
+        for lineno, line, reason in errors:
+            status_log.warning(f'{self.tooldbpath}:{lineno} skipped, {reason}: {line}')
+        self.tools = tools
+        self.errors = errors
+        self.index()
+        self.signature = sig
+        self.reload_count += 1
+        return True
+
+    def index(self):
+        self.tool_to_pocket = {}
+        self.pocket_to_tool = {}
+        self.tool_to_length = {}
+        for toolno, tool in self.tools.items():
+            self.tool_to_pocket[toolno] = tool.pocket
+            self.pocket_to_tool[tool.pocket] = toolno
+            if tool.z is not None:
+                self.tool_to_length[toolno] = tool.z
+
+    def update(self, changes:dict):
+        '''
+            Write changes, {tool: {letter: value}} e.g. {3: {'P': 5}} or {3: None} to delete T3,
+            to the table and to the records in memory without parsing the table again
+        '''
+        update_tool_table(self.tooldbpath, changes)
+        for toolno, values in changes.items():
+            tool = self.tools.get(toolno)
+            if values is None:
+                self.tools.pop(toolno, None)
+            elif tool is None:
+                self.tools[toolno] = new_record(toolno, values)
+            else:
+                for letter, value in values.items():
+                    if letter == COMMENT:
+                        tool.comment = value
+                    else:
+                        tool.set(letter, value)
+        self.index()
+        self.signature = self.file_signature()
     
     def get_tool_pocket(self, toolid:int) -> int:
-        for tool in self.tools:
-            if tool.id == f'T{str(toolid)}':
-                return int(tool.pocket[1:])
-        return -1
+        return self.tool_to_pocket.get(int(toolid), -1)
+
+    def get_pocket_tool(self, pocket:int) -> int:
+        return self.pocket_to_tool.get(int(pocket), -1)
+
+    def get_tool_length(self, toolid:int):
+        return self.tool_to_length.get(int(toolid))
     
     def get_tools(self) -> dict:
-        ret = {}
-        for tool in self.tools:
-            ret[tool.id] = int(tool.pocket[1:])
-        return ret
+        return {f'T{k}': v for k, v in self.tool_to_pocket.items()}
 
-      
-class AtcHalPin(StrEnum):
-    SAFE_Z = 'safe_z'
-    Z_IR_ENGAGE = 'z_ir_engage'
-    NUM_POCKETS = 'num_pockets'
-    POCKET_OFFSET = 'pocket_offset'
-    FIRST_POCKET_X = 'first_pocket_x'
-    FIRST_POCKET_Y = 'first_pocket_y'
-    ENGAGE_Z =  'engage_z'
-    ENGAGE_Z_DROP_OFFSET = 'engage_z_drop_offset'
-    ALIGN_AXIS = 'align_axis'
-    #ALIGN_DIR = 'align_dir'
-    IR_HAL_DPIN = 'ir_hal_dpin'
-    COVER_HAL_DPIN = 'cover_hal_dpin'
-    DROP_RATE = 'drop_feed_rate'
-    PICKUP_RATE = 'pickup_feed_rate'
-    SPINDLE_SPEED_PICKUP = 'spindle_speed_pickup'
-    SPINDLE_SPEED_DROP = 'spindle_speed_drop'
-    X_MANUAL_CHANGE_POS = 'x_manual_change_pos'
-    Y_MANUAL_CHANGE_POS = 'y_manual_change_pos'
-    CURRENT_TOOL_POCKET = 'current_tool_pocket'
-    #TOOL_INDEX = 'tool_'
-    IR_ENABLED = 'ir_enabled'
-    COVER_ENABLED = 'cover_enabled'
-    DUST_COVER_STATE = 'dust_cover_state'
-    def __str__(self) -> str:
-        return self.value
-
-class ConfigElement(StrEnum):
-    ATC_SECTION = 'RAPID_ATC'
-    NUM_POCKETS = 'num_pockets'
-    POCKET_OFFSET = 'pocket_offset'
-    FIRST_POCKET_X = 'first_pocket_x'
-    FIRST_POCKET_Y = 'first_pocket_y'
-    Z_ENGAGE = 'z_engage'
-    Z_ENGAGE_DROP_OFFSET = 'z_engage_drop_offset'
-    Z_IR_ENGAGE = 'z_ir_engage'
-    COVER_HAL_DPIN = 'cover_hal_dpin'
-    IR_HAL_DPIN = 'ir_hal_dpin'
-    Z_SAFE_CLEARANCE = 'z_safe_clearance'
-    X_MANUAL_CHANGE_POS = 'x_manual_change_pos'
-    Y_MANUAL_CHANGE_POS = 'y_manual_change_pos'
-    ALIGN_AXIS = 'align_axis'
-    #ALIGN_DIR = 'align_dir'
-    PICKUP_RATE = 'pickup_rate'
-    DROP_RATE = 'drop_rate'
-    SPINDLE_SPEED_PICKUP = 'spindle_speed_pickup'
-    SPINDLE_SPEED_DROP = 'spindle_speed_drop'
-    IR_ENABLED = 'ir_enabled'
-    COVER_ENABLED = 'cover_enabled'
-    
-    def __str__(self) -> str:
-        return self.value
-    
-    
+'''
+    ToolTableWatcher reloads a ToolTableReader when the table changes on disk, so the periodic
+    cycle never has to look at the file. QFileSystemWatcher (inotify on Linux) watches the table
+    and its directory: LinuxCNC and atc_tooltable replace the table by renaming a new file over
+    it, which drops the watch on the file itself, it is added again after every reload.
+    Events closer together than debounce_ms are coalesced into one reload, and tableChanged
+    is only emitted when the reload finds the file's signature changed.
+'''
+class ToolTableWatcher(QtCore.QObject):
+    tableChanged = QtCore.pyqtSignal()
+
+    def __init__(self, reader:ToolTableReader, debounce_ms:int = 250) -> None:
+        super().__init__()
+        self.reader = reader
+        self.directory = path.dirname(path.abspath(reader.tooldbpath))
+        self.events = 0
+        self.reloads = 0
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.onEvent)
+        self.watcher.directoryChanged.connect(self.onEvent)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce_ms)
+        self.timer.timeout.connect(self.reload)
+        self.watch()
+
+    @property
+    def active(self) -> bool:
+        return self.directory in self.watcher.directories()
+
+    def watch(self):
+        watched = set(self.watcher.files()) | set(self.watcher.directories())
+        missing = [p for p in (self.reader.tooldbpath, self.directory) if p not in watched and path.exists(p)]
+        if missing:
+            self.watcher.addPaths(missing)
+
+    def onEvent(self, changed:str):
+        self.events += 1
+        self.timer.start() # restart the debounce
+
+    def reload(self):
+        self.timer.stop()
+        self.watch()
+        if self.reader.load_tool_db():
+            self.reloads += 1
+            self.tableChanged.emit()
+
+    def poll(self):
+        '''
+            Only needed when nothing could be watched, e.g. no inotify instances left
+        '''
+        if not self.active:
+            self.reload()
+
+    def stop(self):
+        self.timer.stop()
+        watched = self.watcher.files() + self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+
+    def get_stats(self) -> dict:
+        return {'active': self.active, 'events': self.events, 'reloads': self.reloads,
+                'table_reloads': self.reader.reload_count}
+
+'''
+    StatusChannel keeps one long-lived linuxcnc.stat connection for the whole handler.
+    It is polled once per periodic cycle and every consumer reads the resulting snapshot,
+    rather than opening and polling a fresh status channel of its own.
+'''
+class StatusChannel():
+    def __init__(self, budget_ms:float = 100.0) -> None:
+        self.stat = linuxcnc.stat() # create a single connection to the status channel
+        self.budget_ms = budget_ms
+        self.poll_count = 0
+        self.poll_errors = 0
+        self.last_poll_ms = 0.0
+        self.max_poll_ms = 0.0
+        self.total_poll_ms = 0.0
+        self.tick_count = 0
+        self.last_tick_ms = 0.0
+        self.max_tick_ms = 0.0
+        self.total_tick_ms = 0.0
+        self.ticks_over_budget = 0
+
+    def poll(self):
+        start = time.perf_counter()
+        try:
+            self.stat.poll() # get current values
+        except linuxcnc.error as detail:
+            self.poll_errors += 1
+            status_log.error(f'Error polling status channel: {detail}')
+        elapsed = (time.perf_counter() - start) * 1000.0
+        self.poll_count += 1
+        self.last_poll_ms = elapsed
+        self.total_poll_ms += elapsed
+        self.max_poll_ms = max(self.max_poll_ms, elapsed)
+        return self.stat
+
+    def snapshot(self):
+        # Consumers outside the periodic cycle (button callbacks) read the last poll.
+        # Only poll here if the periodic cycle has not run yet.
+        if self.poll_count == 0:
+            return self.poll()
+        return self.stat
+
+    def record_tick(self, elapsed_ms:float):
+        self.tick_count += 1
+        self.last_tick_ms = elapsed_ms
+        self.total_tick_ms += elapsed_ms
+        self.max_tick_ms = max(self.max_tick_ms, elapsed_ms)
+        if elapsed_ms > self.budget_ms:
+            self.ticks_over_budget += 1
+
+    def get_stats(self) -> dict:
+        return {
+            'poll_count': self.poll_count,
+            'poll_errors': self.poll_errors,
+            'last_poll_ms': self.last_poll_ms,
+            'max_poll_ms': self.max_poll_ms,
+            'avg_poll_ms': self.total_poll_ms / self.poll_count if self.poll_count else 0.0,
+            'tick_count': self.tick_count,
+            'last_tick_ms': self.last_tick_ms,
+            'max_tick_ms': self.max_tick_ms,
+            'avg_tick_ms': self.total_tick_ms / self.tick_count if self.tick_count else 0.0,
+            'budget_ms': self.budget_ms,
+            'ticks_over_budget': self.ticks_over_budget,
+        }
+
+MOTION_DIO_MAX = 64 # motmod num_dio upper limit
+
+def motion_dio_pin(direction:str, n:int) -> str:
+    '''
+        motion.digital-in-NN / motion.digital-out-NN, motmod always numbers them with two digits
+    '''
+    n = int(n)
+    if not 0 <= n < MOTION_DIO_MAX:
+        raise ValueError(f'motion.digital-{direction} pin {n} is outside 0..{MOTION_DIO_MAX - 1}')
+    return f'motion.digital-{direction}-{n:02d}'
+
+'''
+    HalPins binds the pins of other components the handler monitors (motion, halui, iocontrol)
+    to short keys. A pin name is formatted and checked once when it is bound and again only when
+    its DPIN setting changes. read() takes one snapshot of every bound pin per periodic cycle and
+    the consumers use that snapshot instead of looking the pins up themselves.
+'''
+class HalPins():
+    def __init__(self, reader=hal.get_value) -> None:
+        self.reader = reader
+        self.names = {} # key -> pin name
+        self.values = {} # key -> value at the last read
+        self.rebinds = 0
+        self.read_count = 0
+        self.read_errors = 0
+        self.pin_reads = 0
+        self.last_read_ms = 0.0
+        self.max_read_ms = 0.0
+        self.total_read_ms = 0.0
+
+    def bind(self, key:str, name:str) -> bool:
+        if self.names.get(key) == name:
+            return False
+        if key in self.names:
+            self.rebinds += 1
+        self.names[key] = name
+        self.values.pop(key, None)
+        return True
+
+    def unbind(self, key:str):
+        if self.names.pop(key, None) is not None:
+            self.rebinds += 1
+        self.values.pop(key, None)
+
+    def read(self) -> dict:
+        start = time.perf_counter()
+        try:
+            values = {key: self.reader(name) for key, name in self.names.items()}
+        except Exception:
+            self.read_errors += 1
+            raise
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            self.read_count += 1
+            self.pin_reads += len(self.names)
+            self.last_read_ms = elapsed
+            self.total_read_ms += elapsed
+            self.max_read_ms = max(self.max_read_ms, elapsed)
+        self.values = values
+        return values
+
+    def get(self, key:str, default=None):
+        # value at the last read, unbound pins are default
+        return self.values.get(key, default)
+
+    def read_one(self, key:str):
+        # for button callbacks that need the pin as it is now, not at the last tick
+        return self.reader(self.names[key])
+
+    def get_stats(self) -> dict:
+        return {
+            'pins': dict(self.names),
+            'rebinds': self.rebinds,
+            'read_count': self.read_count,
+            'read_errors': self.read_errors,
+            'last_read_ms': self.last_read_ms,
+            'max_read_ms': self.max_read_ms,
+            'avg_read_ms': self.total_read_ms / self.read_count if self.read_count else 0.0,
+            'avg_pin_ms': self.total_read_ms / self.pin_reads if self.pin_reads else 0.0,
+        }
+
+'''
+    MdiExecutor runs MDI commands (the ATC macros) on a background thread so the Qt event
+    loop and the periodic update keep running while a tool change is in progress.
+    Jobs are queued and executed in order on one reused linuxcnc.command channel.
+    Results are delivered back on the GUI thread through Qt signals.
+'''
+class MdiExecutor(QtCore.QObject):
+    jobStarted = QtCore.pyqtSignal(int, str)
+    jobCompleted = QtCore.pyqtSignal(int, str)
+    jobFailed = QtCore.pyqtSignal(int, str, str)
+    jobCancelled = QtCore.pyqtSignal(int, str)
+
+    MDI = 'mdi'
+    LOAD_TOOL_TABLE = 'load_tool_table'
+
+    def __init__(self, timeout:float = 600.0, poll_interval:float = 0.05) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.command = linuxcnc.command()
+        self.stat = linuxcnc.stat() # worker thread's own status channel
+        self.jobs = queue.Queue()
+        self.callbacks = {}
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.current = None
+        self.cancelEvent = threading.Event()
+        self.jobCompleted.connect(self.dispatchCompleted)
+        self.jobFailed.connect(self.dispatchFailed)
+        self.jobCancelled.connect(self.dispatchCancelled)
+        self.worker = threading.Thread(target=self.run, name='rapid_atc_mdi', daemon=True)
+        self.worker.start()
+
+    @property
+    def busy(self) -> bool:
+        return self.current is not None or not self.jobs.empty()
+
+    def submit(self, s:str, on_complete=None, on_error=None, kind:str = MDI) -> int:
+        with self.lock:
+            job_id = self.next_id
+            self.next_id += 1
+            self.pending.add(job_id)
+        self.callbacks[job_id] = (on_complete, on_error)
+        self.jobs.put((job_id, kind, s))
+        return job_id
+
+    def load_tool_table(self, on_complete=None, on_error=None) -> int:
+        return self.submit('load_tool_table', on_complete, on_error, kind=MdiExecutor.LOAD_TOOL_TABLE)
+
+    def cancel(self, job_id:int = None):
+        '''
+            Cancel a queued job, or the running job (which is aborted), or everything if job_id is None
+        '''
+        with self.lock:
+            if job_id is None:
+                self.pending.clear()
+            else:
+                self.pending.discard(job_id)
+            current = self.current
+        if current is not None and (job_id is None or current == job_id):
+            self.cancelEvent.set()
+
+    def stop(self):
+        self.cancel()
+        self.jobs.put(None)
+        self.worker.join(timeout=2.0)
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            job_id, kind, s = job
+            with self.lock:
+                if job_id not in self.pending:
+                    self.jobCancelled.emit(job_id, s)
+                    continue
+                self.pending.discard(job_id)
+                self.current = job_id
+                self.cancelEvent.clear()
+            self.jobStarted.emit(job_id, s)
+            try:
+                if kind == MdiExecutor.LOAD_TOOL_TABLE:
+                    self.command.load_tool_table()
+                    self.command.wait_complete()
+                    self.jobCompleted.emit(job_id, s)
+                else:
+                    self.execute(job_id, s)
+            except Exception as ex:
+                self.jobFailed.emit(job_id, s, str(ex))
+            finally:
+                self.current = None
+
+    def execute(self, job_id:int, s:str):
+        self.stat.poll()
+        if self.stat.task_mode != linuxcnc.MODE_MDI:
+            self.command.mode(linuxcnc.MODE_MDI)
+            self.command.wait_complete()
+        self.command.mdi(s)
+        if self.command.wait_complete() == linuxcnc.RCS_ERROR:
+            self.jobFailed.emit(job_id, s, 'MDI command rejected')
+            return
+        # wait for the interpreter to finish running the macro
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.cancelEvent.is_set():
+                self.command.abort()
+                self.command.wait_complete()
+                self.jobCancelled.emit(job_id, s)
+                return
+            self.stat.poll()
+            if self.stat.interp_state == linuxcnc.INTERP_IDLE:
+                break
+            if time.monotonic() > deadline:
+                self.jobFailed.emit(job_id, s, f'Timed out after {self.timeout} seconds')
+                return
+            time.sleep(self.poll_interval)
+        if self.stat.state == linuxcnc.RCS_ERROR:
+            self.jobFailed.emit(job_id, s, 'MDI command finished with an error')
+            return
+        self.jobCompleted.emit(job_id, s)
+
+    def dispatchCompleted(self, job_id:int, s:str):
+        on_complete, _ = self.callbacks.pop(job_id, (None, None))
+        if on_complete is not None:
+            on_complete()
+
+    def dispatchFailed(self, job_id:int, s:str, err:str):
+        mdi_log.error(f'MDI job {job_id} [{s}] failed: {err}')
+        _, on_error = self.callbacks.pop(job_id, (None, None))
+        if on_error is not None:
+            on_error(err)
+
+    def dispatchCancelled(self, job_id:int, s:str):
+        mdi_log.debug(f'MDI job {job_id} [{s}] cancelled')
+        _, on_error = self.callbacks.pop(job_id, (None, None))
+        if on_error is not None:
+            on_error('cancelled')
+
+'''
+    ProgramPrescan scans a loaded program on a background thread (see atc_prescan.py).
+    A new request cancels the scan that is still running, results arrive on the GUI thread.
+'''
+class ProgramPrescan(QtCore.QObject):
+    scanFinished = QtCore.pyqtSignal(object)
+    scanFailed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.scanner = ProgramScanner()
+        self.lock = threading.Lock() # the scanner cache is not shared between threads
+        self.cancelEvent = None
+        self.worker = None
 
+    @property
+    def busy(self) -> bool:
+        return self.worker is not None and self.worker.is_alive()
+
+    def request(self, filename:str):
+        self.cancel()
+        self.cancelEvent = threading.Event()
+        self.worker = threading.Thread(target=self.run, args=(filename, self.cancelEvent),
+                                       name='rapid_atc_prescan', daemon=True)
+        self.worker.start()
+
+    def cancel(self):
+        if self.cancelEvent is not None:
+            self.cancelEvent.set()
+
+    def run(self, filename:str, cancelEvent:threading.Event):
+        try:
+            with self.lock:
+                result = self.scanner.scan(filename, cancelled=cancelEvent.is_set)
+        except ScanCancelled:
+            prescan_log.debug(f'Prescan of {filename} cancelled')
+            return
+        except OSError as e:
+            self.scanFailed.emit(filename, str(e))
+            return
+        if not cancelEvent.is_set():
+            self.scanFinished.emit(result)
+
+'''
+    PrefStore sits in front of the QtVCP preference object (self.w.MAIN.PREFS_) for the
+    sections it owns. Each section is read in one go at startup. putpref() only updates
+    memory and marks the key dirty, and the dirty keys are written together after a short
+    debounce, on a background thread, through a temporary file and an atomic rename.
+    QtVCP keeps writing the other sections of the same file itself, so the background write
+    reads the file again and only replaces the options of the sections PrefStore owns.
+    getpref()/putpref() take the same arguments as the QtVCP ones.
+'''
+class PrefStore(QtCore.QObject):
+    TRUE = ('1', 'yes', 'true', 'on')
+
+    def __init__(self, prefs, sections:list, debounce_ms:int = 1000) -> None:
+        super().__init__()
+        self.prefs = prefs
+        self.filename = getattr(prefs, 'fn', None)
+        self.values = {}
+        for section in sections:
+            items = dict(prefs.items(section)) if prefs.has_section(section) else {}
+            self.values.update({(section, k): v for k, v in items.items()})
+        self.dirty = set()
+        self.lock = threading.Lock() # one writer at a time
+        self.writer = None
+        self.requested = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(debounce_ms)
+        self.timer.timeout.connect(self.flush)
+
+    @staticmethod
+    def convert(value:str, type):
+        if type == bool:
+            return str(value).strip().lower() in PrefStore.TRUE
+        return type(value)
+
+    def getpref(self, option:str, default=False, type=bool, section:str = 'DEFAULT'):
+        value = self.values.get((section, option))
+        if value is not None:
+            try:
+                return self.convert(value, type)
+            except ValueError:
+                prefs_log.warning(f'Invalid preference {section}/{option} = {value}, using {default}')
+        # like QtVCP, a missing or invalid option is written back with its default
+        self.putpref(option, default, type, section)
+        return self.convert(default, type) if type in (bool, float, int) else default
+
+    def putpref(self, option:str, value, type=bool, section:str = 'DEFAULT'):
+        text = str(type(value)) if type != bool else str(self.convert(value, bool))
+        self.requested += 1
+        if self.values.get((section, option)) == text:
+            return
+        self.values[(section, option)] = text
+        self.dirty.add((section, option))
+        self.timer.start() # restart the debounce
+
+    def flush(self, wait:bool = False):
+        '''
+            Copy the dirty keys into the QtVCP preference object, so its own writes keep them,
+            and write them to the file from a background thread, or on the calling thread when
+            wait is True.
+        '''
+        self.timer.stop()
+        if not self.dirty:
+            return
+        for section, option in self.dirty:
+            if section != 'DEFAULT' and not self.prefs.has_section(section):
+                self.prefs.add_section(section)
+            self.prefs.set(section, option, self.values[(section, option)])
+        self.dirty.clear()
+        if self.filename is None:
+            return
+        # all the owned values, a write that failed is made up for by the next one
+        values = dict(self.values)
+        if wait:
+            self.write(values)
+        else:
+            self.writer = threading.Thread(target=self.write, args=(values,), name='rapid_atc_prefs', daemon=True)
+            self.writer.start()
+
+    def merge(self, values:dict) -> str:
+        '''
+            The file as it is now with values, {(section, option): text}, set in it
+        '''
+        current = configparser.RawConfigParser()
+        current.optionxform = self.prefs.optionxform
+        current.read(self.filename)
+        for (section, option), text in values.items():
+            if section != 'DEFAULT' and not current.has_section(section):
+                current.add_section(section)
+            current.set(section, option, text)
+        buffer = io.StringIO()
+        current.write(buffer)
+        return buffer.getvalue()
+
+    def write(self, values:dict):
+        start = time.perf_counter()
+        with self.lock:
+            try:
+                write_atomic(self.filename, self.merge(values))
+            except (OSError, configparser.Error) as e:
+                prefs_log.error(f'Unable to write preferences to {self.filename}: {e}')
+                return
+            self.flushes += 1
+            self.last_flush_ms = (time.perf_counter() - start) * 1000.0
+
+    def close(self):
+        self.flush(wait=True)
+        if self.writer is not None:
+            self.writer.join(timeout=2.0)
+
+    def get_stats(self) -> dict:
+        return {
+            'requested': self.requested,
+            'flushes': self.flushes,
+            'pending': len(self.dirty),
+            'last_flush_ms': self.last_flush_ms,
+        }
+
+'''
+    ViewModel remembers the last value pushed to each widget property and rapid_atc pin,
+    and only calls through to Qt/HAL when the value actually changed.
+    Fields that change slowly are refreshed on their own, configurable interval.
+'''
+class ViewModel():
+    UNSET = object()
+
+    def __init__(self, comp, slow_interval_ms:float = 500.0) -> None:
+        self.comp = comp
+        self.rendered = {}
+        self.slow_interval = slow_interval_ms / 1000.0
+        self.next_slow = 0.0
+        self.pushed = 0
+        self.skipped = 0
+        self.push_ms = 0.0
+
+    def set(self, key:str, setter, value) -> bool:
+        if self.rendered.get(key, ViewModel.UNSET) == value:
+            self.skipped += 1
+            return False
+        start = time.perf_counter()
+        setter(value)
+        self.push_ms += (time.perf_counter() - start) * 1000.0
+        self.rendered[key] = value
+        self.pushed += 1
+        return True
+
+    def setPin(self, pinName:str, value) -> bool:
+        return self.set(f'pin:{pinName}', lambda v: self.comp.__setitem__(pinName, v), value)
+
+    def invalidate(self, key:str = None):
+        if key is None:
+            self.rendered.clear()
+        else:
+            self.rendered.pop(key, None)
+
+    def setSlowInterval(self, interval_ms:float):
+        self.slow_interval = interval_ms / 1000.0
+        self.next_slow = 0.0
+
+    def slowDue(self) -> bool:
+        now = time.monotonic()
+        if now < self.next_slow:
+            return False
+        self.next_slow = now + self.slow_interval
+        return True
+
+    def get_stats(self) -> dict:
+        avg_push_ms = self.push_ms / self.pushed if self.pushed else 0.0
+        return {
+            'pushed': self.pushed,
+            'skipped': self.skipped,
+            'avg_push_ms': avg_push_ms,
+            'estimated_saved_ms': self.skipped * avg_push_ms,
+        }
+
+'''
+    ToolChangeProfiler records the phases of every tool change.
+    The ATC macros publish the current phase with M67 E0 (and the pocket with M67 E1), which
+    rapidatc-postgui.hal wires to the rapid_atc.atc_phase / atc_phase_pocket pins.
+    Phase codes are op * 10 + step, e.g. 15 = drop.engage, 26 = pickup.ir_check.
+    Each completed change is appended as one JSON line to the cycle time log.
+'''
+class ToolChangeProfiler():
+    OPS = {1: 'drop', 2: 'pickup', 3: 'probe'}
+    STEPS = {1: 'safe_z', 2: 'xy_move', 3: 'cover_open', 4: 'spindle_spinup',
+             5: 'engage', 6: 'ir_check', 7: 'probe', 8: 'retract', 9: 'cached'}
+    PROBE_MEASURED = 37 # probe.probe
+    PROBE_CACHED = 39 # probe.cached, _auto_probe_tool used the cached tool length
+
+    def __init__(self, logpath:str, history:int = 500) -> None:
+        self.logpath = logpath
+        self.records = deque(maxlen=history)
+        self.completed = 0 # changes finished this session
+        self.active = None
+        self.phase = 0
+        self.pocket = 0
+        self.phase_start = 0.0
+        self.load()
+
+    @staticmethod
+    def phase_name(code:int) -> str:
+        return f'{ToolChangeProfiler.OPS.get(code // 10, "op" + str(code // 10))}.' \
+               f'{ToolChangeProfiler.STEPS.get(code % 10, "step" + str(code % 10))}'
+
+    @staticmethod
+    def percentile(values:list, pct:float) -> float:
+        # nearest-rank percentile
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+        return ordered[rank]
+
+    def load(self):
+        try:
+            with open(self.logpath, 'r') as file:
+                for line in file:
+                    try:
+                        self.records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+
+    def sample(self, phase:int, pocket:int, now:float = None):
+        '''
+            Feed the current phase/pocket pins, returns the record when a change completes
+        '''
+        if phase == self.phase:
+            return None
+        now = time.time() if now is None else now
+        if self.active is None:
+            if phase != 0:
+                self.active = {'t': round(now, 3), 'p': []}
+        else:
+            self.active['p'].append([self.phase, self.pocket, round(now - self.phase_start, 3)])
+        self.phase = phase
+        self.pocket = pocket
+        self.phase_start = now
+        if phase == 0 and self.active is not None:
+            return self.finish(now)
+        return None
+
+    def finish(self, now:float = None):
+        '''
+            Close the change in progress, e.g. when an MDI-run macro ends without resetting the phase
+        '''
+        if self.active is None:
+            return None
+        now = time.time() if now is None else now
+        if self.phase != 0:
+            self.active['p'].append([self.phase, self.pocket, round(now - self.phase_start, 3)])
+        record = self.active
+        record['d'] = round(now - record['t'], 3)
+        # self.phase keeps the last pin value so a stale phase does not start a new change
+        self.active = None
+        self.records.append(record)
+        self.completed += 1
+        try:
+            with open(self.logpath, 'a') as file:
+                file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        except OSError as detail:
+            profiler_log.error(f'Unable to write tool change log {self.logpath}: {detail}')
+        return record
+
+    def summary(self) -> dict:
+        phases = {}
+        pockets = {}
+        totals = []
+        for record in self.records:
+            per_phase = {}
+            per_pocket = {}
+            for code, pocket, duration in record['p']:
+                name = ToolChangeProfiler.phase_name(int(code))
+                per_phase[name] = per_phase.get(name, 0.0) + duration
+                if pocket:
+                    per_pocket[int(pocket)] = per_pocket.get(int(pocket), 0.0) + duration
+            for name, duration in per_phase.items():
+                phases.setdefault(name, []).append(duration)
+            for pocket, duration in per_pocket.items():
+                pockets.setdefault(pocket, []).append(duration)
+            totals.append(record.get('d', 0.0))
+        stats = lambda v: {'n': len(v), 'p50': self.percentile(v, 50), 'p95': self.percentile(v, 95)}
+        return {
+            'total': stats(totals),
+            'phases': {k: stats(v) for k, v in sorted(phases.items())},
+            'pockets': {k: stats(v) for k, v in sorted(pockets.items())},
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        total = summary['total']
+        lines = [f'TOOL CHANGES: {total["n"]}  p50 {total["p50"]:.2f}s  p95 {total["p95"]:.2f}s', '',
+                 f'{"PHASE":<24}{"N":>5}{"P50":>9}{"P95":>9}']
+        for name, st in summary['phases'].items():
+            lines.append(f'{name:<24}{st["n"]:>5}{st["p50"]:>9.2f}{st["p95"]:>9.2f}')
+        lines += ['', f'{"POCKET":<24}{"N":>5}{"P50":>9}{"P95":>9}']
+        for pocket, st in summary['pockets'].items():
+            lines.append(f'{pocket:<24}{st["n"]:>5}{st["p50"]:>9.2f}{st["p95"]:>9.2f}')
+        return '\n'.join(lines)
+
+      
 ###################################
 # **** HANDLER CLASS SECTION **** #
 ###################################
@@ -170,12 +929,56 @@ class HandlerClass:
         self.configPath = paths.CONFIGPATH
         self.toolTablePath = path.join(self.configPath, 'tool.tbl')
         self.tooldb = ToolTableReader(tooldb=self.toolTablePath)
+        self.toolTableWatcher = ToolTableWatcher(self.tooldb)
+        self.toolModel = ToolLibraryModel(self.tooldb)
         self.currentTool = 0
         self.currentToolPocketNo = 0
+        # GUI tick budget is the [DISPLAY] CYCLE_TIME (seconds), default to 100 ms
+        cycle_time = self.iniFile.find('DISPLAY', 'CYCLE_TIME') or '0.100'
+        self.status = StatusChannel(budget_ms=float(cycle_time) * 1000.0)
+        self.halPins = HalPins() # the IR and cover pins are bound when their DPIN settings are applied
+        self.halPins.bind('homed', 'motion.is-all-homed')
+        self.halPins.bind('machine_on', 'halui.machine.is-on')
+        self.halPins.bind('prep_tool', 'iocontrol.0.tool-prep-number')
+        self.mdi = MdiExecutor()
+        self.view = ViewModel(self.c)
+        self.allowDirectTraverse = False
+        self.traverseZ = 0.0
+        self.planKey = None
+        self.motionModel = self.getMotionModel()
+        self.prefs = None
+        self.params = ParamRegistry(build_params(), ConfigElement.ATC_SECTION)
+        self.prescan = ProgramPrescan()
+        self.prescanResult = None
+        self.prescanHistory = {} # sha1 -> tool sequence of the programs scanned this session
+        self.layoutProposal = None
+        self.profiler = ToolChangeProfiler(logpath=path.join(self.configPath, 'atc_cycle_times.jsonl'))
+        self.toolCache = ToolLengthCache(path.join(self.configPath, 'atc_tool_cache.json'))
+        self.probeCacheEnabled = False
+        self.probeCacheKey = None
+        self.probePriorKey = None
+        self.probeCheckAck = 0.0 # last probe_check_request answered
+        self.cacheSeen = 0 # profiler.completed already booked in the cache
+        self.cacheTool = None # spindle tool at the last idle tick
+        self.cacheToolChanges = 0 # profiler.completed at the last idle tick
+        self.rack = RackOccupancy(path.join(self.configPath, 'atc_rack.bin'))
+        self.rackTool = None # spindle tool at the last tick
+        self.rackChanges = 0 # profiler.completed at the last tick
+        self.rackCheckKey = None
+        self.rackViewKey = None
+        self.batch = None # BatchRun
+        self.batchJob = None # MDI job id of the running step
+        self.logVersion = None
+        logfile = self.iniFile.find(ConfigElement.ATC_SECTION, 'LOG_FILE')
+        if logfile:
+            try:
+                LOGS.startFile(path.join(self.configPath, path.expanduser(logfile)))
+            except OSError as e:
+                log.error(f'Unable to open log file {logfile}: {e}')
 
     
     def onTextChanged(self, s:str):
-        print(f'Text Changed: {s}')
+        log.debug(f'Text Changed: {s}')
 
     ##########################################
     # SPECIAL FUNCTIONS SECTION              #
@@ -189,11 +992,11 @@ class HandlerClass:
         log.debug('INIT qtvcp handler')
         if not self.w.MAIN.PREFS_:
             err = "CRITICAL - no preference file found, enable preferences in screenoptions widget"
-            log.debug(err)
-            print(err)
+            log.critical(err)
             return
 
         if self.w.MAIN.PREFS_:
+            self.prefs = PrefStore(self.w.MAIN.PREFS_, sections=[ConfigElement.ATC_SECTION])
             '''
             [ATC]
             NUM_POCKETS = 4
@@ -212,32 +1015,14 @@ class HandlerClass:
             LOAD_ZSPEED = 870
             '''
             
-            # PIN definitions
-            self.c.newpin(AtcHalPin.SAFE_Z, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.Z_IR_ENGAGE, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.NUM_POCKETS, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.POCKET_OFFSET, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.FIRST_POCKET_X, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.FIRST_POCKET_Y, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.X_MANUAL_CHANGE_POS, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.Y_MANUAL_CHANGE_POS, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.ENGAGE_Z, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.ENGAGE_Z_DROP_OFFSET, hal.HAL_FLOAT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.ALIGN_AXIS, hal.HAL_BIT, hal.HAL_IN)
-            #self.c.newpin(AtcHalPin.ALIGN_DIR, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.DROP_RATE, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.PICKUP_RATE, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.SPINDLE_SPEED_PICKUP, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.SPINDLE_SPEED_DROP, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.CURRENT_TOOL_POCKET, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.IR_ENABLED, hal.HAL_BIT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.COVER_ENABLED, hal.HAL_BIT, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.IR_HAL_DPIN, hal.HAL_S32, hal.HAL_IN)
-            self.c.newpin(AtcHalPin.COVER_HAL_DPIN, hal.HAL_S32, hal.HAL_OUT)
-            self.c.newpin(AtcHalPin.DUST_COVER_STATE, hal.HAL_BIT, hal.HAL_OUT)
+            # PIN definitions, see atc_params.build_params()
+            self.params.create_pins(self.c, hal)
             # Wire periodic update function
             STATUS.connect('periodic', lambda w: self.updatePeriodic())
             STATUS.connect('general', self.dialog_return)
+            self.toolTableWatcher.tableChanged.connect(self.onToolTableChanged)
+            if not self.toolTableWatcher.active:
+                status_log.warning(f'Unable to watch {self.toolTablePath}, it is checked at the slow refresh rate')
             
             # UI elements
             self.w.btnSetXYPocketOne.clicked.connect( lambda: self.setXYPocketOne() )
@@ -246,10 +1031,13 @@ class HandlerClass:
 
             self.w.btnSetZIREngage.clicked.connect(lambda: self.setZIREngage() )
 
-            self.w.btnAdd.clicked.connect(lambda: (self.w.tooloffsetview.add_tool(),\
-                                            self.w.tooloffsetview.repaint()))
-            self.w.btnDelete.clicked.connect(lambda:(self.w.tooloffsetview.delete_tools(),\
-                                                self.w.tooloffsetview.repaint()))
+            self.w.tvToolLibrary.setModel(self.toolModel)
+            self.toolModel.toolEdited.connect(self.editTool)
+            self.w.leToolFilter.textChanged.connect(lambda text: self.toolModel.setFilter(text=text))
+            self.w.pbRackOnly.clicked.connect(
+                lambda checked: self.toolModel.setFilter(rack_only=checked, num_pockets=self.c[AtcHalPin.NUM_POCKETS]))
+            self.w.btnAdd.clicked.connect(lambda: self.addTool())
+            self.w.btnDelete.clicked.connect(lambda: self.deleteTools())
             #self.w.pbSafeZ.clicked.connect(
             #    lambda: self.executeProgram('o<_go_to_pos> call')
             #)
@@ -257,7 +1045,7 @@ class HandlerClass:
             #    lambda: self.executeProgram('o<_tool_change> call [5]')
             #)
             self.w.btnDropTool.clicked.connect(
-                lambda: self.executeProgram(f'o<_drop_tool> call [{self.currentToolPocketNo}]')
+                lambda: self.dropToolViaATC()
             )
 
             self.w.btnPickupTool.clicked.connect(
@@ -273,6 +1061,27 @@ class HandlerClass:
 
             self.w.btnM61.clicked.connect( lambda: self.loadToolViaM61() )
 
+            self.w.btnRefreshCycleTimes.clicked.connect( lambda: self.updateCycleTimeSummary() )
+            self.w.btnClearLog.clicked.connect( lambda: LOGS.ring.clear() )
+            self.updateCycleTimeSummary()
+            self.w.lblProbeCacheStats.setText('HITS 0  MISSES 0')
+            self.w.btnRackMarkEmpty.clicked.connect( lambda: self.setRackPocket(full=False) )
+            self.w.btnRackMarkFull.clicked.connect( lambda: self.setRackPocket(full=True) )
+            self.w.btnRackFromTable.clicked.connect( lambda: self.seedRack() )
+            self.w.btnBatchVerify.clicked.connect( lambda: self.startBatch(VERIFY) )
+            self.w.btnBatchMeasure.clicked.connect( lambda: self.startBatch(MEASURE) )
+            self.w.btnBatchCycle.clicked.connect( lambda: self.startBatch(CYCLE) )
+            self.w.btnBatchCancel.clicked.connect( lambda: self.cancelBatch() )
+
+            self.prescan.scanFinished.connect(self.onPrescanFinished)
+            self.prescan.scanFailed.connect(
+                lambda f, e: self.w.tePrescan.setPlainText(f'Could not scan {f}: {e}'))
+            STATUS.connect('file-loaded', lambda w, filename: self.prescanProgram(filename))
+            self.w.btnRescanProgram.clicked.connect( lambda: self.prescanProgram(self.getCurrentStat().file) )
+            self.w.btnProposeLayout.clicked.connect( lambda: self.proposePocketLayout() )
+            self.w.btnApplyLayout.clicked.connect( lambda: self.applyPocketLayout() )
+            self.w.btnApplyLayout.setEnabled(False)
+
             '''
             future items, which may never be implemented
             '''
@@ -280,422 +1089,18 @@ class HandlerClass:
             self.w.gbToolSetterTouch.setVisible(False)
             
             '''
-                Removed columns from tooloffsetview that are extraneous/unused by ATC Logic
-            '''
-            # https://linuxcnc.org/docs/2.9/html/gui/qtvcp-widgets.html#sub:qtvcp:widgets:tooloffsetview
-           # self.w.tooloffsetview.hideColumn(2) 
-            self.w.tooloffsetview.hideColumn(3)
-            self.w.tooloffsetview.hideColumn(4)
-            self.w.tooloffsetview.hideColumn(5)
-            self.w.tooloffsetview.hideColumn(6)
-            self.w.tooloffsetview.hideColumn(7)
-            self.w.tooloffsetview.hideColumn(8)
-            self.w.tooloffsetview.hideColumn(9)
-            self.w.tooloffsetview.hideColumn(10)
-            self.w.tooloffsetview.hideColumn(11)
-
-            '''
-                num_pockets : Number of tool pocketsi available for tool changing
-            '''
-            num_pockets = self.w.MAIN.PREFS_.getpref(ConfigElement.NUM_POCKETS, 4, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.NUM_POCKETS} = {num_pockets}')
-            self.c[AtcHalPin.NUM_POCKETS] = int(num_pockets)
-            self.numPocketInput = self.w.leNoPockets
-            self.numPocketInput.setText(str(num_pockets))
-            self.numPocketInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.NUM_POCKETS, int(self.numPocketInput.text()), int, ConfigElement.ATC_SECTION),
-                        log.debug(f'SETTING {ConfigElement.NUM_POCKETS} = {self.numPocketInput.text()} in preferences'),
-                         self.setPinValue( pinName = AtcHalPin.NUM_POCKETS, pinVal = int(self.numPocketInput.text()))))
-            
-            '''
-                pocket_offset : Offset between tool pockets
-            '''
-            pocket_offset = self.w.MAIN.PREFS_.getpref(ConfigElement.POCKET_OFFSET, "45", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.POCKET_OFFSET} = {pocket_offset}')
-            self.c[AtcHalPin.POCKET_OFFSET] = float(pocket_offset)
-            self.pocketOffsetInput = self.w.lePocketOffset
-            
-            self.pocketOffsetInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.pocketOffsetInput.setText(str(pocket_offset))
-            self.pocketOffsetInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.POCKET_OFFSET, self.pocketOffsetInput.text(), str, ConfigElement.ATC_SECTION),
-                         log.debug(f'SETTING {ConfigElement.POCKET_OFFSET} = {self.pocketOffsetInput.text()} in preferences'),
-                         self.setPinValue( pinName = AtcHalPin.POCKET_OFFSET, pinVal = float(self.pocketOffsetInput.text()))
-                        )
-                )
-            
-            '''
-                first_pocket_x : X pos of first pocket
-            '''
-            first_pocket_x = self.w.MAIN.PREFS_.getpref(ConfigElement.FIRST_POCKET_X, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.FIRST_POCKET_X} = {first_pocket_x}')
-            self.c[AtcHalPin.FIRST_POCKET_X] = float(first_pocket_x)
-            self.firstPocketXInput = self.w.leLocPocketOneX
-            self.firstPocketXInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.firstPocketXInput.setText(str(first_pocket_x))
-            self.firstPocketXInput.editingFinished.connect(
-                    lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.FIRST_POCKET_X, self.firstPocketXInput.text(), str, ConfigElement.ATC_SECTION),
-                    log.debug(f'SETTING {ConfigElement.FIRST_POCKET_X} = {self.firstPocketXInput.text()} in preferences'),
-                    self.setPinValue( pinName = AtcHalPin.FIRST_POCKET_X, pinVal = float(self.firstPocketXInput.text()))))
-            '''
-                first_pocket_y : Y pos of first pocket
-            '''
-            first_pocket_y = self.w.MAIN.PREFS_.getpref(ConfigElement.FIRST_POCKET_Y, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.FIRST_POCKET_Y} = {first_pocket_y}')
-            self.c[AtcHalPin.FIRST_POCKET_Y] = float(first_pocket_y)
-            self.firstPocketYInput = self.w.leLocPocketOneY
-            self.firstPocketYInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.firstPocketYInput.setText(str(first_pocket_y))
-            self.firstPocketYInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.FIRST_POCKET_Y, self.firstPocketYInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.FIRST_POCKET_Y} = {self.firstPocketYInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.FIRST_POCKET_Y, pinVal = float(self.firstPocketYInput.text()))))
-            '''
-                z_engage : Z engage position
-            '''
-            z_engage = self.w.MAIN.PREFS_.getpref(ConfigElement.Z_ENGAGE, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.Z_ENGAGE} = {z_engage}')
-            self.c[AtcHalPin.ENGAGE_Z] = float(z_engage)
-            self.zEngageInput = self.w.leLocZEngage
-            self.zEngageInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.zEngageInput.setText(str(z_engage))
-            self.zEngageInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.Z_ENGAGE, self.zEngageInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.Z_ENGAGE} = {self.zEngageInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.ENGAGE_Z, pinVal = float(self.zEngageInput.text()))))
-            '''
-                z_engage_drop_offset : Z engage offset position for drops
-            '''
-            z_engage_drop_offset = self.w.MAIN.PREFS_.getpref(ConfigElement.Z_ENGAGE_DROP_OFFSET, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.Z_ENGAGE_DROP_OFFSET} = {z_engage_drop_offset}')
-            self.c[AtcHalPin.ENGAGE_Z_DROP_OFFSET] = float(z_engage)
-            self.zEngageDropOffsetInput = self.w.leZToolDropOffset
-            self.zEngageDropOffsetInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.zEngageDropOffsetInput.setText(str(z_engage_drop_offset))
-            self.zEngageDropOffsetInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.Z_ENGAGE, self.zEngageDropOffsetInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.Z_ENGAGE_DROP_OFFSET} = {self.zEngageDropOffsetInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.ENGAGE_Z_DROP_OFFSET, pinVal = float(self.zEngageDropOffsetInput.text()))))
-
-                
-            '''
-                z_ir_engage : Z IR engage position
-            '''
-            z_ir_engage = self.w.MAIN.PREFS_.getpref(ConfigElement.Z_IR_ENGAGE, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.Z_IR_ENGAGE} = {z_ir_engage}')
-            self.c[AtcHalPin.Z_IR_ENGAGE] = float(z_ir_engage)
-            self.zEngageIRInput = self.w.leLocZIREngage
-            self.zEngageIRInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.zEngageIRInput.setText(str(z_ir_engage))
-            self.zEngageIRInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.Z_IR_ENGAGE, self.zEngageIRInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.Z_IR_ENGAGE} = {self.zEngageIRInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.Z_IR_ENGAGE, pinVal = float(self.zEngageIRInput.text()))))
-            '''
-                z_safe_clearance 
-            '''
-            z_safe_clearance = self.w.MAIN.PREFS_.getpref(ConfigElement.Z_SAFE_CLEARANCE, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.Z_SAFE_CLEARANCE} = {z_safe_clearance}')
-            self.c[AtcHalPin.SAFE_Z] = float(z_safe_clearance)
-            self.zSafeClearanceInput = self.w.leZSafeClearance
-            self.zSafeClearanceInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.zSafeClearanceInput.setText(z_safe_clearance)
-            self.zSafeClearanceInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.Z_SAFE_CLEARANCE, self.zSafeClearanceInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.Z_SAFE_CLEARANCE} = {self.zSafeClearanceInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.SAFE_Z, pinVal = float(self.zSafeClearanceInput.text()))))
-            '''
-                cover_hal_dpin 
-            '''
-            cover_hal_dpin = self.w.MAIN.PREFS_.getpref(ConfigElement.COVER_HAL_DPIN, 2, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.COVER_HAL_DPIN} = {cover_hal_dpin}')
-            self.c[AtcHalPin.COVER_HAL_DPIN] = int(cover_hal_dpin)
-            self.coverDPinInput = self.w.leCoverDPinInput
-            self.coverDPinInput.setText(str(cover_hal_dpin))
-            self.coverDPinInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.COVER_HAL_DPIN, self.coverDPinInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.COVER_HAL_DPIN} = {self.coverDPinInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.COVER_HAL_DPIN, pinVal = int(self.coverDPinInput.text()))))
-            '''
-                ir_hal_dpin 
-            '''
-            ir_hal_dpin = self.w.MAIN.PREFS_.getpref(ConfigElement.IR_HAL_DPIN, 3, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.IR_HAL_DPIN} = {ir_hal_dpin}')
-            self.c[AtcHalPin.IR_HAL_DPIN] = int(ir_hal_dpin)
-            self.irDPinInput = self.w.leIRDPinInput
-            self.irDPinInput.setText(str(ir_hal_dpin))
-            self.irDPinInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.IR_HAL_DPIN, self.irDPinInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.IR_HAL_DPIN} = {self.irDPinInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.IR_HAL_DPIN, pinVal = int(self.irDPinInput.text()))))
-            '''
-                x_manual_change_pos 
-            '''
-            x_manual_change_pos = self.w.MAIN.PREFS_.getpref(ConfigElement.X_MANUAL_CHANGE_POS, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.X_MANUAL_CHANGE_POS} = {x_manual_change_pos}')
-            self.c[AtcHalPin.X_MANUAL_CHANGE_POS] = float(x_manual_change_pos)
-            self.xManualChangePosInput = self.w.leXManualChangePos
-            self.xManualChangePosInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.xManualChangePosInput.setText(str(x_manual_change_pos))
-            self.xManualChangePosInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.X_MANUAL_CHANGE_POS, self.xManualChangePosInput.text(), str, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.X_MANUAL_CHANGE_POS} = {self.xManualChangePosInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.X_MANUAL_CHANGE_POS, pinVal = float(self.xManualChangePosInput.text())
-                )
-            ))
-            '''
-                y_manual_change_pos 
-            '''
-            y_manual_change_pos = self.w.MAIN.PREFS_.getpref(ConfigElement.Y_MANUAL_CHANGE_POS, "0", str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.Y_MANUAL_CHANGE_POS} = {y_manual_change_pos}')
-            self.c[AtcHalPin.Y_MANUAL_CHANGE_POS] = float(y_manual_change_pos)
-            self.yManualChangePosInput = self.w.leYManualChangePos
-            self.yManualChangePosInput.setValidator(
-            QtGui.QDoubleValidator(
-                -5000, # bottom
-                5000, # top
-                3, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            self.yManualChangePosInput.setText(str(y_manual_change_pos))
-            self.yManualChangePosInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.Y_MANUAL_CHANGE_POS, self.yManualChangePosInput.text(), int, ConfigElement.ATC_SECTION),
-                log.debug(f'SETTING {ConfigElement.Y_MANUAL_CHANGE_POS} = {self.yManualChangePosInput.text()} in preferences'),
-                self.setPinValue( pinName = AtcHalPin.Y_MANUAL_CHANGE_POS, pinVal = float(self.yManualChangePosInput.text())
-                )
-            ))
-            '''
-                align_axis 
-            '''
-            align_axis = self.w.MAIN.PREFS_.getpref(ConfigElement.ALIGN_AXIS, 'X', str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.ALIGN_AXIS} = {align_axis}')
-            if align_axis.lower() == 'x':
-                self.w.pbXAxis.setChecked(True)
-                self.w.pbYAxis.setChecked(False)
-                self.c[AtcHalPin.ALIGN_AXIS] = 0
-            else:
-                self.w.pbYAxis.setChecked(True)
-                self.w.pbXAxis.setChecked(False)
-                self.c[AtcHalPin.ALIGN_AXIS] = 0
-
-            self.w.pbXAxis.clicked.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.ALIGN_AXIS, 'X', str, ConfigElement.ATC_SECTION),
-                    self.w.pbXAxis.setEnabled(False),
-                    self.w.pbYAxis.setEnabled(True),
-                    self.w.pbYAxis.setChecked(False),
-                    self.setPinValue( pinName = AtcHalPin.ALIGN_AXIS, pinVal = 0),
-                    log.debug(f'SETTING {ConfigElement.ALIGN_AXIS} = X in preferences'))
-                )
-            self.w.pbYAxis.clicked.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.ALIGN_AXIS, 'Y', str, ConfigElement.ATC_SECTION),
-                    self.w.pbYAxis.setEnabled(False),
-                    self.w.pbXAxis.setEnabled(True), 
-                    self.w.pbXAxis.setChecked(False),
-                    self.setPinValue( pinName = AtcHalPin.ALIGN_AXIS, pinVal = 1),
-                    log.debug(f'SETTING {ConfigElement.ALIGN_AXIS} = Y in preferences'))
-                )
-            '''
-                align_dir
-            
-            align_dir = self.w.MAIN.PREFS_.getpref(ConfigElement.ALIGN_DIR, 'POS', str, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.ALIGN_DIR} = {align_dir}')
-            if align_dir.lower() == 'pos':
-                self.w.pbDirectionPos.setChecked(True)
-                self.w.pbDirectionNeg.setChecked(False)
-                self.setPinValue( pinName = AtcHalPin.ALIGN_DIR, pinVal = 1)
-            else:
-                self.w.pbDirectionNeg.setChecked(True)
-                self.w.pbDirectionPos.setChecked(False)
-                self.setPinValue( pinName = AtcHalPin.ALIGN_DIR, pinVal = -1)
-            
-            self.w.pbDirectionPos.clicked.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.ALIGN_DIR, 'POS', str, ConfigElement.ATC_SECTION),
-                    self.w.pbDirectionPos.setEnabled(False),
-                    self.w.pbDirectionNeg.setEnabled(True),
-                    self.w.pbDirectionNeg.setChecked(False),
-                    self.setPinValue( pinName = AtcHalPin.ALIGN_DIR, pinVal = 1),
-                    log.debug(f'SETTING {ConfigElement.ALIGN_DIR} = POS in preferences'))
-                )
-            self.w.pbDirectionNeg.clicked.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.ALIGN_DIR, 'NEG', str, ConfigElement.ATC_SECTION),
-                    self.w.pbDirectionNeg.setEnabled(False),
-                    self.w.pbDirectionPos.setEnabled(True), 
-                    self.w.pbDirectionPos.setChecked(False),
-                    self.setPinValue( pinName = AtcHalPin.ALIGN_DIR, pinVal = -1),
-                    log.debug(f'SETTING {ConfigElement.ALIGN_DIR} = NEG in preferences'))
-                )
-            '''
-            '''
-                engage_feed_rate 
-            
-            engage_feed_rate = self.w.MAIN.PREFS_.getpref(ConfigElement.ENGAGE_FEED_RATE, 1800, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.ENGAGE_FEED_RATE} = {engage_feed_rate}')
-            self.engageFeedRateInput = self.w.leSFEngageFeedRate
-            self.engageFeedRateInput.setText(str(engage_feed_rate))
-            self.engageFeedRateInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.ENGAGE_FEED_RATE, int(self.engageFeedRateInput.text()), int, ConfigElement.ATC_SECTION),
-                self.setPinValue( pinName = AtcHalPin.ENGAGE_FEED_RATE, pinVal = int(self.engageFeedRateInput.text())),
-                log.debug(f'SETTING {ConfigElement.ENGAGE_FEED_RATE} = {self.engageFeedRateInput.text()} in preferences'))
-                )
-            
-            self.engageFeedRateInput.setValidator(
-            QtGui.QDoubleValidator(
-                0, # bottom
-                5000, # top
-                0, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            '''
-            '''
-                pickup_rate 
-            '''
-            pickup_rate = self.w.MAIN.PREFS_.getpref(ConfigElement.PICKUP_RATE, 1800, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.PICKUP_RATE} = {pickup_rate}')
-            self.pickupRateInput = self.w.leSFPickUpRate
-            self.pickupRateInput.setText(str(pickup_rate))
-            self.c[AtcHalPin.PICKUP_RATE] = int(pickup_rate)
-            self.pickupRateInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.PICKUP_RATE, int(self.pickupRateInput.text()), int, ConfigElement.ATC_SECTION),
-                self.setPinValue( pinName = AtcHalPin.PICKUP_RATE, pinVal = int(self.pickupRateInput.text())),
-                log.debug(f'SETTING {ConfigElement.PICKUP_RATE} = {self.pickupRateInput.text()} in preferences'))
-                )
-            
-            self.pickupRateInput.setValidator(
-            QtGui.QDoubleValidator(
-                0, # bottom
-                5000, # top
-                0, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            '''
-                drop_rate 
+                rapid_atc parameters: preferences -> pins/handler attributes -> widgets, see atc_params.py
             '''
-            drop_rate = self.w.MAIN.PREFS_.getpref(ConfigElement.DROP_RATE, 1800, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.DROP_RATE} = {drop_rate}')
-            self.dropRateInput = self.w.leSFDropRate
-            self.dropRateInput.setText(str(drop_rate))
-            self.c[AtcHalPin.DROP_RATE] = int(drop_rate)
-            self.dropRateInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.DROP_RATE, int(self.dropRateInput.text()), int, ConfigElement.ATC_SECTION),
-                self.setPinValue( pinName = AtcHalPin.DROP_RATE, pinVal = int(self.dropRateInput.text())),
-                log.debug(f'SETTING {ConfigElement.DROP_RATE} = {self.dropRateInput.text()} in preferences'))
-                )
-            self.dropRateInput.setValidator(
-            QtGui.QDoubleValidator(
-                0, # bottom
-                5000, # top
-                0, # decimals 
+            self.params.load(self.prefs)
+            self.params.apply(lambda pin, value: self.setPinValue(pinName=pin, pinVal=value), self)
+            self.params.bind(self.w, validator=lambda p: QtGui.QDoubleValidator(
+                p.bottom, # bottom
+                p.top, # top
+                p.decimals, # decimals
                 notation=QtGui.QDoubleValidator.StandardNotation
             ))
-            '''
-                spindle_speed_pickup
-            '''
-            spindle_speed_pickup = self.w.MAIN.PREFS_.getpref(ConfigElement.SPINDLE_SPEED_PICKUP, 1500, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.SPINDLE_SPEED_PICKUP} = {spindle_speed_pickup}')
-            self.spindleSpeedInput = self.w.leSpindleSpeedPickup
-            self.spindleSpeedInput.setText(str(spindle_speed_pickup))
-            self.c[AtcHalPin.SPINDLE_SPEED_PICKUP] = int(spindle_speed_pickup)
-            self.spindleSpeedInput.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.SPINDLE_SPEED_PICKUP, int(self.spindleSpeedInput.text()), int, ConfigElement.ATC_SECTION),
-                self.setPinValue( pinName = AtcHalPin.SPINDLE_SPEED_PICKUP, pinVal = int(self.spindleSpeedInput.text())),
-                log.debug(f'SETTING {ConfigElement.SPINDLE_SPEED_PICKUP} = {self.spindleSpeedInput.text()} in preferences'))
-                )
-            self.spindleSpeedInput.setValidator(
-            QtGui.QDoubleValidator(
-                0, # bottom
-                5000, # top
-                0, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            '''
-                spindle speed drop
-            '''
-            spindle_speed_drop = self.w.MAIN.PREFS_.getpref(ConfigElement.SPINDLE_SPEED_DROP, 1500, int, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.SPINDLE_SPEED_DROP} = {spindle_speed_drop}')
-            self.spindleSpeedInputDrop = self.w.leSpindleSpeedDrop
-            self.spindleSpeedInputDrop.setText(str(spindle_speed_drop))
-            self.c[AtcHalPin.SPINDLE_SPEED_DROP] = int(spindle_speed_drop)
-            self.spindleSpeedInputDrop.editingFinished.connect(
-                lambda: (self.w.MAIN.PREFS_.putpref(ConfigElement.SPINDLE_SPEED_DROP, int(self.spindleSpeedInputDrop.text()), int, ConfigElement.ATC_SECTION),
-                self.setPinValue( pinName = AtcHalPin.SPINDLE_SPEED_DROP, pinVal = int(self.spindleSpeedInputDrop.text())),
-                log.debug(f'SETTING {ConfigElement.SPINDLE_SPEED_DROP} = {self.spindleSpeedInputDrop.text()} in preferences'))
-                )
-            self.spindleSpeedInputDrop.setValidator(
-            QtGui.QDoubleValidator(
-                0, # bottom
-                5000, # top
-                0, # decimals 
-                notation=QtGui.QDoubleValidator.StandardNotation
-            ))
-            '''
-                ir_enabled
-            '''
-            ir_enabled = self.w.MAIN.PREFS_.getpref(ConfigElement.IR_ENABLED, True, bool, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.IR_ENABLED} = {ir_enabled}')
-            self.irEnabledInput = self.w.btn_ir_enabled
-            self.irEnabledInput.setChecked(ir_enabled)
-            self.setIREnabled(ir_enabled)
-            self.w.btn_ir_enabled.clicked.connect(
-                lambda: ( self.setIREnabled(self.w.btn_ir_enabled.isChecked()))
-            )
-
-
-            cover_enabled = self.w.MAIN.PREFS_.getpref(ConfigElement.COVER_ENABLED, True, bool, ConfigElement.ATC_SECTION)
-            log.debug(f'{ConfigElement.COVER_ENABLED} = {cover_enabled}')
-            self.coverEnabledInput = self.w.btnCoverEnabled
-            self.coverEnabledInput.setChecked(cover_enabled)
-            self.setCoverEnabled(cover_enabled)
-            self.w.btnCoverEnabled.clicked.connect(
-                lambda: ( self.setCoverEnabled(self.w.btnCoverEnabled.isChecked()))
-            )
+            log.debug(f'Parameter startup: {self.params.timings}')
+            self.loadRack()
 
             '''
             tool_dict = self.tooldb.get_tools()
@@ -722,39 +1127,66 @@ class HandlerClass:
     #######################
     # CALLBACKS FROM FORM #
     #######################
-    def executeProgram(self, s:str):
-        command = linuxcnc.command()
-        command.mode(linuxcnc.MODE_MDI)
-        command.wait_complete()
-        command.mdi(s)
-        command.wait_complete()
+    def executeProgram(self, s:str, on_complete=None, on_error=None) -> int:
+        # queued on the MDI worker thread, returns immediately
+        return self.mdi.submit(s, on_complete=on_complete, on_error=on_error)
+
+    def cancelProgram(self):
+        self.mdi.cancel()
 
     def setPinValue(self, pinName:str, pinVal):
-        self.c[pinName] = pinVal
+        self.view.setPin(pinName, pinVal)
         
     def setIREnabled(self, b:bool):
-        if b == True:
-            self.setPinValue(pinName=AtcHalPin.IR_ENABLED, pinVal=1)
-        else:
-            self.setPinValue(pinName=AtcHalPin.IR_ENABLED, pinVal=0)
-        self.w.MAIN.PREFS_.putpref(ConfigElement.IR_ENABLED, b, bool, ConfigElement.ATC_SECTION)
-        self.w.btn_ir_enabled.setChecked(b)
+        self.params.set(ConfigElement.IR_ENABLED, b)
 
     def setCoverEnabled(self, b:bool):
-        if b == True:
-            self.setPinValue(pinName=AtcHalPin.COVER_ENABLED, pinVal=1)
-        else:
-            self.setPinValue(pinName=AtcHalPin.COVER_ENABLED, pinVal=0)
-        self.w.MAIN.PREFS_.putpref(ConfigElement.COVER_ENABLED, b, bool, ConfigElement.ATC_SECTION)
-        self.w.btnCoverEnabled.setChecked(b)
+        self.params.set(ConfigElement.COVER_ENABLED, b)
 
         #info = "I LIKE CHEEEEEEZE!"
         #mess = {'NAME':'MESSAGE', 'TITLE':'SOME TITLE', 'ICON':'WARNING', 'ID':'__test1__', 'MESSAGE':'OVERWRITE FILE?', 'MORE':info, 'TYPE':'YESNO','NONBLOCKING':True}
         #ACTION.CALL_DIALOG(mess)
 
+    def setAllowDirectTraverse(self, b:bool):
+        self.params.set(ConfigElement.ALLOW_DIRECT_TRAVERSE, b)
+
+    def setEventWaits(self, b:bool):
+        self.params.set(ConfigElement.EVENT_WAITS, b)
+
+    def setPrestage(self, b:bool):
+        self.params.set(ConfigElement.PRESTAGE, b)
+
+    def setProbeCacheMinutes(self, minutes:float):
+        self.toolCache.max_age = minutes * 60.0
+
+    def setProbeCacheChanges(self, changes:int):
+        self.toolCache.max_changes = changes
+
+    def setSlowRefresh(self, interval_ms:int):
+        self.view.setSlowInterval(interval_ms)
+
+    def bindIRPin(self, n:int):
+        self.bindDigitalPin('ir', 'in', n)
+
+    def bindCoverPin(self, n:int):
+        self.bindDigitalPin('cover', 'out', n)
+
+    def bindDigitalPin(self, key:str, direction:str, n:int):
+        try:
+            name = motion_dio_pin(direction, n)
+        except ValueError as e:
+            status_log.error(f'Not monitoring the {key} pin: {e}')
+            self.halPins.unbind(key)
+            return
+        if self.halPins.bind(key, name):
+            status_log.debug(f'{key} pin is {name}')
+
     def toggleDustCover(self):
         #b = self.c[AtcHalPin.DUST_COVER_STATE]
-        cover_state = QHAL.getvalue(f'motion.digital-out-0{self.coverDPinInput.text()}')
+        if 'cover' not in self.halPins.names:
+            status_log.error('No dust cover output to toggle, check the cover DPIN setting')
+            return
+        cover_state = self.halPins.read_one('cover')
         #self.w.ledIRTrigger.currentState = bool(ir_stat)
         if cover_state == False:
             self.executeProgram('o<_dust_cover_op> call [1]')
@@ -762,44 +1194,60 @@ class HandlerClass:
             self.executeProgram('o<_dust_cover_op> call [0]')
         
     def dialog_return(self, w, message):
-        print('RETURN FROM DIALOG')
+        log.debug('RETURN FROM DIALOG')
         rtn = message.get('RETURN')
         code = bool(message.get('ID') == '__test1__')
         name = bool(message.get('NAME') == 'MESSAGE')
         if code and name and not rtn is None:
-            print('Entry return value from {} = {}'.format(code, rtn))
+            log.debug('Entry return value from {} = {}'.format(code, rtn))
     
         
     def toggleAllHomed(self, w, data):
-        print(f'toggleAllHomed = {data}')
+        log.debug(f'toggleAllHomed = {data}')
         pass
 
     def updatePeriodic(self):
+        tick_start = time.perf_counter()
+        slow = self.view.slowDue()
         try:
-            homed = QHAL.getvalue('motion.is-all-homed')
-            machine_on = QHAL.getvalue('halui.machine.is-on')
+            pins = self.halPins.read() # the one HAL read for this cycle
+            ready = bool(pins['homed'] and pins['machine_on'])
             #if self.irEnabledInput:
-            ir_stat = QHAL.getvalue(f'motion.digital-in-0{int(self.irDPinInput.text())}')
-            self.w.ledIRTrigger.setState(bool(ir_stat))
-            self.w.gbToolActions.setEnabled((homed & machine_on))
-            self.w.gbMacros.setEnabled((homed & machine_on))
-            self.w.lblMachineOnNotice.setVisible(not (homed & machine_on))
+            ir_stat = pins.get('ir', False)
+            v = self.view
+            v.set('ledIRTrigger.state', self.w.ledIRTrigger.setState, bool(ir_stat))
+            v.set('gbToolActions.enabled', self.w.gbToolActions.setEnabled, ready and not self.mdi.busy)
+            v.set('gbMacros.enabled', self.w.gbMacros.setEnabled, ready)
+            v.set('lblMachineOnNotice.visible', self.w.lblMachineOnNotice.setVisible, not ready)
+            batch_ok = ready and self.batch is None and not self.mdi.busy
+            v.set('btnBatchVerify.enabled', self.w.btnBatchVerify.setEnabled, batch_ok)
+            v.set('btnBatchMeasure.enabled', self.w.btnBatchMeasure.setEnabled, batch_ok)
+            v.set('btnBatchCycle.enabled', self.w.btnBatchCycle.setEnabled, batch_ok)
+            v.set('btnBatchCancel.enabled', self.w.btnBatchCancel.setEnabled, self.batch is not None)
             
-            s = self.getCurrentStat()#linuxcnc.stat()
-            s.poll()
+            s = self.status.poll() # the one poll for this cycle
+            self.sampleToolChangePhase(s)
+            self.updateToolChangePlan()
+            self.updateProbeCheck(s)
+            self.checkManualToolChange(s)
+            self.updateRackOccupancy(s)
+            self.updateRackCheck(s)
+            # tool/pocket fields only change on a tool change, refresh them at the slow rate
+            # unless the spindle tool differs from what we last rendered
+            if not slow and s.tool_in_spindle == self.currentTool:
+                return
             if s.tool_in_spindle == 0:
-                self.w.lblToolNo.setText('EMPTY')
+                v.set('lblToolNo.text', self.w.lblToolNo.setText, 'EMPTY')
                 self.currentTool = 0
                 self.currentToolPocketNo = 0
                 self.setPinValue(pinName=AtcHalPin.CURRENT_TOOL_POCKET, pinVal=0)
-                self.w.lblToolPocket.setText('NONE')
-                self.w.btnDropTool.setEnabled(False)
-                self.w.btnPickupTool.setEnabled(True)
+                v.set('lblToolPocket.text', self.w.lblToolPocket.setText, 'NONE')
+                v.set('btnDropTool.enabled', self.w.btnDropTool.setEnabled, False)
+                v.set('btnPickupTool.enabled', self.w.btnPickupTool.setEnabled, True)
             else:
                 if s.interp_state == linuxcnc.INTERP_IDLE:
                     self.currentTool = s.tool_in_spindle
-                    self.w.lblToolNo.setText(str(s.tool_in_spindle))
-                    self.tooldb.load_tool_db() # force a reload to catch any changes
+                    v.set('lblToolNo.text', self.w.lblToolNo.setText, str(s.tool_in_spindle))
 
                     #tool_dict = self.tooldb.get_tools()
                     #for k, v in tool_dict.items():
@@ -809,12 +1257,17 @@ class HandlerClass:
                     p = self.getToolPocketByIndex(s.tool_in_spindle)
                     self.currentToolPocketNo = p
                     self.setPinValue(pinName=AtcHalPin.CURRENT_TOOL_POCKET, pinVal=p)
-                    self.w.lblToolPocket.setText(str(p))
-                    self.w.btnDropTool.setEnabled(True)
-                    self.w.btnPickupTool.setEnabled(False)
+                    v.set('lblToolPocket.text', self.w.lblToolPocket.setText, str(p))
+                    v.set('btnDropTool.enabled', self.w.btnDropTool.setEnabled, True)
+                    v.set('btnPickupTool.enabled', self.w.btnPickupTool.setEnabled, False)
         except Exception as ex:
-            print(ex)
-            pass
+            # a bad pin name fails every tick, the repeat filter keeps this to one record per interval
+            periodic_log.error(f'Periodic update failed: {ex!r}', exc_info=True)
+        finally:
+            if slow:
+                self.toolTableWatcher.poll()
+                self.updateLogView()
+            self.status.record_tick((time.perf_counter() - tick_start) * 1000.0)
 
 
     '''
@@ -833,64 +1286,607 @@ class HandlerClass:
     
 
             
+    def getMotionModel(self) -> MotionModel:
+        find = lambda sec, key, d: float(self.iniFile.find(sec, key) or d)
+        vel = tuple(find(f'AXIS_{a}', 'MAX_VELOCITY', 50.0) for a in 'XYZ')
+        accel = tuple(find(f'AXIS_{a}', 'MAX_ACCELERATION', 100.0) for a in 'XYZ')
+        return MotionModel(vel, accel, find('TRAJ', 'MAX_LINEAR_VELOCITY', max(vel)))
+
+    def getRackGeometry(self) -> RackGeometry:
+        return RackGeometry(
+            num_pockets=self.c[AtcHalPin.NUM_POCKETS],
+            first_pocket_x=self.c[AtcHalPin.FIRST_POCKET_X],
+            first_pocket_y=self.c[AtcHalPin.FIRST_POCKET_Y],
+            pocket_offset=self.c[AtcHalPin.POCKET_OFFSET],
+            align_axis=self.c[AtcHalPin.ALIGN_AXIS],
+            safe_z=self.c[AtcHalPin.SAFE_Z],
+            z_ir_engage=self.c[AtcHalPin.Z_IR_ENGAGE],
+            engage_z=self.c[AtcHalPin.ENGAGE_Z],
+            traverse_z=self.traverseZ,
+            allow_direct=self.allowDirectTraverse)
+
+    def getToolChangePlanner(self) -> ToolChangePlanner:
+        timings = MacroTimings(cover_enabled=bool(self.c[AtcHalPin.COVER_ENABLED]),
+                               cover_dwell=self.c[AtcHalPin.COVER_DWELL],
+                               cover_settle=self.c[AtcHalPin.COVER_SETTLE],
+                               spinup_dwell=self.c[AtcHalPin.SPINUP_DWELL],
+                               spindle_stop_dwell=self.c[AtcHalPin.SPINDLE_STOP_DWELL],
+                               ir_settle_dwell=self.c[AtcHalPin.IR_SETTLE_DWELL],
+                               drop_feed_rate=self.c[AtcHalPin.DROP_RATE],
+                               pickup_feed_rate=self.c[AtcHalPin.PICKUP_RATE],
+                               prestage=bool(self.c[AtcHalPin.PRESTAGE]))
+        return ToolChangePlanner(self.getRackGeometry(), self.motionModel, timings)
+
+    def updateToolChangePlan(self):
+        '''
+            Plan the change from the current pocket to the prepared tool's pocket and publish it
+            on the plan_* pins. tool_change.ngc only uses the plan when its pockets match.
+        '''
+        prep_tool = self.halPins.get('prep_tool', 0)
+        to_pocket = self.tooldb.get_tool_pocket(prep_tool) if prep_tool > 0 else 0
+        planner = self.getToolChangePlanner()
+        key = (self.currentToolPocketNo, to_pocket, tuple(vars(planner.rack).values()),
+               tuple(vars(planner.timings).values()))
+        if key == self.planKey:
+            return
+        self.planKey = key
+        plan = planner.plan(self.currentToolPocketNo, to_pocket)
+        tx, ty = planner.rack.pocket_xy(to_pocket)
+        self.setPinValue(pinName=AtcHalPin.PLAN_FROM_POCKET, pinVal=plan.from_pocket)
+        self.setPinValue(pinName=AtcHalPin.PLAN_TO_POCKET, pinVal=plan.to_pocket)
+        self.setPinValue(pinName=AtcHalPin.PLAN_TRAVERSE_Z, pinVal=planner.rack.traverse_z)
+        self.setPinValue(pinName=AtcHalPin.PLAN_X, pinVal=tx)
+        self.setPinValue(pinName=AtcHalPin.PLAN_Y, pinVal=ty)
+        self.setPinValue(pinName=AtcHalPin.PLAN_DIRECT, pinVal=1 if plan.direct else 0)
+        if plan.direct:
+            log.debug(f'Tool change plan: {plan}')
+
+    def onToolTableChanged(self):
+        '''
+            The watcher reloaded a changed tool table: refresh what depends on its pockets, update
+            the tool library rows that changed and let LinuxCNC catch up. A program's own G10 L1 writes are already
+            in LinuxCNC's table, so LinuxCNC only reloads it while the interpreter is idle.
+        '''
+        status_log.debug(f'Tool table changed on disk, {len(self.tooldb.tools)} tool(s)')
+        self.rackCheckKey = None
+        s = self.getCurrentStat()
+        if s.tool_in_spindle > 0:
+            p = self.getToolPocketByIndex(s.tool_in_spindle)
+            self.currentToolPocketNo = p
+            self.setPinValue(pinName=AtcHalPin.CURRENT_TOOL_POCKET, pinVal=p)
+            self.view.set('lblToolPocket.text', self.w.lblToolPocket.setText, str(p))
+        self.toolModel.refresh()
+        if s.interp_state == linuxcnc.INTERP_IDLE:
+            self.mdi.load_tool_table()
+
+    def updateProbeCheck(self, s):
+        '''
+            Refresh the probe_prior and probe_cached pins. _auto_probe_tool asks for them with a new
+            number on probe_check_request and only trusts them once probe_check_ack echoes it, the
+            answer also picks up a tool table written since the watcher last looked, so it is from
+            a tick that saw the prepared tool, the active work offset and the current table.
+        '''
+        request = self.c[AtcHalPin.PROBE_CHECK_REQUEST]
+        answer = request != self.probeCheckAck
+        if answer:
+            self.tooldb.load_tool_db()
+        self.updateProbePrior()
+        self.updateProbeCache(s)
+        if answer:
+            self.probeCheckAck = request
+            self.setPinValue(pinName=AtcHalPin.PROBE_CHECK_ACK, pinVal=request) # after the probe pins
+
+    def updateProbePrior(self):
+        '''
+            Publish the prepared tool's length from the tool table and the work Z offset it was
+            measured at, _auto_probe_tool rapids to just above where that length touches the setter
+            and only searches probe_window either side while that offset is still the active one
+        '''
+        prep_tool = self.halPins.get('prep_tool', 0)
+        length = self.tooldb.get_tool_length(prep_tool) if prep_tool > 0 else None
+        # only a length the cache saw measured has a known offset, a zero length was never measured
+        z_offset = self.toolCache.measured_z_offset(prep_tool, length) if length else None
+        key = (prep_tool, length, z_offset) if z_offset is not None else (0, 0.0, 0.0)
+        if key == self.probePriorKey:
+            return
+        self.probePriorKey = key
+        self.setPinValue(pinName=AtcHalPin.PROBE_PRIOR_TOOL, pinVal=key[0])
+        self.setPinValue(pinName=AtcHalPin.PROBE_PRIOR_LENGTH, pinVal=key[1])
+        self.setPinValue(pinName=AtcHalPin.PROBE_PRIOR_Z_OFFSET, pinVal=key[2])
+
+    def updateProbeCache(self, s):
+        '''
+            Book the changes the profiler finished in the tool length cache and publish on the
+            probe_cached pins whether _auto_probe_tool may use the prepared tool's cached length
+        '''
+        cache = self.toolCache
+        new = self.profiler.completed - self.cacheSeen
+        if new > 0:
+            self.cacheSeen = self.profiler.completed
+            for record in list(self.profiler.records)[-new:]:
+                codes = {int(code) for code, _, _ in record['p']}
+                if any(code // 10 == 2 for code in codes):
+                    cache.count_change()
+                if ToolChangeProfiler.PROBE_MEASURED in codes and s.tool_in_spindle > 0:
+                    self.tooldb.load_tool_db() # G10 L1 rewrote the table, don't wait for the watcher's debounce
+                    tool = s.tool_in_spindle
+                    entry = cache.record(tool, self.tooldb.get_tool_pocket(tool), self.tooldb.get_tool_length(tool),
+                                         self.workZOffset(s))
+                    cache_log.info(f'T{tool} measured, length {entry.length} at Z offset {entry.z_offset} cached '
+                                   f'(miss {cache.misses})')
+                elif ToolChangeProfiler.PROBE_CACHED in codes:
+                    cache.hit()
+                    cache_log.info(f'T{s.tool_in_spindle} used its cached length (hit {cache.hits})')
+            try:
+                cache.save()
+            except OSError as e:
+                cache_log.error(f'Unable to write the tool length cache {cache.cachepath}: {e}')
+            self.w.lblProbeCacheStats.setText(f'HITS {cache.hits}  MISSES {cache.misses}')
+        prep_tool = self.halPins.get('prep_tool', 0)
+        if not self.probeCacheEnabled:
+            reason = 'disabled'
+        elif prep_tool <= 0:
+            reason = 'no tool prepared'
+        elif self.batch is not None and self.batch.op == MEASURE:
+            reason = 'measuring every tool'
+        else:
+            reason = cache.check(prep_tool, self.tooldb.get_tool_pocket(prep_tool),
+                                 self.tooldb.get_tool_length(prep_tool), self.workZOffset(s))
+        key = (prep_tool, reason)
+        if key == self.probeCacheKey:
+            return
+        self.probeCacheKey = key
+        self.setPinValue(pinName=AtcHalPin.PROBE_CACHED, pinVal=1 if reason is None else 0)
+        self.setPinValue(pinName=AtcHalPin.PROBE_CACHED_TOOL, pinVal=prep_tool if reason is None else 0)
+        if prep_tool > 0 and self.probeCacheEnabled:
+            cache_log.debug(f'T{prep_tool}: ' + ('cached length trusted' if reason is None else f'will be probed, {reason}'))
+
+    @staticmethod
+    def workZOffset(s) -> float:
+        '''
+            The active G5x + G92 Z offset, the tool lengths _auto_probe_tool writes are relative to it
+        '''
+        return round(s.g5x_offset[2] + s.g92_offset[2], 4)
+
+    def checkManualToolChange(self, s):
+        '''
+            The spindle tool changed between two idle ticks without a tool change finishing, e.g. M61
+            from the M61 button or MDI. The holder may have been swapped by hand, so that tool is probed again.
+        '''
+        if s.interp_state != linuxcnc.INTERP_IDLE:
+            return
+        tool = s.tool_in_spindle
+        manual = self.cacheTool is not None and tool != self.cacheTool \
+            and self.cacheToolChanges == self.profiler.completed and self.profiler.active is None
+        self.cacheTool = tool
+        self.cacheToolChanges = self.profiler.completed
+        if manual and self.toolCache.invalidate(tool, 'M61'):
+            cache_log.info(f'T{tool} loaded by hand, its cached length will not be used')
+            try:
+                self.toolCache.save()
+            except OSError as e:
+                cache_log.error(f'Unable to write the tool length cache {self.toolCache.cachepath}: {e}')
+
+    def loadRack(self):
+        '''
+            The rack as it was saved, or as the tool table says when there is no usable state file
+        '''
+        if self.rack.load():
+            rack_log.debug(f'Rack state loaded, {self.rack.num_pockets} pocket(s)')
+            self.updateRackOccupancy(self.getCurrentStat())
+        else:
+            self.seedRack()
+
+    def seedRack(self):
+        '''
+            Every pocket holds the tool the tool table assigns to it, except the spindle tool's pocket
+        '''
+        self.tooldb.load_tool_db()
+        self.rack.resize(int(self.c[AtcHalPin.NUM_POCKETS]))
+        self.rack.seed(self.tooldb.pocket_to_tool, self.getCurrentStat().tool_in_spindle)
+        rack_log.info('Rack occupancy taken from the tool table')
+        self.saveRack()
+
+    def saveRack(self):
+        try:
+            self.rack.save()
+        except OSError as e:
+            rack_log.error(f'Unable to write the rack state {self.rack.statepath}: {e}')
+
+    def setRackPocket(self, full:bool):
+        '''
+            Correct one pocket by hand, a full pocket holds the tool the tool table assigns to it
+        '''
+        try:
+            pocket = int(self.w.leRackPocket.text())
+        except ValueError:
+            pocket = 0
+        if not self.rack.in_rack(pocket):
+            rack_log.warning(f'Pocket {self.w.leRackPocket.text()!r} is not in the rack')
+            return
+        self.tooldb.load_tool_db()
+        tool = self.tooldb.get_pocket_tool(pocket) if full else EMPTY
+        if tool < 0:
+            tool = UNKNOWN
+        if self.rack.set(pocket, tool):
+            rack_log.info(f'Pocket {pocket} marked ' + ('empty' if tool == EMPTY else 'full'))
+            self.saveRack()
+
+    def updateRackOccupancy(self, s):
+        '''
+            Follow the spindle tool: a tool that leaves the spindle during a tool change went back to
+            its pocket, one that arrives came out of its pocket. A tool loaded by hand (M61) is no
+            longer in the rack. Where a tool unloaded by hand went is not known, the rack is left as is.
+        '''
+        rack = self.rack
+        num_pockets = int(self.c[AtcHalPin.NUM_POCKETS])
+        changed = False
+        if num_pockets != rack.num_pockets:
+            added = range(rack.num_pockets + 1, num_pockets + 1)
+            changed = rack.resize(num_pockets)
+            self.toolModel.setFilter(num_pockets=num_pockets)
+            rack.seed(self.tooldb.pocket_to_tool, s.tool_in_spindle, pockets=added)
+        tool = s.tool_in_spindle
+        if self.rackTool is not None and tool != self.rackTool:
+            old = self.rackTool
+            if self.profiler.active is not None or self.profiler.completed != self.rackChanges:
+                pocket = self.tooldb.get_tool_pocket(old) if old > 0 else 0
+                if rack.dropped(pocket, old):
+                    changed = True
+                    rack_log.info(f'T{old} dropped into pocket {pocket}')
+                pocket = self.tooldb.get_tool_pocket(tool) if tool > 0 else 0
+                if rack.removed(tool) | rack.picked(pocket):
+                    changed = True
+                    rack_log.info(f'T{tool} picked up from pocket {pocket}')
+            elif tool > 0 and rack.removed(tool):
+                changed = True
+                rack_log.info(f'T{tool} loaded by hand, its pocket is marked empty')
+        self.rackTool = tool
+        self.rackChanges = self.profiler.completed
+        if changed:
+            self.saveRack()
+        key = (rack.version, tool)
+        if key != self.rackViewKey:
+            self.rackViewKey = key
+            self.w.teRackView.setPlainText(rack.format_rack(tool))
+
+    def checkRack(self, spindle_tool:int, tool:int) -> int:
+        '''
+            RACK_OK when the change from spindle_tool to tool can start: the drop pocket is not known
+            to hold a tool and the pickup pocket is not known to be empty or to hold another tool
+        '''
+        drop = self.tooldb.get_tool_pocket(spindle_tool) if spindle_tool > 0 else 0
+        pickup = self.tooldb.get_tool_pocket(tool) if tool > 0 else 0
+        if drop == pickup: # measure only
+            return RACK_OK
+        code = self.rack.check_drop(drop) if drop > 0 else RACK_OK
+        if code == RACK_OK and pickup > 0:
+            code = self.rack.check_pickup(pickup, tool)
+        return code
+
+    def updateRackCheck(self, s):
+        '''
+            Publish on rack_check whether the prepared change may start, tool_change aborts before
+            any motion when it is not 0. tool_change asks for the check with a new number on
+            rack_check_request and only trusts rack_check once rack_check_ack echoes it, so the
+            answer is always from a tick that saw the prepared tool and the current rack.
+        '''
+        prep_tool = self.halPins.get('prep_tool', 0)
+        request = self.c[AtcHalPin.RACK_CHECK_REQUEST]
+        key = (prep_tool, s.tool_in_spindle, self.rack.version, request)
+        if key == self.rackCheckKey:
+            return
+        self.rackCheckKey = key
+        code = self.checkRack(s.tool_in_spindle, prep_tool) if prep_tool > 0 else RACK_OK
+        self.setPinValue(pinName=AtcHalPin.RACK_CHECK, pinVal=code)
+        self.setPinValue(pinName=AtcHalPin.RACK_CHECK_ACK, pinVal=request) # after rack_check
+        if code != RACK_OK:
+            rack_log.warning(f'T{s.tool_in_spindle} -> T{prep_tool}: {RACK_MESSAGES[code]}')
+
+    def getBatchPlanner(self) -> BatchPlanner:
+        return BatchPlanner(self.getToolChangePlanner())
+
+    def startBatch(self, op:str):
+        '''
+            Plan a batch operation on the rack (see atc_batch.py) as one sequence of steps and start it.
+            Measure and cycle leave out the tools the rack does not have, verify is what finds them.
+        '''
+        s = self.getCurrentStat()
+        if self.batch is not None or self.mdi.busy or s.interp_state != linuxcnc.INTERP_IDLE:
+            batch_log.warning(f'Not starting {op}, the machine is busy')
+            return
+        if op == VERIFY and not self.c[AtcHalPin.IR_ENABLED]:
+            batch_log.warning('Verifying the pockets needs the IR sensor, it is disabled')
+            return
+        self.tooldb.load_tool_db()
+        planner = self.getBatchPlanner()
+        spindle_tool = s.tool_in_spindle
+        spindle = (spindle_tool, self.tooldb.get_tool_pocket(spindle_tool)) if spindle_tool > 0 else (0, 0)
+        if spindle_tool > 0 and not planner.rack.in_rack(spindle[1]):
+            batch_log.warning(f'T{spindle_tool} is not a rack tool, unload it before a batch')
+            return
+        tools = self.getSelectedToolFromTable() if op == CYCLE else list(self.tooldb.tools)
+        targets = {}
+        for tool in tools:
+            pocket = self.tooldb.get_tool_pocket(tool)
+            if op != VERIFY and tool != spindle_tool and planner.rack.in_rack(pocket):
+                code = self.rack.check_pickup(pocket, tool)
+                if code != RACK_OK:
+                    batch_log.warning(f'Leaving out T{tool}: {RACK_MESSAGES[code]} (pocket {pocket})')
+                    continue
+            targets[tool] = pocket
+        if op == VERIFY:
+            plan = planner.verify(targets, spindle, restore=spindle)
+        elif op == MEASURE:
+            plan = planner.measure(targets, spindle)
+        else:
+            plan = planner.cycle(targets, spindle)
+            for tool, reason in plan.skipped:
+                batch_log.warning(f'Leaving out T{tool}: {reason}')
+        if not plan.targets:
+            batch_log.warning(f'Nothing to {op}')
+            return
+        self.batch = BatchRun(plan, spindle, restore=spindle if op == VERIFY else (0, 0))
+        batch_log.info(f'{op} of {len(plan.targets)} tool(s) in {len(plan.steps)} steps, '
+                       f'about {plan.seconds_saved:.0f}s less than one pickup and drop at a time')
+        batch_log.debug(plan.format_summary())
+        if op == MEASURE:
+            self.probeCacheKey = None
+            self.updateProbeCache(s) # the prepared tool's cached length is not trusted from now on
+        self.submitBatch()
+
+    def submitBatch(self):
+        '''
+            Queue the next step of the batch. The steps are queued one at a time, each after the
+            periodic update has seen the previous one finish, tool_change.ngc reads the spindle
+            tool's pocket from rapid_atc.current_tool_pocket.
+        '''
+        step = self.batch.step
+        self.w.lblBatchProgress.setText(self.batch.format_progress())
+        self.batchJob = self.mdi.submit(step.gcode, on_complete=lambda: self.onBatchStepDone(step),
+                                        on_error=lambda err: self.onBatchStepFailed(step, err))
+
+    def onBatchStepDone(self, step):
+        batch = self.batch
+        if batch is None or step is not batch.step:
+            return
+        if step.target:
+            batch.done.append(step.tool)
+            batch_log.debug(f'{batch.format_progress()} done')
+        self.updatePeriodic()
+        batch.index += 1
+        if batch.step is None:
+            self.finishBatch()
+        else:
+            self.submitBatch()
+
+    def onBatchStepFailed(self, step, err:str):
+        '''
+            A verify pickup that fails found its pocket empty: the pocket is marked empty and the
+            pockets that are left are planned again. Any other failure ends the batch.
+        '''
+        batch = self.batch
+        if batch is None or step is not batch.step:
+            return
+        if err == 'cancelled':
+            self.finishBatch('cancelled')
+            return
+        if batch.op != VERIFY or step.kind != BatchStep.PICKUP or not step.target:
+            self.finishBatch(f'{step.describe()} failed: {err}')
+            return
+        batch.failed.append((step.tool, step.pocket))
+        if self.rack.set(step.pocket, EMPTY):
+            self.saveRack()
+        batch_log.warning(f'T{step.tool} not found in pocket {step.pocket}, the pocket is marked empty')
+        self.updatePeriodic()
+        plan = self.getBatchPlanner().verify(batch.remaining(), restore=batch.restore, start_pocket=step.pocket)
+        if not plan.steps:
+            self.finishBatch()
+            return
+        batch.replan(plan)
+        self.submitBatch()
+
+    def finishBatch(self, error:str = None):
+        batch = self.batch
+        self.batch = None
+        self.batchJob = None
+        if batch.op == MEASURE:
+            self.probeCacheKey = None
+        if error is None:
+            text = batch.format_result()
+            batch_log.info(text)
+        else:
+            text = f'{batch.op.upper()} stopped, {error}'
+            batch_log.error(f'{text} ({batch.format_progress()})')
+        self.w.lblBatchProgress.setText(text)
+
+    def cancelBatch(self):
+        if self.batch is None:
+            return
+        job = self.batchJob
+        self.finishBatch('cancelled')
+        self.mdi.cancel(job)
+
+    def sampleToolChangePhase(self, s):
+        record = self.profiler.sample(int(round(self.c[AtcHalPin.ATC_PHASE])),
+                                      int(round(self.c[AtcHalPin.ATC_PHASE_POCKET])))
+        # a macro run from MDI ends without resetting the phase, close it once the interpreter is idle
+        if record is None and self.profiler.active is not None and s.interp_state == linuxcnc.INTERP_IDLE:
+            record = self.profiler.finish()
+        if record is not None:
+            self.updateCycleTimeSummary()
+
+    def updateCycleTimeSummary(self):
+        self.w.teCycleTimes.setPlainText(self.profiler.format_summary())
+
+    def updateLogView(self):
+        if LOGS.ring.version == self.logVersion:
+            return
+        self.logVersion = LOGS.ring.version
+        self.w.teAtcLog.setPlainText(LOGS.ring.text())
+        self.w.teAtcLog.moveCursor(QtGui.QTextCursor.End)
+
+    def prescanProgram(self, filename:str):
+        if not filename or not path.isfile(filename):
+            return
+        self.w.tePrescan.setPlainText(f'Scanning {path.basename(filename)}..')
+        self.prescan.request(filename)
+
+    def onPrescanFinished(self, result):
+        '''
+            Map the scanned tools with the current tool table and rack settings
+        '''
+        self.tooldb.load_tool_db()
+        ProgramScanner.evaluate(result, self.tooldb.get_tool_pocket, self.getToolChangePlanner(),
+                                current_tool=self.getCurrentStat().tool_in_spindle)
+        self.prescanResult = result
+        self.prescanHistory.pop(result.sha1, None)
+        self.prescanHistory[result.sha1] = [tool for _, tool in result.tools]
+        while len(self.prescanHistory) > 10:
+            self.prescanHistory.pop(next(iter(self.prescanHistory)))
+        if result.missing:
+            prescan_log.warning(f'{path.basename(result.filename)} uses tools that are not in the rack: '
+                        + ' '.join(f'T{t}' for t in result.missing))
+        self.w.tePrescan.setPlainText(result.format_summary())
+
+    def proposePocketLayout(self):
+        '''
+            Propose pockets for the tools of the programs scanned this session, see atc_layout.py
+        '''
+        if not self.prescanHistory:
+            self.w.tePrescan.setPlainText('Load a program first, the layout is based on its tool changes')
+            return
+        self.tooldb.load_tool_db()
+        optimizer = PocketLayoutOptimizer(self.getToolChangePlanner())
+        self.layoutProposal = optimizer.optimize(list(self.prescanHistory.values()), self.tooldb.tool_to_pocket)
+        layout_log.debug(f'Pocket layout proposed in {self.layoutProposal.elapsed_ms:.1f} ms')
+        self.w.tePrescan.setPlainText(f'{len(self.prescanHistory)} program(s)\n'
+                                      + self.layoutProposal.format_summary())
+        self.w.btnApplyLayout.setEnabled(True)
+
+    def applyPocketLayout(self):
+        if self.layoutProposal is None:
+            return
+        s = self.getCurrentStat()
+        if self.mdi.busy or s.interp_state != linuxcnc.INTERP_IDLE:
+            layout_log.warning('Not writing the pocket layout while the machine is busy')
+            return
+        try:
+            write_tool_table(self.toolTablePath, self.layoutProposal.layout, self.c[AtcHalPin.NUM_POCKETS])
+        except OSError as e:
+            layout_log.error(f'Unable to write the pocket layout to {self.toolTablePath}: {e}')
+            return
+        layout_log.info('Pocket layout written, move the tools in the rack to match the tool table '
+                        'and press FROM TOOL TABLE on the Rack tab')
+        self.layoutProposal = None
+        self.w.btnApplyLayout.setEnabled(False)
+        if self.tooldb.load_tool_db(force=True):
+            self.toolModel.refresh()
+        self.mdi.load_tool_table()
+
     def getToolPocketByIndex(self, index):
         return self.tooldb.get_tool_pocket(toolid=index)
         
             
     def getCurrentStat(self):
-        try:
-            s = linuxcnc.stat() # create a connection to the status channel
-            s.poll() # get current values
-            return s
-        except linuxcnc.error as detail:
-            log.error(f'Error: {detail}')
-            sys.exit(1)  
+        return self.status.snapshot()
+
+    def getStatusStats(self) -> dict:
+        return self.status.get_stats()
+
+    def getViewStats(self) -> dict:
+        return self.view.get_stats()
+
+    def getHalPinStats(self) -> dict:
+        return self.halPins.get_stats()
 
     def loadToolViaM61(self):
         t = self.getSelectedToolFromTable()
         if len(t) > 0:
             self.executeProgram(f'M61 Q{t[0]}')
            #emccanon.CHANGE_TOOL(2)
-            self.w.tooloffsetview.repaint()
-            cmd = linuxcnc.command()
-            cmd.load_tool_table()
             
 
+    def dropToolViaATC(self):
+        p = self.currentToolPocketNo
+        if self.rack.check_drop(p) != RACK_OK:
+            rack_log.warning(f'Not dropping T{self.currentTool}: pocket {p} already holds T{self.rack.tool_at(p)}')
+            return
+        self.executeProgram(f'o<_drop_tool> call [{p}]')
+
     def loadToolViaATC(self):
         t = self.getSelectedToolFromTable()
         if len(t) > 0:
             p = self.getToolPocketByIndex(t[0])
+            code = self.rack.check_pickup(p, t[0])
+            if code != RACK_OK:
+                rack_log.warning(f'Not picking up T{t[0]}: {RACK_MESSAGES[code]} (pocket {p})')
+                return
             self.executeProgram(f'o<_pickup_tool> call [{p}] [{t[0]}]')
-            #self.w.tooloffsetview.repaint()
-            #cmd = linuxcnc.command()
-            #cmd.load_tool_table()
 
         
     def getSelectedToolFromTable(self):
-        tool = self.w.tooloffsetview.get_checked_list()
+        tool = self.toolModel.checkedTools()
         return tool
+
+    def writeToolTable(self, changes:dict) -> bool:
+        '''
+            Change single tools of the table (see ToolTableReader.update), only while the interpreter
+            is idle, LinuxCNC reloads the table afterwards
+        '''
+        if self.getCurrentStat().interp_state != linuxcnc.INTERP_IDLE:
+            status_log.warning('Not changing the tool table while the machine is busy')
+            return False
+        try:
+            self.tooldb.update(changes)
+        except OSError as e:
+            status_log.error(f'Unable to write the tool table {self.toolTablePath}: {e}')
+            return False
+        self.toolModel.refresh()
+        self.rackCheckKey = None
+        self.mdi.load_tool_table()
+        return True
+
+    def addTool(self):
+        '''
+            The next free tool number, in the first free pocket after the rack
+        '''
+        tool = max(self.tooldb.tools, default=0) + 1
+        pocket = int(self.c[AtcHalPin.NUM_POCKETS]) + 1
+        while pocket in self.tooldb.pocket_to_tool:
+            pocket += 1
+        if self.writeToolTable({tool: {'P': pocket, COMMENT: 'New Tool'}}):
+            status_log.info(f'T{tool} added in pocket {pocket}')
+
+    def deleteTools(self):
+        tools = self.getSelectedToolFromTable()
+        spindle_tool = self.getCurrentStat().tool_in_spindle
+        if spindle_tool in tools:
+            status_log.warning(f'T{spindle_tool} is in the spindle, not deleting it')
+            tools.remove(spindle_tool)
+        if tools and self.writeToolTable({tool: None for tool in tools}):
+            status_log.info('Deleted ' + ' '.join(f'T{tool}' for tool in tools))
+
+    def editTool(self, tool:int, letter:str, value):
+        if self.writeToolTable({tool: {letter: value}}):
+            status_log.debug(f'T{tool} {letter} = {value}')
     
     def setXYPocketOne(self):
         stat = self.getCurrentStat()
         x_pos = round(stat.position[0], 3)
         y_pos = round(stat.position[1], 3)
-        
-        self.w.MAIN.PREFS_.putpref(ConfigElement.FIRST_POCKET_Y, str(x_pos), str, ConfigElement.ATC_SECTION)
-        self.firstPocketXInput.setText(str(x_pos))
-        self.w.MAIN.PREFS_.putpref(ConfigElement.FIRST_POCKET_X, str(y_pos), str, ConfigElement.ATC_SECTION)
-        self.firstPocketYInput.setText(str(y_pos))
+        self.params.set(ConfigElement.FIRST_POCKET_X, str(x_pos))
+        self.params.set(ConfigElement.FIRST_POCKET_Y, str(y_pos))
         
     def setZEngage(self):
         stat = self.getCurrentStat()
         z_pos = round(stat.position[2], 3)
-        self.w.MAIN.PREFS_.putpref(ConfigElement.Z_ENGAGE, str(z_pos), str, ConfigElement.ATC_SECTION)
-        self.zEngageInput.setText(str(z_pos))
+        self.params.set(ConfigElement.Z_ENGAGE, str(z_pos))
 
     def setZIREngage(self):
         stat = self.getCurrentStat()
         z_pos = round(stat.position[2], 3)
-        self.w.MAIN.PREFS_.putpref(ConfigElement.Z_IR_ENGAGE, str(z_pos), str, ConfigElement.ATC_SECTION)
-        self.zEngageIRInput.setText(str(z_pos))
+        self.params.set(ConfigElement.Z_IR_ENGAGE, str(z_pos))
 
     def isMachineMetric(self) -> bool:
         return INFO.MACHINE_IS_METRIC
@@ -902,9 +1898,19 @@ class HandlerClass:
     def closing_cleanup__(self):
         #print('***CLOSE***', self.w.belt_1.isChecked())
         log.debug(f'Calling cleanup for shutdown..')
+        log.debug(f'Status channel stats: {self.getStatusStats()}')
+        log.debug(f'View update stats: {self.getViewStats()}')
+        log.debug(f'HAL pin stats: {self.getHalPinStats()}')
+        log.debug(f'Tool table watcher stats: {self.toolTableWatcher.get_stats()}')
+        self.prescan.cancel()
+        self.toolTableWatcher.stop()
+        self.mdi.stop()
         self.c.exit() # Call Component's exist function per https://linuxcnc.org/docs/html/hal/halmodule.html
-        if self.w.MAIN.PREFS_:
-            pass
+        if self.prefs is not None:
+            self.prefs.close()
+            log.debug(f'Preference stats: {self.prefs.get_stats()}')
+        log.debug(f'Log stats: {LOGS.get_stats()}')
+        LOGS.stopFile()
 
     def __getitem__(self, item):
         return getattr(self, item) 
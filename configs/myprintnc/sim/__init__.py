@@ -0,0 +1,76 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    Hardware-free simulation of the machine for the RapidChange ATC handler and macros.
+
+    FakeMachine (machine.py) holds the HAL pins, position, spindle, rack and tool table and
+    a simulated clock. The stand-in linuxcnc, hal, debugpy and qtvcp modules in stubs/ talk
+    to it, and gcode.py runs the NGC macros against it, so rapidchange_handler.py can be
+    imported and driven headless (harness.py):
+
+        python3 -m sim T2 M6 T5 M6
+
+    from the configs/myprintnc directory, or from Python:
+
+        import sim
+        machine = sim.install(sim.FakeMachine.from_config(workdir))
+        harness = sim.HandlerHarness(machine)
+'''
+
+import sys
+from os import path
+
+HERE = path.dirname(path.abspath(__file__))
+CONFIG_DIR = path.dirname(HERE)
+QTVCP_DIR = path.join(CONFIG_DIR, 'qtvcp')
+STUBS_DIR = path.join(HERE, 'stubs')
+
+# the handler modules import each other as siblings, like QtVCP runs them
+if QTVCP_DIR not in sys.path:
+    sys.path.insert(0, QTVCP_DIR)
+
+from sim.machine import FakeMachine, current
+from sim.gcode import Interpreter, NgcError, NgcAbort
+
+def install_stubs():
+    '''
+        Put the stand-in modules in front of sys.path, they need a machine once they are used
+    '''
+    if STUBS_DIR not in sys.path:
+        sys.path.insert(0, STUBS_DIR)
+
+def install(machine:FakeMachine) -> FakeMachine:
+    '''
+        Make machine the one the stand-in modules talk to.
+        Installing another machine later switches the stand-ins over to it.
+    '''
+    install_stubs()
+    machine.install()
+    return machine
+
+def __getattr__(name):
+    # the harness needs PyQt5, only import it when asked for
+    if name == 'HandlerHarness':
+        from sim.harness import HandlerHarness
+        return HandlerHarness
+    raise AttributeError(name)
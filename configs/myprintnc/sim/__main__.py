@@ -0,0 +1,82 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Run MDI on the simulated machine with the handler loaded, print the messages and timings:
+
+        python3 -m sim [--tool 3] [--direct] [--python-remap] T2 M6 "o<_drop_tool> call [2]"
+'''
+
+import argparse
+import tempfile
+
+import sim
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run MDI commands on the simulated RapidChange machine')
+    parser.add_argument('--tool', type=int, default=0, help='tool in the spindle at the start')
+    parser.add_argument('--direct', action='store_true', help='allow the direct traverse between pockets')
+    parser.add_argument('--python-remap', action='store_true',
+                        help='run M6 through python/rapid_atc_remap.py instead of tool_change.ngc')
+    parser.add_argument('--quiet', action='store_true', help='only print the timings')
+    parser.add_argument('mdi', nargs='+', help='MDI words, a new command starts at every M6 or o-word call')
+    args = parser.parse_args(argv)
+
+    commands = []
+    for word in args.mdi:
+        if not commands or commands[-1].upper().endswith('M6') or word.lower().startswith('o<'):
+            commands.append(word)
+        else:
+            commands[-1] += f' {word}'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        remap = 'M6 modalgroup=6 python=rapid_tool_change' if args.python_remap else None
+        machine = sim.install(sim.FakeMachine.from_config(workdir, remap=remap))
+        harness = sim.HandlerHarness(machine)
+        if args.tool:
+            machine.load_tool(args.tool)
+        harness.w.pbAllowDirectTraverse.click(args.direct)
+        harness.tick()
+        status = 0
+        for command in commands:
+            shown = len(machine.messages)
+            try:
+                seconds = machine.run(command)
+                result = f'{seconds:.2f}s'
+            except sim.NgcError as e:
+                result = f'ERROR {e}'
+                status = 1
+            harness.tick()
+            if not args.quiet:
+                for clock, kind, text in list(machine.messages)[shown:]:
+                    print(f'{clock:9.3f} {kind:<6}{text}')
+            print(f'{command}: {result}')
+            if status:
+                break
+        print(harness.handler.profiler.format_summary())
+        print(machine.get_stats())
+        harness.close()
+    return status
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,828 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    A small RS274NGC interpreter that runs the ATC macros against a FakeMachine the way
+    milltask would, motion and dwells advance the machine's simulated clock. It covers what
+    the macros use:
+
+        O-words     sub endsub call return if elseif else endif while endwhile break continue
+        parameters  #1-#30 per call, named locals, #<_globals>, #<_hal[pin]>, #<_ini[section]key>
+        G           0 1 4 10L1 10L2 17 20 21 38.2 38.3 40 43 49 53 54 61 64 90 91
+        M           2 3 4 5 6 (remapped like stdglue change_prolog/epilog) 30 61 64 65 66 67 68 70-73
+        comments    (print,) (MSG,) (DEBUG,) (ABORT,)
+        remaps      ngc= with the stdglue prolog/epilog, python= generators (RemapContext)
+
+    G54 is the only coordinate system, set with G10 L2 P0/P1 and added to every position that
+    is not G53 together with the machine's G92 offset (there is no G92 word). #5061-#5063,
+    #<_x>.. and #5210-#5213, #5220-#5223 report them like LinuxCNC. Tool offsets are not applied.
+'''
+
+import importlib
+import inspect
+import math
+import re
+import sys
+from os import path
+
+STATEMENT = re.compile(r'o(<[^>]*>|\d+)(endsub|endwhile|endif|elseif|else|sub|call|return|if|while|break|continue)(.*)$')
+NUMBER = re.compile(r'\d+\.?\d*|\.\d+')
+WORD = re.compile(r'[a-z]+')
+PARAM = re.compile(r'#<([^>]+)>|#(\d+)')
+FORMAT = re.compile(r'%l?\.?\d*[fd]')
+
+# precedence, all binary operators are left associative
+OPERATORS = (('**', 4), ('*', 3), ('/', 3), ('mod', 3), ('+', 2), ('-', 2),
+             ('eq', 1), ('ne', 1), ('gt', 1), ('ge', 1), ('lt', 1), ('le', 1),
+             ('and', 0), ('or', 0), ('xor', 0))
+TOLERANCE_EQUAL = 0.0001
+FUNCTIONS = {
+    'abs': abs, 'acos': lambda v: math.degrees(math.acos(v)), 'asin': lambda v: math.degrees(math.asin(v)),
+    'cos': lambda v: math.cos(math.radians(v)), 'exp': math.exp, 'fix': math.floor, 'fup': math.ceil,
+    'round': lambda v: float(math.floor(v + 0.5)), 'ln': math.log, 'sin': lambda v: math.sin(math.radians(v)),
+    'sqrt': math.sqrt, 'tan': lambda v: math.tan(math.radians(v)),
+}
+G_CODES = {0, 10, 40, 100, 170, 200, 210, 382, 383, 400, 430, 490, 530, 540, 610, 640, 900, 910}
+M_CODES = {0, 1, 2, 3, 4, 5, 6, 30, 61, 64, 65, 66, 67, 68, 70, 71, 72, 73}
+MOTION = (0, 10, 382, 383)
+
+class NgcError(Exception):
+    pass
+
+class NgcAbort(NgcError):
+    pass
+
+'''
+    One line of a program, split into the code (lower case, no spaces) and its comments
+'''
+class Block():
+    __slots__ = ('filename', 'lineno', 'code', 'comments', 'statement')
+
+    def __init__(self, text:str, filename:str = 'MDI', lineno:int = 0) -> None:
+        self.filename = filename
+        self.lineno = lineno
+        code = []
+        comments = []
+        depth = 0
+        comment = ''
+        for c in text:
+            if depth:
+                if c == ')':
+                    depth = 0
+                    comments.append(comment)
+                    comment = ''
+                else:
+                    comment += c
+            elif c == '(':
+                depth = 1
+            elif c == ';':
+                break
+            elif not c.isspace():
+                code.append(c.lower())
+        self.code = ''.join(code).lstrip('/')
+        self.comments = comments
+        m = STATEMENT.match(self.code)
+        self.statement = m.groups() if m else None
+
+    def where(self) -> str:
+        return f'{path.basename(self.filename)}:{self.lineno}'
+
+'''
+    A subroutine file, the lines between o<name> sub and o<name> endsub with the jumps of
+    its if/while blocks resolved up front
+'''
+class Sub():
+    def __init__(self, name:str, filename:str) -> None:
+        self.name = name
+        self.filename = filename
+        with open(filename, 'r') as file:
+            blocks = [Block(line, filename, n) for n, line in enumerate(file, 1)]
+        label = f'<{name}>'
+        start = next((i for i, b in enumerate(blocks) if b.statement and b.statement[:2] == (label, 'sub')), None)
+        end = next((i for i, b in enumerate(blocks) if b.statement and b.statement[:2] == (label, 'endsub')), None)
+        if start is None or end is None or end < start:
+            raise NgcError(f'{filename}: no o{label} sub .. endsub')
+        self.body = blocks[start + 1:end + 1]
+        self.next_branch = {} # if/elseif -> the next elseif/else/endif
+        self.endif = {} # elseif/else -> endif
+        self.loops = {} # while <-> endwhile
+        self.loop_of = {} # break/continue -> while
+        stack = []
+        for i, b in enumerate(self.body):
+            if b.statement is None:
+                continue
+            label, kw, _ = b.statement
+            if kw in ('if', 'while'):
+                stack.append((label, kw, i, []))
+            elif kw in ('elseif', 'else', 'endif', 'endwhile'):
+                opener = 'while' if kw == 'endwhile' else 'if'
+                if not stack or stack[-1][0] != label or stack[-1][1] != opener:
+                    raise NgcError(f'{b.where()}: o{label} {kw} without o{label} {opener}')
+                if kw in ('elseif', 'else'):
+                    stack[-1][3].append(i)
+                    continue
+                _, _, first, branches = stack.pop()
+                if kw == 'endwhile':
+                    self.loops[first] = i
+                    self.loops[i] = first
+                    continue
+                chain = [first] + branches + [i]
+                for a, c in zip(chain, chain[1:]):
+                    self.next_branch[a] = c
+                for e in branches:
+                    self.endif[e] = i
+            elif kw in ('break', 'continue'):
+                loop = next((s for s in reversed(stack) if s[1] == 'while'), None)
+                if loop is None:
+                    raise NgcError(f'{b.where()}: o{label} {kw} outside a loop')
+                self.loop_of[i] = loop[2]
+        if stack:
+            raise NgcError(f'{filename}: o{stack[-1][0]} {stack[-1][1]} is not closed')
+
+class Frame():
+    __slots__ = ('numbered', 'named')
+
+    def __init__(self, args:list = (), named:dict = None) -> None:
+        self.numbered = {i + 1: float(v) for i, v in enumerate(args)}
+        self.named = dict(named or {})
+
+'''
+    Parses and evaluates the code of one block, values are computed while parsing
+'''
+class Line():
+    def __init__(self, interp, text:str, block:Block = None) -> None:
+        self.interp = interp
+        self.s = text
+        self.pos = 0
+        self.block = block
+
+    def error(self, msg:str):
+        where = f'{self.block.where()}: ' if self.block is not None else ''
+        return NgcError(f'{where}{msg} in "{self.s}"')
+
+    def done(self) -> bool:
+        return self.pos >= len(self.s)
+
+    def peek(self) -> str:
+        return self.s[self.pos] if self.pos < len(self.s) else ''
+
+    def expect(self, c:str):
+        if self.peek() != c:
+            raise self.error(f'expected "{c}" at {self.pos}')
+        self.pos += 1
+
+    def number(self) -> float:
+        m = NUMBER.match(self.s, self.pos)
+        if m is None:
+            raise self.error(f'bad number at {self.pos}')
+        self.pos = m.end()
+        return float(m.group())
+
+    def param_ref(self) -> tuple:
+        self.expect('#')
+        c = self.peek()
+        if c == '<':
+            end = self.s.find('>', self.pos)
+            if end < 0:
+                raise self.error('unterminated named parameter')
+            name = self.s[self.pos + 1:end]
+            self.pos = end + 1
+            return ('named', name)
+        if c == '[':
+            return ('num', int(round(self.expression())))
+        if c == '#':
+            return ('num', int(round(self.interp.read(self.param_ref()))))
+        return ('num', int(self.number()))
+
+    def real_value(self) -> float:
+        c = self.peek()
+        if c == '[':
+            return self.expression()
+        if c == '#':
+            return self.interp.read(self.param_ref())
+        if c in '+-' and c:
+            self.pos += 1
+            value = self.real_value()
+            return -value if c == '-' else value
+        if c.isdigit() or c == '.':
+            return self.number()
+        m = WORD.match(self.s, self.pos)
+        if m is not None:
+            name = m.group()
+            self.pos = m.end()
+            if name == 'exists':
+                self.expect('[')
+                key = self.param_ref()
+                self.expect(']')
+                return 1.0 if self.interp.exists(key) else 0.0
+            if name == 'atan':
+                y = self.expression()
+                self.expect('/')
+                return math.degrees(math.atan2(y, self.expression()))
+            if name in FUNCTIONS:
+                return float(FUNCTIONS[name](self.expression()))
+            raise self.error(f'unknown function {name}')
+        raise self.error(f'bad value at {self.pos}')
+
+    def expression(self) -> float:
+        self.expect('[')
+        value = self.binary(0)
+        self.expect(']')
+        return value
+
+    def operator(self):
+        for op, prec in OPERATORS:
+            if self.s.startswith(op, self.pos):
+                return op, prec
+        return None, -1
+
+    def binary(self, min_prec:int) -> float:
+        left = self.real_value()
+        while True:
+            op, prec = self.operator()
+            if op is None or prec < min_prec:
+                return left
+            self.pos += len(op)
+            left = apply(op, left, self.binary(prec + 1))
+
+    def assignments(self):
+        '''
+            #n=value and #<name>=value at the start of the line, set after they are all read
+        '''
+        values = []
+        while self.peek() == '#':
+            key = self.param_ref()
+            self.expect('=')
+            values.append((key, self.real_value()))
+        for key, value in values:
+            self.interp.write(key, value)
+
+    def words(self) -> tuple:
+        g = []
+        m = []
+        words = {}
+        while not self.done():
+            letter = self.s[self.pos]
+            if not letter.isalpha():
+                raise self.error(f'bad character "{letter}"')
+            self.pos += 1
+            value = self.real_value()
+            if letter == 'g':
+                g.append(int(round(value * 10)))
+            elif letter == 'm':
+                m.append(int(round(value)))
+            elif letter == 'n':
+                continue
+            elif letter in words:
+                raise self.error(f'{letter.upper()} word repeated')
+            else:
+                words[letter] = value
+        return g, m, words
+
+    def values(self) -> list:
+        values = []
+        while not self.done():
+            values.append(self.expression())
+        return values
+
+def apply(op:str, a:float, b:float) -> float:
+    if op == '**':
+        return a ** b
+    if op == '*':
+        return a * b
+    if op == '/':
+        if b == 0:
+            raise NgcError('Attempt to divide by zero')
+        return a / b
+    if op == 'mod':
+        return math.fmod(a, b) if a >= 0 else math.fmod(a, b) + abs(b)
+    if op == '+':
+        return a + b
+    if op == '-':
+        return a - b
+    if op == 'eq':
+        return float(abs(a - b) < TOLERANCE_EQUAL)
+    if op == 'ne':
+        return float(abs(a - b) >= TOLERANCE_EQUAL)
+    if op == 'gt':
+        return float(a > b)
+    if op == 'ge':
+        return float(a >= b)
+    if op == 'lt':
+        return float(a < b)
+    if op == 'le':
+        return float(a <= b)
+    if op == 'and':
+        return float(a != 0 and b != 0)
+    if op == 'or':
+        return float(a != 0 or b != 0)
+    return float((a != 0) != (b != 0))
+
+'''
+    The self a Python remap gets from milltask's interpreter, the parts rapid_atc_remap.py uses.
+    execute() runs one block right away, the machine is synced when the remap yields
+    INTERP_EXECUTE_FINISH.
+'''
+class RemapContext():
+    def __init__(self, interp) -> None:
+        mc = interp.machine
+        self.interp = interp
+        self.machine = mc
+        self.task = interp.task
+        self.selected_tool = mc.pins['iocontrol.0.tool-prep-number']
+        self.selected_pocket = mc.pins['iocontrol.0.tool-prep-pocket']
+        self.current_pocket = max(mc.tool_pocket(mc.tool_in_spindle), 0)
+        self.cutter_comp_side = 0
+        self.toolchange_flag = False
+        self.errormsg = None
+        self.params = RemapParams(interp)
+
+    @property
+    def current_tool(self) -> int:
+        return self.machine.tool_in_spindle
+
+    def execute(self, text:str, lineno:int = 0):
+        from interpreter import InterpreterException
+        try:
+            self.interp.execute(text)
+        except NgcAbort:
+            raise
+        except NgcError as e:
+            raise InterpreterException(lineno, text, str(e)) from None
+
+    def set_errormsg(self, message:str):
+        self.errormsg = message
+
+    def set_tool_parameters(self):
+        pass
+
+class RemapParams():
+    '''
+        self.params, #<name> / #n by name or number
+    '''
+    def __init__(self, interp) -> None:
+        self.interp = interp
+
+    @staticmethod
+    def key(key) -> tuple:
+        return ('num', int(key)) if isinstance(key, (int, float)) else ('named', key.lower())
+
+    def __getitem__(self, key) -> float:
+        return self.interp.read(self.key(key))
+
+    def __setitem__(self, key, value:float):
+        self.interp.write(self.key(key), float(value))
+
+class Interpreter():
+    def __init__(self, machine, subroutine_path:list, remaps:dict = None, max_loops:int = 100000,
+                 max_depth:int = 50) -> None:
+        self.machine = machine
+        self.subroutine_path = subroutine_path
+        self.remaps = remaps or {}
+        self.max_loops = max_loops
+        self.max_depth = max_depth
+        self.subs = {}
+        self.globals = {'_value': 0.0, '_value_returned': 0.0}
+        self.frames = [Frame()]
+        self.motion_mode = 0
+        self.absolute = True
+        self.metric = machine.metric
+        self.feed = 0.0
+        self.speed = 0.0
+        self.tool_offset = False
+        self.in_remap = False
+        self.sync_on_wait = True # M66 syncs, a Python remap syncs when it yields instead
+        self.lines_executed = 0
+        self.task = 1 # 0 runs the remaps like the GUI's preview interpreter
+
+    #############
+    # programs #
+    #############
+    def load(self, name:str) -> Sub:
+        sub = self.subs.get(name)
+        if sub is None:
+            for directory in self.subroutine_path:
+                filename = path.join(directory, f'{name}.ngc')
+                if path.isfile(filename):
+                    sub = self.subs[name] = Sub(name, filename)
+                    break
+            else:
+                raise NgcError(f'Unable to open file <{name}.ngc>')
+        return sub
+
+    def execute(self, text:str):
+        '''
+            Run MDI text, one or more lines at the top level
+        '''
+        for n, line in enumerate(text.splitlines(), 1):
+            block = Block(line, 'MDI', n)
+            if block.statement is not None:
+                label, kw, rest = block.statement
+                if kw != 'call':
+                    raise NgcError(f'o{label} {kw} is only supported in a subroutine')
+                self.comments(block)
+                self.call(block, label, rest)
+            else:
+                self.execute_block(block)
+
+    def call(self, block:Block, label:str, rest:str):
+        if not label.startswith('<'):
+            raise NgcError(f'{block.where()}: only named subroutines can be called')
+        args = Line(self, rest, block).values()
+        return self.call_sub(label[1:-1], args)
+
+    def call_sub(self, name:str, args:list = (), named:dict = None):
+        if len(self.frames) > self.max_depth:
+            raise NgcError(f'o<{name}> call: nesting too deep')
+        sub = self.load(name)
+        self.frames.append(Frame(args, named))
+        try:
+            value = self.run_body(sub)
+        finally:
+            self.frames.pop()
+        self.globals['_value'] = 0.0 if value is None else value
+        self.globals['_value_returned'] = 0.0 if value is None else 1.0
+        return value
+
+    def run_body(self, sub:Sub):
+        body = sub.body
+        pc = 0
+        loops = 0
+        while pc < len(body):
+            block = body[pc]
+            if block.statement is None:
+                self.execute_block(block)
+                pc += 1
+                continue
+            self.check_abort()
+            self.lines_executed += 1
+            label, kw, rest = block.statement
+            self.comments(block)
+            if kw == 'if':
+                pc = self.branch(sub, pc)
+            elif kw in ('elseif', 'else'):
+                pc = sub.endif[pc] + 1 # the branch before it ran
+            elif kw == 'endif':
+                pc += 1
+            elif kw == 'while':
+                pc = pc + 1 if self.condition(block, rest) else sub.loops[pc] + 1
+            elif kw == 'endwhile':
+                loops += 1
+                if loops > self.max_loops:
+                    raise NgcError(f'{block.where()}: more than {self.max_loops} loop iterations')
+                pc = sub.loops[pc]
+            elif kw == 'break':
+                pc = sub.loops[sub.loop_of[pc]] + 1
+            elif kw == 'continue':
+                pc = sub.loop_of[pc]
+            elif kw in ('return', 'endsub'):
+                values = Line(self, rest, block).values()
+                return values[0] if values else None
+            elif kw == 'call':
+                self.call(block, label, rest)
+                pc += 1
+            else:
+                raise NgcError(f'{block.where()}: o{label} {kw} inside a subroutine')
+        return None
+
+    def branch(self, sub:Sub, pc:int) -> int:
+        while True:
+            block = sub.body[pc]
+            _, kw, rest = block.statement
+            if kw in ('else', 'endif') or self.condition(block, rest):
+                return pc + 1
+            pc = sub.next_branch[pc]
+
+    def condition(self, block:Block, rest:str) -> bool:
+        line = Line(self, rest, block)
+        value = line.expression()
+        if not line.done():
+            raise line.error('unexpected text after the condition')
+        return value != 0
+
+    def check_abort(self):
+        if self.machine.abort_event.is_set():
+            raise NgcAbort('Aborted')
+
+    ###############
+    # parameters #
+    ###############
+    def read(self, key:tuple) -> float:
+        kind, name = key
+        if kind == 'num':
+            if 1 <= name <= 30:
+                return self.frames[-1].numbered.get(name, 0.0)
+            value = self.offset_param(name)
+            if value is not None:
+                return value
+            return self.globals.get(name, 0.0)
+        if name.startswith('_'):
+            return self.read_global(name)
+        try:
+            return self.frames[-1].named[name]
+        except KeyError:
+            raise NgcError(f'Named parameter #<{name}> not defined') from None
+
+    def offset_param(self, n:int) -> float:
+        '''
+            #5210 G92 on, #5211-#5213 G92 XYZ, #5220 coordinate system (G54), #5221-#5223 G54 XYZ
+        '''
+        mc = self.machine
+        if n == 5210:
+            return float(any(mc.g92_offset))
+        if 5211 <= n <= 5213:
+            return mc.g92_offset[n - 5211]
+        if n == 5220:
+            return 1.0
+        if 5221 <= n <= 5223:
+            return mc.work_offset[n - 5221]
+        return None
+
+    def read_global(self, name:str) -> float:
+        mc = self.machine
+        if name.startswith('_hal[') and name.endswith(']'):
+            pin = name[5:-1]
+            if pin not in mc.pins:
+                raise NgcError(f'Named parameter #<{name}>: unknown HAL pin {pin}')
+            return float(mc.pins[pin])
+        if name.startswith('_ini['):
+            section, _, key = name[5:].partition(']')
+            value = mc.ini_value(section, key)
+            if value is None:
+                raise NgcError(f'Named parameter #<{name}> not defined')
+            return float(value)
+        predefined = {
+            '_current_tool': lambda: mc.tool_in_spindle,
+            '_current_pocket': lambda: max(mc.tool_pocket(mc.tool_in_spindle), 0),
+            '_selected_tool': lambda: mc.pins['iocontrol.0.tool-prep-number'],
+            '_selected_pocket': lambda: mc.pins['iocontrol.0.tool-prep-pocket'],
+            '_task': lambda: self.task,
+            '_metric_machine': lambda: mc.metric,
+            '_metric': lambda: self.metric,
+            '_imperial': lambda: not self.metric,
+            '_absolute': lambda: self.absolute,
+            '_incremental': lambda: not self.absolute,
+            '_x': lambda: mc.position[0] - mc.offset(0),
+            '_y': lambda: mc.position[1] - mc.offset(1),
+            '_z': lambda: mc.position[2] - mc.offset(2),
+            '_abs_x': lambda: mc.position[0],
+            '_abs_y': lambda: mc.position[1],
+            '_abs_z': lambda: mc.position[2],
+        }
+        if name in predefined:
+            return float(predefined[name]())
+        try:
+            return self.globals[name]
+        except KeyError:
+            raise NgcError(f'Named parameter #<{name}> not defined') from None
+
+    def exists(self, key:tuple) -> bool:
+        try:
+            self.read(key)
+            return True
+        except NgcError:
+            return False
+
+    def write(self, key:tuple, value:float):
+        kind, name = key
+        if kind == 'num' and 1 <= name <= 30:
+            self.frames[-1].numbered[name] = value
+        elif kind == 'num' or name.startswith('_'):
+            self.globals[name] = value
+        else:
+            self.frames[-1].named[name] = value
+
+    #############
+    # comments #
+    #############
+    def format(self, text:str) -> str:
+        def value(m):
+            key = ('named', m.group(1).lower()) if m.group(1) else ('num', int(m.group(2)))
+            try:
+                return f'{self.read(key):.6f}'
+            except NgcError:
+                return '######'
+        return PARAM.sub(value, FORMAT.sub('', text))
+
+    def comments(self, block:Block):
+        for comment in block.comments:
+            kind, sep, text = comment.partition(',')
+            kind = kind.strip().lower()
+            if not sep or kind not in ('print', 'msg', 'debug', 'abort'):
+                continue
+            text = self.format(text.strip())
+            if kind == 'abort':
+                raise NgcAbort(f'{block.where()}: {text}')
+            self.machine.message(kind, text)
+
+    ###########
+    # blocks #
+    ###########
+    def execute_block(self, block:Block):
+        self.check_abort()
+        self.lines_executed += 1
+        with self.machine.lock:
+            self.comments(block)
+            if not block.code:
+                return
+            line = Line(self, block.code, block)
+            line.assignments()
+            if line.done():
+                return
+            g, m, words = line.words()
+            try:
+                self.execute_words(g, m, words)
+            except KeyError as e:
+                raise line.error(f'{str(e.args[0]).upper()} word missing') from None
+
+    def execute_words(self, g:list, m:list, w:dict):
+        mc = self.machine
+        for code in g:
+            if code not in G_CODES:
+                raise NgcError(f'G{code / 10:g} is not supported by the simulator')
+        for code in m:
+            if code not in M_CODES:
+                raise NgcError(f'M{code} is not supported by the simulator')
+        if 'f' in w:
+            self.feed = w['f']
+        if 's' in w:
+            self.speed = w['s']
+        if 't' in w:
+            self.select_tool(int(w['t']))
+        if 6 in m:
+            self.change_tool()
+        if 61 in m:
+            mc.tool_in_spindle = int(w['q'])
+            mc.set('iocontrol.0.tool-number', mc.tool_in_spindle)
+        for code in m:
+            if code in (3, 4):
+                mc.spindle(1 if code == 3 else -1, self.speed)
+            elif code == 5:
+                mc.spindle(0)
+            elif code in (64, 65):
+                mc.digital_out(int(w['p']), code == 64)
+            elif code == 66:
+                self.globals[5399] = float(self.wait_input(w))
+            elif code in (67, 68):
+                mc.analog_out(int(w['e']), w['q'])
+        for code in g:
+            if code in (200, 210):
+                self.metric = code == 210
+            elif code in (900, 910):
+                self.absolute = code == 900
+            elif code in (430, 490):
+                self.tool_offset = code == 430
+        if 40 in g:
+            mc.dwell(w['p'])
+        if 100 in g:
+            if int(w['l']) == 1:
+                mc.set_tool_offset(int(w['p']), w['z'])
+            elif int(w['l']) == 2 and int(w['p']) in (0, 1):
+                for i, axis in enumerate('xyz'):
+                    if axis in w:
+                        mc.work_offset[i] = w[axis]
+            else:
+                raise NgcError(f'G10 L{int(w["l"])} P{int(w.get("p", 0))} is not supported by the simulator')
+        for code in g:
+            if code in MOTION:
+                self.motion_mode = code
+        if any(a in w for a in 'xyz') and 100 not in g:
+            self.move(w, 530 in g)
+
+    def move(self, w:dict, machine_coords:bool = False):
+        mc = self.machine
+        target = list(mc.position)
+        for i, axis in enumerate('xyz'):
+            if axis in w:
+                if not self.absolute:
+                    target[i] += w[axis]
+                else:
+                    target[i] = w[axis] if machine_coords else w[axis] + mc.offset(i)
+        if self.motion_mode == 0:
+            mc.rapid(target)
+            return
+        if self.feed <= 0:
+            raise NgcError('Cannot move with a zero feed rate')
+        if self.motion_mode == 10:
+            mc.feed(target, self.feed)
+            return
+        contact = mc.probe(target, self.feed)
+        if self.sync_on_wait:
+            mc.sync() # probing is a queue buster
+        if contact is None:
+            self.globals[5070] = 0.0
+            if self.motion_mode == 383:
+                return
+            raise NgcError('G38.2 move finished without making contact')
+        self.globals[5070] = 1.0
+        for i, value in enumerate(contact):
+            self.globals[5061 + i] = value - mc.offset(i)
+
+    def wait_input(self, w:dict) -> int:
+        if self.sync_on_wait:
+            self.machine.sync()
+        mode = int(w.get('l', 0))
+        timeout = w.get('q', 0.0)
+        if 'p' in w:
+            return self.machine.wait_digital(int(w['p']), mode, timeout)
+        if 'e' in w:
+            if mode != 0:
+                raise NgcError('M66 E only supports L0 in the simulator')
+            return self.machine.read_analog(int(w['e']))
+        raise NgcError('M66 needs a P or E word')
+
+    def select_tool(self, tool:int):
+        mc = self.machine
+        pocket = mc.tool_pocket(tool) if tool > 0 else 0
+        if pocket < 0:
+            raise NgcError(f'Requested tool {tool} not found in the tool table')
+        mc.set('iocontrol.0.tool-prep-number', tool)
+        mc.set('iocontrol.0.tool-prep-pocket', pocket)
+
+    def change_tool(self):
+        '''
+            M6, the remapped ngc with the stdglue change_prolog/change_epilog behaviour.
+            M6 inside the remap (or without a remap) is the builtin change.
+        '''
+        mc = self.machine
+        selected = mc.pins['iocontrol.0.tool-prep-number']
+        if self.in_remap or 6 not in self.remaps:
+            mc.tool_in_spindle = selected
+            mc.set('iocontrol.0.tool-number', selected)
+            return
+        kind, name = self.remaps[6]
+        if kind == 'python':
+            self.call_python(name)
+            return
+        named = {
+            'tool_in_spindle': float(mc.tool_in_spindle),
+            'selected_tool': float(selected),
+            'current_pocket': float(max(mc.tool_pocket(mc.tool_in_spindle), 0)),
+            'selected_pocket': float(mc.pins['iocontrol.0.tool-prep-pocket']),
+        }
+        self.in_remap = True
+        try:
+            value = self.call_sub(name, (), named)
+        finally:
+            self.in_remap = False
+        if value is None or value <= 0:
+            raise NgcError(f'M6 aborted (return code {0.0 if value is None else value:.1f})')
+        self.commit_tool_change()
+        self.machine.sync() # change_epilog yields INTERP_EXECUTE_FINISH
+
+    def commit_tool_change(self):
+        mc = self.machine
+        selected = mc.pins['iocontrol.0.tool-prep-number']
+        mc.tool_in_spindle = selected
+        mc.set('iocontrol.0.tool-number', selected)
+        mc.set('iocontrol.0.tool-prep-number', 0)
+        mc.set('iocontrol.0.tool-prep-pocket', 0)
+
+    def call_python(self, name:str):
+        '''
+            A python= remap from the remap module, like [PYTHON] TOPLEVEL. Generators are run
+            to the end, INTERP_EXECUTE_FINISH syncs the machine, INTERP_ERROR fails the block.
+        '''
+        from interpreter import INTERP_OK, INTERP_ERROR, INTERP_EXECUTE_FINISH
+        if self.machine.python_dir not in sys.path:
+            sys.path.insert(0, self.machine.python_dir)
+        handler = getattr(importlib.import_module('remap'), name)
+        context = RemapContext(self)
+        self.in_remap = True
+        self.sync_on_wait = False
+        try:
+            result = handler(context)
+            if inspect.isgenerator(result):
+                try:
+                    while True:
+                        status = next(result)
+                        if status == INTERP_EXECUTE_FINISH:
+                            self.machine.sync()
+                        elif status == INTERP_ERROR:
+                            raise NgcError(context.errormsg or f'{name} failed')
+                except StopIteration as stop:
+                    result = stop.value
+        finally:
+            self.in_remap = False
+            self.sync_on_wait = True
+        if result not in (None, INTERP_OK):
+            raise NgcError(context.errormsg or f'{name} returned {result}')
@@ -0,0 +1,149 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Runs rapidchange_handler.py headless on a FakeMachine: stand-in widgets and preferences,
+    a QCoreApplication for the handler's Qt signals and timers, and helpers that do what
+    QtVCP and the operator would (periodic ticks, button clicks, waiting for MDI jobs).
+'''
+
+import threading
+import time
+from collections import deque
+from os import path
+from types import SimpleNamespace
+
+from PyQt5 import QtCore
+
+from sim import install
+from sim.widgets import Widgets
+
+# created once and kept: a QCoreApplication collected with an old harness takes the Qt objects
+# created meanwhile with it
+APP = None
+
+def application() -> QtCore.QCoreApplication:
+    global APP
+    if APP is None:
+        APP = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    return APP
+
+class HandlerHarness():
+    def __init__(self, machine, sim_time_profiler:bool = True) -> None:
+        self.app = application()
+        self.machine = install(machine)
+        import hal
+        import rapidchange_handler
+        from qtvcp.core import Status
+        from qtvcp.lib.preferences import Access
+        self.module = rapidchange_handler
+        self.status = Status()
+        self.prefs = Access(path.join(machine.config_dir, 'qtdragon.pref'))
+        self.widgets = Widgets(self.prefs)
+        self.paths = SimpleNamespace(CONFIGPATH=machine.config_dir, WORKINGDIR=machine.config_dir)
+        self.thread = threading.current_thread()
+        self.ticks = 0
+        self.syncs = deque() # syncs of the MDI thread waiting for a periodic update
+        self.missed_syncs = 0 # the next syncs the GUI is too busy to run a periodic update for
+        [self.handler] = rapidchange_handler.get_handlers(hal.component('rapidchange'), self.widgets, self.paths)
+        self.handler.initialized__()
+        machine.update_sensors()
+        # M66 is a queue buster, the GUI gets to run while the interpreter waits
+        machine.sync_hooks.append(self.sync)
+        if sim_time_profiler:
+            machine.watch('rapid_atc.atc_phase', self.onPhase)
+
+    @property
+    def w(self) -> Widgets:
+        return self.widgets
+
+    def onPhase(self, name:str, value:float):
+        # time the phases on the simulated clock instead of the (much faster) wall clock
+        self.handler.profiler.sample(int(round(value)), int(round(self.machine.pins['rapid_atc.atc_phase_pocket'])),
+                                     now=self.machine.clock)
+
+    def sync(self):
+        if self.missed_syncs > 0:
+            self.missed_syncs -= 1
+            return
+        if threading.current_thread() is self.thread:
+            self.tick()
+            return
+        # the MDI thread waits until wait() has run a periodic update for it
+        done = threading.Event()
+        self.syncs.append(done)
+        done.wait(timeout=1.0)
+
+    def serve_syncs(self):
+        if not self.syncs:
+            return
+        self.tick()
+        while self.syncs:
+            self.syncs.popleft().set()
+
+    def tick(self):
+        self.ticks += 1
+        self.status.emit('periodic')
+
+    def process_events(self):
+        self.app.processEvents()
+
+    def wait(self, timeout:float = 10.0, tick:bool = False) -> bool:
+        '''
+            Wait for the queued MDI jobs and a running batch and deliver their callbacks, False on a timeout.
+            tick keeps the periodic update running meanwhile, like QtVCP does during a long MDI sequence.
+        '''
+        deadline = time.monotonic() + timeout
+        while self.handler.mdi.busy or self.handler.batch is not None \
+                or self.machine.interp_state != self.machine_idle():
+            if time.monotonic() > deadline:
+                return False
+            self.process_events()
+            self.serve_syncs()
+            if tick:
+                self.tick()
+            time.sleep(0.001)
+        self.process_events()
+        return True
+
+    @staticmethod
+    def machine_idle() -> int:
+        import linuxcnc
+        return linuxcnc.INTERP_IDLE
+
+    def load_program(self, filename:str):
+        self.machine.file = filename
+        self.status.emit('file-loaded', filename)
+
+    def change_tool(self, tool:int) -> float:
+        '''
+            T<tool> M6 the way a running program does it, returns the simulated seconds
+        '''
+        self.tick()
+        seconds = self.machine.run(f'T{tool} M6')
+        self.tick()
+        return seconds
+
+    def close(self):
+        self.handler.closing_cleanup__()
+        self.machine.sync_hooks.remove(self.sync)
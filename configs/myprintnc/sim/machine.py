@@ -0,0 +1,612 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+    FakeMachine: the state the stand-in modules share. HAL pins by full name, the position,
+    spindle, dust cover, rack and tool table, and a simulated clock that motion, dwells and
+    sensor waits advance. Sensors follow the physical state:
+
+        IR sensor      motion.digital-in-<ir_hal_dpin>, 1 when the spindle is empty
+        at speed       motion.digital-in-<at_speed_dpin>, goes high spinup_time after M3/M4
+        cover open     motion.digital-in-<cover_open_dpin>, follows the cover output after cover_time
+
+    A tool is released into the pocket under the spindle by a G1 down to engage_z with the
+    spindle turning CCW (M4) and picked up the same way turning CW (M3). An engagement before
+    the dust cover had cover_time to open counts as a cover strike, a rapid or feed move through
+    the toolsetter contact height as a setter crash.
+'''
+
+import heapq
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from os import path
+
+from atc_planner import MotionModel, RackGeometry, read_ini
+
+# linuxcnc module constants, shared with stubs/linuxcnc.py
+RCS_DONE, RCS_EXEC, RCS_ERROR = 1, 2, 3
+MODE_MANUAL, MODE_AUTO, MODE_MDI = 1, 2, 3
+INTERP_IDLE, INTERP_READING, INTERP_PAUSED, INTERP_WAITING = 1, 2, 3, 4
+STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON = 1, 2, 3, 4
+
+_current = None
+
+def current():
+    if _current is None:
+        raise RuntimeError('No simulated machine installed, call sim.install() first')
+    return _current
+
+def din(n:int) -> str:
+    return f'motion.digital-in-{int(n):02d}'
+
+def dout(n:int) -> str:
+    return f'motion.digital-out-{int(n):02d}'
+
+class FakeMachine():
+    CONFIG_FILES = ('myprintnc.ini', 'tool.tbl', 'qtdragon.pref', 'rapidatc-postgui.hal')
+
+    def __init__(self, config_dir:str, macro_dir:str = None, inifile:str = 'myprintnc.ini',
+                 halfile:str = 'rapidatc-postgui.hal', time_scale:float = 0.0, python_dir:str = None,
+                 remap:str = None) -> None:
+        self.config_dir = config_dir
+        self.inifile = path.join(config_dir, inifile)
+        self.ini = read_ini(self.inifile)
+        self.ini_nocase = {(s.lower(), k.lower()): v for (s, k), v in self.ini.items()}
+        self.macro_dir = macro_dir or path.join(config_dir, 'macros')
+        self.python_dir = python_dir or path.join(config_dir, 'python') # [PYTHON] PATH_PREPEND
+        self.tooltable = path.join(config_dir, self.ini_value('EMCIO', 'TOOL_TABLE', 'tool.tbl'))
+        self.motion = MotionModel.from_ini(self.inifile)
+        self.metric = self.ini_value('TRAJ', 'LINEAR_UNITS', 'mm').lower() in ('mm', 'metric')
+        self.time_scale = time_scale # > 0 sleeps simulated time * time_scale, for watching a run
+        self.lock = threading.RLock()
+        self.signals = {} # qtvcp Status callbacks
+        self.sync_hooks = [] # called when the interpreter syncs with HAL (M66)
+        self.dialogs = [] # qtvcp Action.CALL_DIALOG requests
+        self.syncs = 0
+
+        self.clock = 0.0
+        self.events = []
+        self.event_seq = 0
+        self.pins = {}
+        self.pin_types = {}
+        self.links = {}
+        self.watchers = {}
+
+        self.position = [0.0, 0.0, 0.0]
+        self.work_offset = [0.0, 0.0, 0.0] # G54
+        self.g92_offset = [0.0, 0.0, 0.0]
+        self.tool_in_spindle = 0 # what LinuxCNC thinks, M61 / M6
+        self.spindle_tool = 0 # what is physically in the spindle
+        self.rack = None # pocket -> tool, filled from the tool table on first use
+        self.spindle_dir = 0
+        self.spindle_speed = 0.0
+        self.spindle_epoch = 0
+        self.cover_epoch = 0
+        self.cover_opened = None # clock when the cover output went on
+        self.spinup_time = 0.8
+        self.cover_time = 0.6
+        self.engage_tolerance = 0.5
+        self.engage_failures = 0 # the next n engagements miss, to exercise the retries
+        self.toolsetter_z = -140.0 # spindle nose Z where an empty spindle would touch the setter
+        self.tool_lengths = {}
+
+        self.task_mode = MODE_MANUAL
+        self.task_state = STATE_ON
+        self.interp_state = INTERP_IDLE
+        self.state = RCS_DONE
+        self.file = ''
+        self.error = None
+        self.messages = deque(maxlen=1000)
+        self.abort_event = threading.Event()
+        self.runner = None
+
+        self.moves = 0
+        self.motion_time = 0.0
+        self.dwell_time = 0.0
+        self.wait_time = 0.0
+        self.engagements = 0
+        self.engage_misses = 0
+        self.cover_strikes = 0
+        self.setter_crashes = 0
+
+        self.tool_lines = []
+        self.tools = {}
+        self.tool_table_version = 0
+        self.load_tool_table()
+        self.default_pins()
+        if halfile is not None and path.isfile(path.join(config_dir, halfile)):
+            self.load_nets(path.join(config_dir, halfile))
+
+        from sim.gcode import Interpreter
+        remaps = self.load_remaps(remap)
+        self.interpreter = Interpreter(self, [self.macro_dir], remaps)
+
+    @classmethod
+    def from_config(cls, workdir:str, config_dir:str = None, **kwargs):
+        '''
+            Copy the configuration files the handler writes (tool table, preferences) to workdir
+            and run from there, the macros are used where they are
+        '''
+        from sim import CONFIG_DIR
+        config_dir = config_dir or CONFIG_DIR
+        os.makedirs(workdir, exist_ok=True)
+        for name in cls.CONFIG_FILES:
+            src = path.join(config_dir, name)
+            if path.isfile(src):
+                shutil.copyfile(src, path.join(workdir, name))
+        kwargs.setdefault('macro_dir', path.join(config_dir, 'macros'))
+        kwargs.setdefault('python_dir', path.join(config_dir, 'python'))
+        return cls(workdir, **kwargs)
+
+    def install(self):
+        global _current
+        _current = self
+
+    ########
+    # INI #
+    ########
+    def ini_value(self, section:str, key:str, default=None):
+        value = self.ini.get((section, key))
+        if value is None:
+            value = self.ini_nocase.get((section.lower(), key.lower()), default)
+        return value
+
+    def load_remaps(self, remap:str = None) -> dict:
+        '''
+            {m code: ('ngc' or 'python', name)} from remap, a REMAP= value, or the first
+            REMAP= line of the [RS274NGC] section
+        '''
+        remaps = {}
+        remap = remap or self.ini_value('RS274NGC', 'REMAP')
+        if remap:
+            words = remap.split()
+            options = dict(w.split('=', 1) for w in words[1:] if '=' in w)
+            for kind in ('python', 'ngc'):
+                if words[0].upper().startswith('M') and kind in options:
+                    remaps[int(words[0][1:])] = (kind, options[kind])
+                    break
+        return remaps
+
+    def set_remap(self, remap:str):
+        '''
+            Switch the M6 remap, e.g. set_remap('M6 modalgroup=6 python=rapid_tool_change')
+        '''
+        self.interpreter.remaps = self.load_remaps(remap)
+
+    ########
+    # HAL #
+    ########
+    def default_pins(self):
+        for n in range(16):
+            self.newpin(din(n), 'bit')
+            self.newpin(dout(n), 'bit')
+            self.newpin(f'motion.analog-in-{n:02d}', 'float')
+            self.newpin(f'motion.analog-out-{n:02d}', 'float')
+        self.newpin('motion.is-all-homed', 'bit', True)
+        self.newpin('halui.machine.is-on', 'bit', True)
+        self.newpin('iocontrol.0.tool-prep-number', 's32')
+        self.newpin('iocontrol.0.tool-prep-pocket', 's32')
+        self.newpin('iocontrol.0.tool-number', 's32')
+        # qtversaprobe settings used by _auto_probe_tool.ngc
+        for name, value in (('enable', True), ('searchvel', 200.0), ('probevel', 20.0),
+                            ('backoffdist', 2.0), ('probeheight', 0.0), ('blockheight', 0.0)):
+            self.newpin(f'qtversaprobe.{name}', 'bit' if name == 'enable' else 'float', value)
+
+    def load_nets(self, halfile:str):
+        '''
+            Follow the nets of a HAL file that have a writer, e.g. net atc-phase motion.analog-out-00 => rapid_atc.atc_phase
+        '''
+        with open(halfile, 'r') as file:
+            for line in file:
+                words = line.split('#', 1)[0].split()
+                if len(words) < 4 or words[0] != 'net':
+                    continue
+                pins = words[2:]
+                if '=>' in pins and pins.index('=>') == 1:
+                    self.links.setdefault(pins[0], []).extend(p for p in pins[2:] if p not in ('=>', '<='))
+                elif '<=' in pins and len(pins) >= 3 and pins[-2] == '<=':
+                    self.links.setdefault(pins[-1], []).extend(p for p in pins[:-2] if p not in ('=>', '<='))
+
+    def newpin(self, name:str, type:str, value=None):
+        self.pin_types[name] = type
+        self.pins[name] = self.convert(type, 0 if value is None else value)
+
+    @staticmethod
+    def convert(type:str, value):
+        if type == 'bit':
+            return bool(value)
+        if type in ('s32', 'u32'):
+            return int(value)
+        return float(value)
+
+    def get(self, name:str):
+        return self.pins[name]
+
+    def set(self, name:str, value):
+        value = self.convert(self.pin_types.get(name, 'float'), value)
+        self.pins[name] = value
+        for fn in self.watchers.get(name, ()):
+            fn(name, value)
+        for target in self.links.get(name, ()):
+            self.set(target, value)
+
+    def watch(self, name:str, fn):
+        '''
+            fn(name, value) is called on every write of the pin
+        '''
+        self.watchers.setdefault(name, []).append(fn)
+
+    def pin(self, name:str, default=0):
+        return self.pins.get(name, default)
+
+    ##########
+    # clock #
+    ##########
+    def schedule(self, delay:float, fn):
+        self.event_seq += 1
+        heapq.heappush(self.events, (self.clock + delay, self.event_seq, fn))
+
+    def advance(self, dt:float):
+        end = self.clock + max(dt, 0.0)
+        while self.events and self.events[0][0] <= end:
+            t, _, fn = heapq.heappop(self.events)
+            self.clock = max(self.clock, t)
+            fn()
+        self.clock = end
+        if self.time_scale > 0 and dt > 0:
+            time.sleep(dt * self.time_scale)
+
+    ###########
+    # motion #
+    ###########
+    def travel(self, target:list, dt:float):
+        self.advance(dt)
+        self.position = list(target)
+        self.moves += 1
+        self.motion_time += dt
+
+    def rapid(self, target:list):
+        self.check_setter(target)
+        self.travel(target, self.motion.rapid_time(tuple(self.position), tuple(target)))
+
+    def feed(self, target:list, feed:float):
+        dist = sum((e - s) ** 2 for s, e in zip(self.position, target)) ** 0.5
+        dt = max(dist / (feed / 60.0), self.motion.rapid_time(tuple(self.position), tuple(target)))
+        self.check_setter(target)
+        self.travel(target, dt)
+        self.engage()
+
+    def offset(self, axis:int) -> float:
+        '''
+            Work position = machine position - offset(axis)
+        '''
+        return self.work_offset[axis] + self.g92_offset[axis]
+
+    def setter_contact(self, x:float, y:float):
+        '''
+            The setter is at [VERSA_TOOLSETTER] X/Y and is touched at toolsetter_z + tool length,
+            None away from the setter
+        '''
+        sx = float(self.ini_value('VERSA_TOOLSETTER', 'X', 0))
+        sy = float(self.ini_value('VERSA_TOOLSETTER', 'Y', 0))
+        if abs(x - sx) < 1.0 and abs(y - sy) < 1.0:
+            return self.toolsetter_z + self.tool_length(self.spindle_tool)
+        return None
+
+    def check_setter(self, target:list):
+        contact = self.setter_contact(target[0], target[1])
+        if contact is not None and target[2] < contact <= self.position[2]:
+            self.setter_crashes += 1
+
+    def probe(self, target:list, feed:float):
+        '''
+            G38.2 / G38.3 towards target, returns the contact position or None
+        '''
+        x, y, z = self.position
+        contact = self.setter_contact(x, y)
+        if contact is not None and target[2] <= contact <= z:
+            self.travel([x, y, contact], (z - contact) / (feed / 60.0))
+            return list(self.position)
+        self.feed(target, feed)
+        return None
+
+    def dwell(self, seconds:float):
+        self.advance(seconds)
+        self.dwell_time += seconds
+
+    def tool_length(self, tool:int) -> float:
+        if tool <= 0:
+            return 0.0
+        return self.tool_lengths.get(tool, 20.0 + 2.0 * tool)
+
+    ############
+    # spindle #
+    ############
+    def spindle(self, direction:int, speed:float = 0.0):
+        self.spindle_dir = direction
+        self.spindle_speed = speed if direction else 0.0
+        self.spindle_epoch += 1
+        at_speed = din(self.pin('rapid_atc.at_speed_dpin', 1))
+        self.set(at_speed, False)
+        if direction:
+            epoch = self.spindle_epoch
+            self.schedule(self.spinup_time, lambda: epoch == self.spindle_epoch and self.set(at_speed, True))
+
+    def rack_geometry(self) -> RackGeometry:
+        return RackGeometry(num_pockets=self.pin('rapid_atc.num_pockets'),
+                            first_pocket_x=self.pin('rapid_atc.first_pocket_x'),
+                            first_pocket_y=self.pin('rapid_atc.first_pocket_y'),
+                            pocket_offset=self.pin('rapid_atc.pocket_offset'),
+                            align_axis=self.pin('rapid_atc.align_axis'))
+
+    def pocket_at(self, x:float, y:float) -> int:
+        rack = self.rack_geometry()
+        for pocket in range(1, rack.num_pockets + 1):
+            px, py = rack.pocket_xy(pocket)
+            if abs(px - x) < 1.0 and abs(py - y) < 1.0:
+                return pocket
+        return 0
+
+    def rack_contents(self) -> dict:
+        if self.rack is None:
+            self.rack = {}
+            for tool, entry in self.tools.items():
+                if entry['pocket'] > 0 and tool != self.spindle_tool:
+                    self.rack.setdefault(entry['pocket'], tool)
+        return self.rack
+
+    def engage(self):
+        '''
+            Called at the end of every feed move, nut engagement with the pocket under the spindle
+        '''
+        if not self.spindle_dir or 'rapid_atc.engage_z' not in self.pins:
+            return
+        if self.position[2] > self.pins['rapid_atc.engage_z'] + self.engage_tolerance:
+            return
+        pocket = self.pocket_at(self.position[0], self.position[1])
+        if pocket == 0:
+            return
+        if self.pins.get('rapid_atc.cover_enabled') and \
+                (self.cover_opened is None or self.clock - self.cover_opened < self.cover_time):
+            self.cover_strikes += 1
+        if self.engage_failures > 0:
+            self.engage_failures -= 1
+            self.engage_misses += 1
+            return
+        rack = self.rack_contents()
+        if self.spindle_dir < 0 and self.spindle_tool and not rack.get(pocket):
+            rack[pocket] = self.spindle_tool
+            self.spindle_tool = 0
+            self.engagements += 1
+        elif self.spindle_dir > 0 and not self.spindle_tool and rack.get(pocket):
+            self.spindle_tool = rack.pop(pocket)
+            self.engagements += 1
+        self.update_sensors()
+
+    def load_tool(self, tool:int):
+        '''
+            Put tool in the spindle by hand, like a manual change followed by M61
+        '''
+        rack = self.rack_contents()
+        for pocket, t in list(rack.items()):
+            if t == tool:
+                del rack[pocket]
+        if self.spindle_tool and self.tool_pocket(self.spindle_tool) > 0:
+            rack.setdefault(self.tool_pocket(self.spindle_tool), self.spindle_tool)
+        self.spindle_tool = tool
+        self.tool_in_spindle = tool
+        self.update_sensors()
+
+    ###################
+    # digital/analog #
+    ###################
+    def update_sensors(self):
+        if 'rapid_atc.ir_hal_dpin' in self.pins:
+            self.set(din(self.pins['rapid_atc.ir_hal_dpin']), not self.spindle_tool)
+
+    def digital_out(self, n:int, value:bool):
+        self.set(dout(n), value)
+        if 'rapid_atc.cover_hal_dpin' in self.pins and n == self.pins['rapid_atc.cover_hal_dpin']:
+            self.cover_epoch += 1
+            if not value:
+                self.cover_opened = None
+            elif self.cover_opened is None:
+                self.cover_opened = self.clock
+            sensor = self.pin('rapid_atc.cover_open_dpin', -1)
+            if sensor >= 0:
+                epoch = self.cover_epoch
+                self.schedule(self.cover_time, lambda: epoch == self.cover_epoch and self.set(din(sensor), value))
+
+    def analog_out(self, n:int, value:float):
+        self.set(f'motion.analog-out-{int(n):02d}', value)
+
+    def wait_digital(self, n:int, mode:int, timeout:float) -> int:
+        '''
+            M66 P n L mode Q timeout, returns the input value or -1 on a timeout.
+            L0 immediate, L1 rise, L2 fall, L3 high, L4 low
+        '''
+        name = din(n)
+        last = bool(self.pins.get(name))
+        if mode == 0:
+            return int(last)
+        ok = {1: lambda a, b: not a and b, 2: lambda a, b: a and not b,
+              3: lambda a, b: b, 4: lambda a, b: not b}[mode]
+        if mode in (3, 4) and ok(last, last):
+            return int(last)
+        start = self.clock
+        deadline = start + max(timeout, 0.0)
+        try:
+            while True:
+                if not self.events or self.events[0][0] > deadline:
+                    self.advance(deadline - self.clock)
+                    return -1
+                self.advance(self.events[0][0] - self.clock)
+                now = bool(self.pins.get(name))
+                if ok(last, now):
+                    return int(now)
+                last = now
+        finally:
+            self.wait_time += self.clock - start
+
+    def sync(self):
+        self.syncs += 1
+        # the interpreter holds the lock for the whole block, let the GUI poll the machine meanwhile
+        held = 0
+        while True:
+            try:
+                self.lock.release()
+            except RuntimeError:
+                break
+            held += 1
+        try:
+            for fn in list(self.sync_hooks):
+                fn()
+        finally:
+            for _ in range(held):
+                self.lock.acquire()
+
+    def read_analog(self, n:int) -> float:
+        return self.pins.get(f'motion.analog-in-{int(n):02d}', 0.0)
+
+    ###############
+    # tool table #
+    ###############
+    def load_tool_table(self):
+        with open(self.tooltable, 'r') as file:
+            self.tool_lines = file.readlines()
+        self.tools = {}
+        for i, line in enumerate(self.tool_lines):
+            words = line.split(';', 1)[0].split()
+            entry = {'pocket': 0, 'z': 0.0, 'line': i}
+            tool = None
+            for w in words:
+                letter, value = w[0].upper(), w[1:]
+                if letter == 'T':
+                    tool = int(value)
+                elif letter == 'P':
+                    entry['pocket'] = int(value)
+                elif letter == 'Z':
+                    entry['z'] = float(value)
+            if tool is not None:
+                self.tools[tool] = entry
+        self.tool_table_version += 1
+
+    def tool_pocket(self, tool:int) -> int:
+        entry = self.tools.get(tool)
+        return entry['pocket'] if entry is not None else -1
+
+    def set_tool_offset(self, tool:int, z:float):
+        '''
+            G10 L1 P tool Z z, updates the Z word of the tool's line and rewrites the table
+        '''
+        entry = self.tools.get(tool)
+        if entry is None:
+            raise KeyError(tool)
+        entry['z'] = z
+        params, sep, comment = self.tool_lines[entry['line']].rstrip('\n').partition(';')
+        words = [w for w in params.split() if w[0].upper() != 'Z']
+        words.append(f'Z{z:+f}')
+        self.tool_lines[entry['line']] = f'{" ".join(words)} ;{comment}\n'
+        fd, tmp = tempfile.mkstemp(prefix='.tool.tbl.', dir=path.dirname(self.tooltable))
+        with os.fdopen(fd, 'w') as file:
+            file.writelines(self.tool_lines)
+        os.replace(tmp, self.tooltable)
+        self.tool_table_version += 1
+
+    #########
+    # task #
+    #########
+    def message(self, kind:str, text:str):
+        self.messages.append((round(self.clock, 3), kind, text))
+
+    def run(self, text:str) -> float:
+        '''
+            Run MDI text on the calling thread and return the simulated seconds it took.
+            Raises NgcError when the interpreter stops with an error.
+        '''
+        from sim.gcode import NgcError
+        start = self.clock
+        with self.lock:
+            self.state = RCS_EXEC
+            self.interp_state = INTERP_READING
+            self.error = None
+            self.abort_event.clear()
+        try:
+            self.interpreter.execute(text)
+        except NgcError as e:
+            with self.lock:
+                self.error = str(e)
+                self.state = RCS_ERROR
+                self.message('error', str(e))
+                self.spindle(0)
+            raise
+        finally:
+            with self.lock:
+                self.interp_state = INTERP_IDLE
+        self.state = RCS_DONE
+        return self.clock - start
+
+    def start(self, text:str):
+        '''
+            Run MDI text on a background thread, like milltask does for linuxcnc.command().mdi()
+        '''
+        from sim.gcode import NgcError
+        self.join()
+        with self.lock:
+            self.interp_state = INTERP_READING
+        def run():
+            try:
+                self.run(text)
+            except NgcError:
+                pass
+        self.runner = threading.Thread(target=run, name='sim_interp', daemon=True)
+        self.runner.start()
+
+    def join(self, timeout:float = None):
+        if self.runner is not None:
+            self.runner.join(timeout)
+
+    def abort(self):
+        self.abort_event.set()
+        self.join(timeout=5.0)
+        with self.lock:
+            self.spindle(0)
+            self.interp_state = INTERP_IDLE
+
+    def get_stats(self) -> dict:
+        return {
+            'clock': self.clock,
+            'moves': self.moves,
+            'motion_time': self.motion_time,
+            'dwell_time': self.dwell_time,
+            'wait_time': self.wait_time,
+            'engagements': self.engagements,
+            'engage_misses': self.engage_misses,
+            'cover_strikes': self.cover_strikes,
+            'setter_crashes': self.setter_crashes,
+            'lines': self.interpreter.lines_executed,
+            'syncs': self.syncs,
+        }
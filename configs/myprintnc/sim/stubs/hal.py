@@ -0,0 +1,89 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Stand-in for the hal module. Pins live in the simulated machine under their full name
+    (component.pin), so QHAL, the interpreter's #<_hal[...]> and the nets all see them.
+'''
+
+from sim.machine import current
+
+HAL_BIT, HAL_FLOAT, HAL_S32, HAL_U32 = 1, 2, 3, 4
+HAL_IN, HAL_OUT, HAL_IO = 16, 32, 48
+HAL_RO, HAL_RW = 64, 192
+
+TYPES = {HAL_BIT: 'bit', HAL_FLOAT: 'float', HAL_S32: 's32', HAL_U32: 'u32'}
+
+class error(RuntimeError):
+    pass
+
+class component():
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.machine = current()
+        self.pins = {}
+        self.is_ready = False
+
+    def newpin(self, name:str, type:int, dir:int):
+        full = f'{self.name}.{name}'
+        if name in self.pins or full in self.machine.pins:
+            raise error(f'Duplicate pin name {full}')
+        self.machine.newpin(full, TYPES[type])
+        self.pins[name] = (type, dir)
+        return full
+
+    def newparam(self, name:str, type:int, dir:int):
+        return self.newpin(name, type, dir)
+
+    def getpins(self) -> dict:
+        return {name: self.machine.pins[f'{self.name}.{name}'] for name in self.pins}
+
+    def __getitem__(self, name:str):
+        try:
+            return self.machine.pins[f'{self.name}.{name}']
+        except KeyError:
+            raise AttributeError(f'Pin {self.name}.{name} does not exist') from None
+
+    def __setitem__(self, name:str, value):
+        full = f'{self.name}.{name}'
+        if full not in self.machine.pins:
+            raise AttributeError(f'Pin {full} does not exist')
+        self.machine.set(full, value)
+
+    def ready(self):
+        self.is_ready = True
+
+    def exit(self):
+        self.is_ready = False
+
+def get_value(name:str):
+    return current().get(name)
+
+def set_p(name:str, value):
+    current().set(name, value)
+
+def pin_has_writer(name:str) -> bool:
+    return any(name in targets for targets in current().links.values())
+
+def component_exists(name:str) -> bool:
+    return any(pin.startswith(f'{name}.') for pin in current().pins)
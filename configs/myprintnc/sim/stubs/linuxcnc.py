@@ -0,0 +1,125 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Stand-in for the linuxcnc module, stat() and command() on the simulated machine
+'''
+
+from sim.machine import (current, RCS_DONE, RCS_EXEC, RCS_ERROR, MODE_MANUAL, MODE_AUTO, MODE_MDI,
+                         INTERP_IDLE, INTERP_READING, INTERP_PAUSED, INTERP_WAITING,
+                         STATE_ESTOP, STATE_ESTOP_RESET, STATE_OFF, STATE_ON)
+
+class error(Exception):
+    pass
+
+class ini():
+    def __init__(self, inifile:str) -> None:
+        self.machine = current()
+
+    def find(self, section:str, key:str):
+        return self.machine.ini_value(section, key)
+
+class ToolEntry():
+    __slots__ = ('id', 'pocketno', 'zoffset')
+
+    def __init__(self, id:int, pocketno:int, zoffset:float) -> None:
+        self.id = id
+        self.pocketno = pocketno
+        self.zoffset = zoffset
+
+class stat():
+    def __init__(self) -> None:
+        self.machine = current()
+        self.tool_table_version = None
+        self.tool_table = ()
+        self.poll()
+
+    def poll(self):
+        m = self.machine
+        with m.lock:
+            self.tool_in_spindle = m.tool_in_spindle
+            self.pocket_prepped = m.pins['iocontrol.0.tool-prep-pocket']
+            self.interp_state = m.interp_state
+            self.task_mode = m.task_mode
+            self.task_state = m.task_state
+            self.state = m.state
+            self.file = m.file
+            self.position = (*m.position, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            self.actual_position = self.position
+            self.g5x_index = 1
+            self.g5x_offset = (*m.work_offset, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            self.g92_offset = (*m.g92_offset, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            self.spindle = ({'direction': m.spindle_dir, 'speed': m.spindle_speed, 'enabled': bool(m.spindle_dir)},)
+            self.homed = (1, 1, 1, 0, 0, 0, 0, 0, 0)
+            version = (m.tool_table_version, m.tool_in_spindle)
+            if self.tool_table_version != version:
+                # index 0 is the tool in the spindle, like LinuxCNC
+                entries = [ToolEntry(t, e['pocket'], e['z']) for t, e in sorted(m.tools.items())]
+                loaded = m.tools.get(m.tool_in_spindle)
+                spindle = ToolEntry(m.tool_in_spindle, 0, loaded['z'] if loaded else 0.0)
+                self.tool_table = tuple([spindle] + entries)
+                self.tool_table_version = version
+
+class command():
+    def __init__(self) -> None:
+        self.machine = current()
+        self.serial = 0
+        self.status = RCS_DONE
+
+    def mode(self, mode:int):
+        self.serial += 1
+        with self.machine.lock:
+            busy = self.machine.interp_state != INTERP_IDLE
+            if not busy:
+                self.machine.task_mode = mode
+        self.status = RCS_ERROR if busy else RCS_DONE
+
+    def mdi(self, text:str):
+        self.serial += 1
+        if self.machine.task_mode != MODE_MDI:
+            self.machine.message('error', 'Must be in MDI mode to issue MDI command')
+            self.status = RCS_ERROR
+            return
+        self.machine.start(text)
+        self.status = RCS_DONE
+
+    def program_open(self, filename:str):
+        self.serial += 1
+        self.machine.file = filename
+        self.status = RCS_DONE
+
+    def load_tool_table(self):
+        self.serial += 1
+        self.machine.load_tool_table()
+        self.status = RCS_DONE
+
+    def abort(self):
+        self.serial += 1
+        self.machine.abort()
+        self.status = RCS_DONE
+
+    def reset_interpreter(self):
+        self.abort()
+
+    def wait_complete(self, timeout:float = 5.0) -> int:
+        return self.status
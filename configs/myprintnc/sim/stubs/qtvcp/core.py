@@ -0,0 +1,88 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Stand-in for qtvcp.core. Info reads the simulated machine's INI, Status delivers the
+    signals the harness emits ('periodic', 'file-loaded', ..) with the emitter as the first
+    argument like GObject, Qhal reads HAL pins by name.
+'''
+
+from sim.machine import current
+
+class Ini():
+    def __init__(self, machine) -> None:
+        self.machine = machine
+
+    def find(self, section:str, key:str):
+        return self.machine.ini.get((section, key))
+
+    def findall(self, section:str, key:str) -> list:
+        value = self.find(section, key)
+        return [] if value is None else [value]
+
+class Info():
+    @property
+    def INI(self) -> Ini:
+        return Ini(current())
+
+    @property
+    def INIPATH(self) -> str:
+        return current().inifile
+
+    @property
+    def MACHINE_IS_METRIC(self) -> bool:
+        return current().metric
+
+class Status():
+    def connect(self, signal:str, callback) -> int:
+        signals = current().signals
+        signals.setdefault(signal, []).append(callback)
+        return len(signals[signal])
+
+    def emit(self, signal:str, *args):
+        for callback in list(current().signals.get(signal, ())):
+            callback(self, *args)
+
+    def stat(self):
+        import linuxcnc
+        return linuxcnc.stat()
+
+class Qhal():
+    def getvalue(self, name:str):
+        return current().get(name)
+
+    def setvalue(self, name:str, value):
+        current().set(name, value)
+
+class Action():
+    def CALL_DIALOG(self, message:dict):
+        current().dialogs.append(message)
+
+    def CALL_MDI(self, text:str):
+        current().start(text)
+
+    def CALL_MDI_WAIT(self, text:str, timeout:float = 5.0) -> bool:
+        machine = current()
+        machine.start(text)
+        machine.join(timeout)
+        return machine.error is None
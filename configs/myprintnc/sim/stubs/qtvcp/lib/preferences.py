@@ -0,0 +1,59 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Stand-in for qtvcp.lib.preferences, the object QtVCP hands the handler as MAIN.PREFS_.
+    Like the real one it writes the whole file on every putpref() and on a getpref() that
+    falls back to its default.
+'''
+
+import configparser
+
+class Access(configparser.RawConfigParser):
+    def __init__(self, path:str = None) -> None:
+        super().__init__()
+        self.fn = path
+        self.writes = 0
+        if path is not None:
+            self.read(path)
+
+    def getpref(self, option:str, default=False, type=bool, section:str = 'DEFAULT'):
+        getters = {bool: self.getboolean, float: self.getfloat, int: self.getint}
+        try:
+            return getters.get(type, self.get)(section, option)
+        except (configparser.Error, ValueError):
+            self.putpref(option, default, type, section)
+            return default
+
+    def putpref(self, option:str, value, type=bool, section:str = 'DEFAULT'):
+        if section != 'DEFAULT' and not self.has_section(section):
+            self.add_section(section)
+        self.set(section, option, str(type(value)))
+        self.save()
+
+    def save(self):
+        if self.fn is None:
+            return
+        with open(self.fn, 'w') as file:
+            self.write(file)
+        self.writes += 1
@@ -0,0 +1,64 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import sys
+from os import path
+
+import pytest
+
+# configs/myprintnc, so the sim package imports from any working directory
+sys.path.insert(0, path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+import sim
+
+sim.install_stubs()
+
+@pytest.fixture
+def machine(tmp_path):
+    return sim.install(sim.FakeMachine.from_config(str(tmp_path)))
+
+@pytest.fixture
+def handler_module(machine):
+    '''
+        rapidchange_handler reads the INI when it is imported, so it needs a machine first
+    '''
+    import rapidchange_handler
+    return rapidchange_handler
+
+@pytest.fixture
+def harness(machine):
+    harness = sim.HandlerHarness(machine)
+    harness.tick()
+    yield harness
+    harness.close()
+
+@pytest.fixture
+def big_tool_table(tmp_path):
+    '''
+        A 500 tool table in the LinuxCNC format, every tool in a pocket of its own
+    '''
+    filename = tmp_path / 'big_tool.tbl'
+    with open(filename, 'w') as file:
+        for t in range(1, 501):
+            file.write(f'T{t:<3} P{t:<3} Z{t * 0.1:+f} D+6.000000 ;tool {t}\n')
+    return str(filename)
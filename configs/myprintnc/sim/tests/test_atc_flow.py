@@ -0,0 +1,642 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    The ATC flow on the simulated machine, through the handler like the operator would
+'''
+
+import re
+import stat
+import time
+from os import path
+
+import pytest
+
+import sim
+
+PYTHON_REMAP = 'M6 modalgroup=6 python=rapid_tool_change'
+
+def test_pickup_and_drop_buttons(harness, machine):
+    harness.handler.toolModel.setChecked([4])
+    harness.w.btnPickupTool.click()
+    assert harness.wait()
+    assert machine.error is None
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (4, 4)
+    harness.tick()
+    assert harness.w.lblToolPocket.text() == '4'
+    assert machine.pins['rapid_atc.current_tool_pocket'] == 4
+    harness.w.btnDropTool.click()
+    assert harness.wait()
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (0, 0)
+    assert machine.rack_contents()[4] == 4
+
+def test_tool_change_measures_the_new_tool(harness, machine):
+    machine.tool_lengths[3] = 31.5
+    harness.change_tool(3)
+    assert machine.tool_in_spindle == 3
+    # G10 L1 rewrote the tool table, the reader picks it up on its next load
+    harness.handler.tooldb.load_tool_db()
+    assert harness.handler.tooldb.tools[3].z == pytest.approx(machine.toolsetter_z + 31.5)
+
+def test_missed_engagement_is_retried(harness, machine):
+    machine.engage_failures = 1
+    harness.change_tool(2)
+    assert machine.engage_misses == 1
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (2, 2)
+
+def test_change_aborts_when_every_retry_misses(harness, machine):
+    machine.engage_failures = 10
+    with pytest.raises(sim.NgcAbort):
+        harness.change_tool(2)
+    assert machine.tool_in_spindle == 0
+    assert machine.spindle_dir == 0
+
+def test_tool_outside_the_rack_is_rejected(harness, machine):
+    # T8 sits in pocket 8, the rack has 6 pockets
+    with pytest.raises(sim.NgcAbort, match='Pocket number invalid'):
+        harness.change_tool(8)
+
+def test_setting_edit_updates_pin_and_preferences(harness, machine):
+    harness.w.leNoPockets.edit('8')
+    assert machine.pins['rapid_atc.num_pockets'] == 8
+    harness.handler.prefs.flush(wait=True)
+    assert harness.prefs.getpref('num_pockets', 0, int, 'RAPID_ATC') == 8
+
+def test_preference_flush_keeps_sections_qtvcp_wrote_meanwhile(harness):
+    store = harness.handler.prefs
+    store.putpref('num_pockets', 7, int, 'RAPID_ATC')
+    with store.lock:
+        store.flush()
+        # QtVCP writes another section while the background write waits for the lock
+        harness.prefs.putpref('theme', 'dark', str, 'SCREEN')
+    store.writer.join(timeout=2.0)
+    from qtvcp.lib.preferences import Access
+    saved = Access(harness.prefs.fn)
+    assert saved.getpref('theme', '', str, 'SCREEN') == 'dark'
+    assert saved.getpref('num_pockets', 0, int, 'RAPID_ATC') == 7
+
+def test_broken_pin_is_logged_once_per_interval(harness, machine):
+    logs = harness.module.LOGS
+    logs.ring.clear()
+    dropped = logs.repeats.dropped
+    # the sim only has 16 motion.digital-in pins, every tick fails on motion.digital-in-42
+    harness.w.leIRDPinInput.edit('42')
+    harness.handler.view.setSlowInterval(0)
+    for _ in range(50):
+        harness.tick()
+    failures = [line for line in logs.ring.lines() if 'Periodic update failed' in line]
+    assert len(failures) == 1
+    assert logs.repeats.dropped - dropped == 49
+    assert 'Periodic update failed' in harness.w.teAtcLog.text()
+    logs.stopFile() # flushes the writer thread
+    with open(path.join(machine.config_dir, 'rapid_atc.log')) as file:
+        assert sum('Periodic update failed' in line for line in file) == 1
+
+def test_ir_pin_above_nine_is_read(harness, machine):
+    pins = harness.handler.halPins
+    rebinds = pins.rebinds
+    harness.w.leIRDPinInput.edit('12')
+    assert pins.names['ir'] == 'motion.digital-in-12'
+    machine.set('motion.digital-in-12', True)
+    harness.tick()
+    assert harness.w.ledIRTrigger.state is True
+    # the same setting again does not look the pin up again
+    harness.w.leIRDPinInput.edit('12')
+    assert pins.rebinds == rebinds + 1
+    stats = harness.handler.getHalPinStats()
+    assert stats['read_errors'] == 0
+    assert stats['read_count'] > 0
+
+def test_out_of_range_cover_pin_is_not_monitored(harness, machine):
+    harness.w.leCoverDPinInput.edit('64')
+    assert 'cover' not in harness.handler.halPins.names
+    harness.tick()
+    assert harness.handler.getHalPinStats()['read_errors'] == 0
+    harness.w.btnDustCoverToggle.click()
+    assert any('No dust cover output' in line for line in harness.module.LOGS.ring.lines())
+
+def test_python_remap_changes_and_measures(harness, machine):
+    machine.set_remap(PYTHON_REMAP)
+    machine.tool_lengths[3] = 31.5
+    harness.change_tool(2)
+    lines = machine.interpreter.lines_executed
+    harness.change_tool(3)
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (3, 3)
+    assert machine.rack_contents()[machine.tool_pocket(2)] == 2
+    assert machine.tools[3]['z'] == pytest.approx(machine.toolsetter_z + 31.5)
+    assert machine.pins['iocontrol.0.tool-prep-pocket'] == 0
+    # one block per step, no O-word control flow
+    assert machine.interpreter.lines_executed - lines < 100
+
+def test_python_remap_retries_then_aborts(harness, machine):
+    machine.set_remap(PYTHON_REMAP)
+    machine.engage_failures = 1
+    harness.change_tool(2)
+    assert machine.engage_misses == 1
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (2, 2)
+    machine.engage_failures = 10
+    with pytest.raises(sim.NgcError, match='M6 aborted: Timeout! Tool still in spindle'):
+        harness.change_tool(5)
+    assert machine.spindle_dir == 0
+
+def test_python_remap_keeps_the_tool_for_a_bad_pocket(harness, machine):
+    machine.set_remap(PYTHON_REMAP)
+    harness.change_tool(2)
+    with pytest.raises(sim.NgcError, match='Pocket number invalid'):
+        harness.change_tool(8)
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (2, 2)
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_preview_commits_the_change_without_moving(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    machine.interpreter.task = 0
+    rack = machine.rack_contents()
+    moves = machine.moves
+    harness.change_tool(3)
+    # the preview's G43 after the change uses T3
+    assert machine.tool_in_spindle == 3
+    assert machine.pins['iocontrol.0.tool-prep-number'] == 0
+    assert (machine.moves, machine.rack_contents(), machine.spindle_tool) == (moves, rack, 0)
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_prestaged_change_keeps_the_cover_open(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.change_tool(2)
+    moves = machine.moves
+    seconds = harness.change_tool(5)
+    moves, staged_moves = machine.moves - moves, machine.moves
+    harness.w.pbPrestage.click(True)
+    staged = harness.change_tool(2)
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (2, 2)
+    assert machine.rack_contents()[machine.tool_pocket(5)] == 5
+    assert machine.cover_strikes == 0
+    # no cover close, open and settle between the pockets and no second safe Z move
+    timings = harness.handler.getToolChangePlanner().timings
+    assert seconds - staged >= timings.cover_dwell * 2 + timings.cover_settle
+    assert machine.moves - staged_moves == moves - 1
+
+def probe_phases(harness) -> int:
+    return sum(1 for record in harness.handler.profiler.records for code, _, _ in record['p'] if code == 37)
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_cached_tool_length_skips_the_probe(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.w.pbProbeCache.click(True)
+    machine.tool_lengths[2] = 31.5
+    harness.change_tool(2)
+    measured = harness.change_tool(5)
+    cached = harness.change_tool(2)
+    cache = harness.handler.toolCache
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert probe_phases(harness) == 2
+    assert cached < measured
+    assert harness.w.lblProbeCacheStats.text() == 'HITS 1  MISSES 2'
+    # the offset in use is still the measured one
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + 31.5)
+    # the cache survives a restart
+    assert path.isfile(path.join(machine.config_dir, 'atc_tool_cache.json'))
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_cached_verdict_is_asked_for_before_it_is_trusted(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.w.pbProbeCache.click(True)
+    harness.change_tool(2)
+    machine.run('T2')
+    harness.tick()
+    assert machine.pins['rapid_atc.probe_cached'] == 1
+    # touched off right before measuring T2 again, the GUI has not run since
+    machine.run('G10 L2 P1 Z-50')
+    harness.missed_syncs = 1
+    machine.run('M6')
+    harness.tick()
+    assert probe_phases(harness) == 2
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_length(2) + 50.0)
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_cached_length_is_not_used_without_a_probe_check_answer(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.w.pbProbeCache.click(True)
+    harness.change_tool(2)
+    machine.run('T2')
+    harness.tick()
+    assert machine.pins['rapid_atc.probe_cached'] == 1
+    harness.missed_syncs = 1000 # the GUI is not running
+    machine.run('M6')
+    harness.missed_syncs = 0
+    harness.tick()
+    assert probe_phases(harness) == 2
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_length(2))
+
+def test_tool_loaded_by_hand_is_probed_again(harness, machine):
+    harness.w.pbProbeCache.click(True)
+    harness.change_tool(2)
+    harness.change_tool(5)
+    harness.w.btnDropTool.click()
+    assert harness.wait()
+    harness.tick()
+    machine.load_tool(2) # swapped by hand, followed by M61 Q2
+    harness.tick()
+    assert harness.handler.toolCache.entries[2].invalid == 'M61'
+    harness.change_tool(5)
+    harness.change_tool(2)
+    assert harness.handler.toolCache.hits == 1 # only T5
+    assert probe_phases(harness) == 3
+
+def test_cached_length_is_probed_again_after_a_touch_off(harness, machine):
+    harness.w.pbProbeCache.click(True)
+    machine.tool_lengths[2] = 31.5
+    harness.change_tool(2)
+    harness.change_tool(5)
+    machine.run('G10 L2 P1 Z-50')
+    harness.tick()
+    assert harness.handler.toolCache.check(2, 2, machine.tools[2]['z'], -50.0) == 'work Z offset changed'
+    harness.change_tool(2)
+    cache = harness.handler.toolCache
+    assert (cache.hits, cache.misses) == (0, 3)
+    # #5063 is a work coordinate, the new length is relative to the new offset
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + 31.5 + 50.0)
+    assert cache.entries[2].z_offset == -50.0
+
+def test_cached_length_expires_after_max_changes(harness, machine):
+    harness.w.pbProbeCache.click(True)
+    harness.w.leProbeCacheChanges.edit('2')
+    for tool in (2, 5, 2, 5, 2):
+        harness.change_tool(tool)
+    # T2 was cached one change after its measurement and measured again two changes later
+    assert (harness.handler.toolCache.hits, harness.handler.toolCache.misses) == (2, 3)
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_probe_approaches_the_previous_length(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.change_tool(2)
+    harness.change_tool(5)
+    full = harness.change_tool(2)
+    harness.change_tool(5)
+    harness.w.leProbeWindow.edit('5')
+    fast = harness.change_tool(2)
+    assert machine.setter_crashes == 0
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_length(2))
+    # 66 mm at searchvel replaced by a rapid and a 10 mm search
+    assert full - fast > 15.0
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+@pytest.mark.parametrize('work_z', [-50.0, 30.0])
+def test_probe_approach_adds_the_work_offset(harness, machine, remap, work_z):
+    if remap:
+        machine.set_remap(remap)
+    machine.run(f'G10 L2 P1 Z{work_z}')
+    harness.change_tool(2)
+    harness.change_tool(5)
+    full = harness.change_tool(2)
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_length(2) - work_z)
+    harness.change_tool(5)
+    harness.w.leProbeWindow.edit('5')
+    fast = harness.change_tool(2)
+    assert machine.setter_crashes == 0
+    assert not any('No contact within the probe window' in text for _, _, text in machine.messages)
+    assert full - fast > 15.0
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_probe_approach_needs_the_offset_the_length_was_measured_at(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.change_tool(2)
+    harness.change_tool(5)
+    # the length of T2 is relative to Z offset 0, lowering work Z puts its contact below the window
+    machine.run('G10 L2 P1 Z-20')
+    harness.w.leProbeWindow.edit('5')
+    harness.change_tool(2)
+    assert machine.setter_crashes == 0
+    assert not any('No contact within the probe window' in text for _, _, text in machine.messages)
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_length(2) + 20.0)
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_probe_window_miss_falls_back_to_the_full_search(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.w.leProbeWindow.edit('5')
+    harness.change_tool(2)
+    harness.change_tool(5)
+    machine.tool_lengths[2] = machine.tool_length(2) - 8.0 # a shorter holder, contact below the window
+    harness.change_tool(2)
+    assert machine.setter_crashes == 0
+    assert machine.tools[2]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_lengths[2])
+
+def rack_state(harness, machine) -> list:
+    '''
+        The handler's occupancy and what is really in the rack, pocket by pocket
+    '''
+    pockets = range(1, harness.handler.rack.num_pockets + 1)
+    return [harness.handler.rack.tool_at(p) for p in pockets], [machine.rack_contents().get(p, 0) for p in pockets]
+
+def test_rack_occupancy_follows_changes_and_survives_restart(harness, machine):
+    from atc_rack import RackOccupancy
+    for tool in (2, 5, 3):
+        harness.change_tool(tool)
+        held, real = rack_state(harness, machine)
+        assert held == real
+    machine.load_tool(4) # swapped by hand, followed by M61 Q4
+    harness.tick()
+    assert harness.handler.rack.tool_at(machine.tool_pocket(4)) == 0
+    assert 'SPINDLE T4' in harness.w.teRackView.text()
+    saved = RackOccupancy(path.join(machine.config_dir, 'atc_rack.bin'))
+    assert saved.load()
+    assert saved.pockets == harness.handler.rack.pockets
+
+def test_damaged_rack_state_is_seeded_from_the_tool_table(machine):
+    from atc_rack import RackOccupancy, UNKNOWN
+    statepath = path.join(machine.config_dir, 'atc_rack.bin')
+    rack = RackOccupancy(statepath, 4)
+    rack.seed({1: 1, 2: 2, 4: 4}, spindle_tool=2)
+    assert rack.pockets[1:] == [1, 0, 0, 4]
+    rack.save()
+    with open(statepath, 'r+b') as file:
+        file.truncate(path.getsize(statepath) - 1)
+    assert not RackOccupancy(statepath).load()
+    assert RackOccupancy(statepath, 2).pockets == [UNKNOWN] * 3
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_change_to_an_empty_pocket_stops_before_moving(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.change_tool(2)
+    harness.w.leRackPocket.edit(str(machine.tool_pocket(5)))
+    harness.w.btnRackMarkEmpty.click()
+    moves = machine.moves
+    with pytest.raises(sim.NgcError, match='is empty' if remap is None else 'pickup pocket is empty'):
+        harness.change_tool(5)
+    assert machine.moves == moves
+    assert machine.tool_in_spindle == 2
+    # the drop pocket is checked too
+    harness.w.btnRackMarkFull.click()
+    harness.w.leRackPocket.edit(str(machine.tool_pocket(2)))
+    harness.w.btnRackMarkFull.click()
+    with pytest.raises(sim.NgcError, match='already holds a tool'):
+        harness.change_tool(5)
+    assert machine.moves == moves
+    harness.w.btnRackFromTable.click()
+    harness.change_tool(5)
+    assert machine.tool_in_spindle == 5
+
+@pytest.mark.parametrize('remap', [None, PYTHON_REMAP])
+def test_change_without_a_rack_check_answer_stops_before_moving(harness, machine, remap):
+    if remap:
+        machine.set_remap(remap)
+    harness.change_tool(2)
+    moves = machine.moves
+    machine.sync_hooks.remove(harness.sync) # the GUI is not running
+    try:
+        with pytest.raises(sim.NgcError, match='No answer from the rack occupancy check'):
+            machine.run('T5 M6')
+    finally:
+        machine.sync_hooks.append(harness.sync)
+    assert machine.moves == moves
+    assert machine.tool_in_spindle == 2
+    # T and M6 on one line without a tick in between, the check is asked for and answered
+    machine.run('T5 M6')
+    assert machine.tool_in_spindle == 5
+
+def test_pickup_button_refuses_an_empty_pocket(harness, machine):
+    harness.w.leRackPocket.edit('4')
+    harness.w.btnRackMarkEmpty.click()
+    harness.handler.toolModel.setChecked([4])
+    moves = machine.moves
+    harness.w.btnPickupTool.click()
+    assert harness.wait()
+    assert (machine.tool_in_spindle, machine.moves) == (0, moves)
+
+def test_tool_table_reader_skips_bad_lines_and_keeps_every_column(handler_module, tmp_path):
+    tooltable = tmp_path / 'tool.tbl'
+    tooltable.write_text('T1   P1   X+0.500000 Z+12.500000 D+6.000000 I+10.0 J+170.0 Q2 ;flat; 6mm\n'
+                         '\n'
+                         'T2   P2\n'
+                         'T3   P3   Zoops ;bad\n'
+                         'P4   T4\n')
+    reader = handler_module.ToolTableReader(str(tooltable))
+    assert sorted(reader.tools) == [1, 2]
+    t1 = reader.tools[1]
+    assert (t1.x, t1.z, t1.diameter, t1.frontangle, t1.backangle, t1.orientation) == (0.5, 12.5, 6.0, 10.0, 170.0, 2)
+    assert t1.comment == 'flat; 6mm'
+    assert [lineno for lineno, _, _ in reader.errors] == [4, 5]
+    assert reader.get_tool_length(2) is None
+
+def test_tool_table_update_rewrites_only_the_changed_tool(handler_module, tmp_path):
+    tooltable = tmp_path / 'tool.tbl'
+    lines = ['T1 P1 Z+1.0 ;kept as written\n', 'T2   P2   D+0.062500 Z-3.841267 ;8mm ball\n']
+    tooltable.write_text(''.join(lines))
+    reader = handler_module.ToolTableReader(str(tooltable))
+    reader.update({2: {'P': 5, 'Z': -4.0}, 7: {'P': 7}})
+    assert tooltable.read_text().splitlines(True) == [lines[0], 'T2   P5   D+0.062500 Z-4.000000 ;8mm ball\n',
+                                                      'T7   P7\n']
+    assert (reader.get_tool_pocket(2), reader.get_tool_length(2), reader.get_pocket_tool(7)) == (5, -4.0, 7)
+    assert reader.load_tool_db() is False # the reader already matches the file
+
+def test_tool_table_update_keeps_permissions_and_symlink(handler_module, tmp_path):
+    from atc_tooltable import update_tool_table
+    real = tmp_path / 'tables' / 'tool.tbl'
+    real.parent.mkdir()
+    real.write_text('T1 P1 Z+1.000000 ;one\n')
+    real.chmod(0o664)
+    tooltable = tmp_path / 'tables' / 'link.tbl'
+    tooltable.symlink_to(real)
+    update_tool_table(str(tooltable), {1: {'Z': 2.0}})
+    assert tooltable.is_symlink()
+    assert stat.S_IMODE(real.stat().st_mode) == 0o664
+    assert 'Z+2.000000' in real.read_text()
+    assert sorted(p.name for p in real.parent.iterdir()) == ['link.tbl', 'tool.tbl'] # no temporary file left
+
+def wait_for(harness, condition, timeout:float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        harness.process_events()
+        time.sleep(0.01)
+    return True
+
+def test_tool_table_edits_are_pushed_without_polling(harness, machine):
+    from atc_tooltable import update_tool_table
+    machine.load_tool(5)
+    harness.tick()
+    watcher = harness.handler.toolTableWatcher
+    assert watcher.active
+    assert wait_for(harness, lambda: not watcher.timer.isActive())
+    reloads, reader_reloads = watcher.reloads, harness.handler.tooldb.reload_count
+    stats = []
+    harness.handler.tooldb.file_signature = lambda real=harness.handler.tooldb.file_signature: stats.append(1) or real()
+    harness.handler.view.setSlowInterval(0)
+    for _ in range(20):
+        harness.tick()
+    assert stats == []
+    # three quick edits, one reload
+    for pocket in (10, 11, 12):
+        update_tool_table(machine.tooltable, {5: {'P': pocket}})
+    assert wait_for(harness, lambda: watcher.reloads > reloads)
+    assert wait_for(harness, lambda: not watcher.timer.isActive())
+    assert (watcher.reloads, harness.handler.tooldb.reload_count) == (reloads + 1, reader_reloads + 1)
+    assert machine.pins['rapid_atc.current_tool_pocket'] == 12
+    # the watch on the replaced file is back
+    assert machine.tooltable in watcher.watcher.files()
+
+class ModelSignals():
+    def __init__(self, model) -> None:
+        self.events = []
+        model.rowsInserted.connect(lambda parent, first, last: self.events.append(('insert', first, last)))
+        model.rowsRemoved.connect(lambda parent, first, last: self.events.append(('remove', first, last)))
+        model.dataChanged.connect(lambda tl, br, roles=[]: self.events.append(('changed', tl.row(), br.row())))
+        model.modelReset.connect(lambda: self.events.append(('reset',)))
+
+def model_tools(model) -> list:
+    return [model.data(model.index(row, 0)) for row in range(model.rowCount())]
+
+def test_tool_library_filters_on_the_index(harness, machine):
+    model = harness.handler.toolModel
+    assert model_tools(model) == sorted(machine.tools)
+    harness.w.leToolFilter.setText('T3')
+    assert model_tools(model) == [3]
+    harness.w.leToolFilter.setText('P3')
+    assert model_tools(model) == [6]
+    harness.w.leToolFilter.setText('3')
+    assert model_tools(model) == [3, 6]
+    harness.w.leToolFilter.setText('END')
+    assert model_tools(model) == [1, 2]
+    harness.w.leToolFilter.setText('end ball')
+    assert model_tools(model) == [2]
+    harness.w.leToolFilter.setText('')
+    harness.w.pbRackOnly.click(True)
+    # T8 sits in pocket 8, the rack has 6 pockets
+    assert model_tools(model) == [1, 2, 3, 4, 5, 6]
+
+def test_tool_library_add_edit_delete_are_incremental(harness, machine):
+    from atc_tooltable import load_tools
+    model = harness.handler.toolModel
+    signals = ModelSignals(model)
+    harness.w.btnAdd.click()
+    assert signals.events == [('insert', 7, 7)]
+    assert model_tools(model)[-1] == 9
+    assert harness.handler.tooldb.get_tool_pocket(9) == 7 # the first free pocket after the rack
+    signals.events.clear()
+    row = model_tools(model).index(9)
+    assert model.setData(model.index(row, 1), '10')
+    # T9 can not take a negative pocket or the pocket of T1
+    assert not model.setData(model.index(row, 1), '-1')
+    assert not model.setData(model.index(row, 1), str(harness.handler.tooldb.get_tool_pocket(1)))
+    assert model.setData(model.index(row, 4), 'drill; 3mm')
+    assert signals.events == [('changed', row, row)] * 2
+    assert harness.handler.tooldb.tools[9].comment == 'drill; 3mm'
+    # P0 takes a tool off the rack, more than one tool can be there
+    assert model.setData(model.index(model_tools(model).index(8), 1), '0')
+    assert model.setData(model.index(row, 1), '0')
+    assert harness.handler.tooldb.get_tool_pocket(8) == harness.handler.tooldb.get_tool_pocket(9) == 0
+    signals.events.clear()
+    model.setChecked([9, 2])
+    signals.events.clear()
+    harness.w.btnDelete.click()
+    assert signals.events == [('remove', 7, 7), ('remove', 1, 1)]
+    assert model_tools(model) == [1, 3, 4, 5, 6, 8]
+    assert sorted(load_tools(machine.tooltable)) == [1, 3, 4, 5, 6, 8]
+
+def test_tool_library_fetches_rows_on_demand(handler_module, big_tool_table):
+    from atc_toolmodel import ToolLibraryModel
+    reader = handler_module.ToolTableReader(big_tool_table)
+    model = ToolLibraryModel(reader, batch=100)
+    assert (model.rowCount(), model.canFetchMore()) == (100, True)
+    model.fetchMore()
+    assert model.rowCount() == 200
+    signals = ModelSignals(model)
+    # a change past the fetched rows is not signalled, it arrives with fetchMore
+    reader.update({400: None, 1: {'Z': 1.0}})
+    model.refresh()
+    assert signals.events == [('changed', 0, 0)]
+    assert len(model.rows) == 499
+
+def test_batch_verify_finds_an_empty_pocket(harness, machine):
+    harness.change_tool(2)
+    empty = machine.tool_pocket(4)
+    del machine.rack_contents()[empty] # taken out by hand
+    harness.w.btnBatchVerify.click()
+    assert harness.wait(tick=True)
+    harness.tick()
+    assert (machine.tool_in_spindle, machine.spindle_tool) == (2, 2)
+    assert harness.handler.rack.tool_at(empty) == 0
+    held, real = rack_state(harness, machine)
+    assert held == real
+    assert harness.handler.batch is None
+    # the elapsed time is wall clock, the MDI thread waits for the periodic update at every sync
+    assert re.fullmatch(rf'VERIFY finished: 4/5 tool\(s\) in \d+s, failed T4 \(pocket {empty}\)',
+                        harness.w.lblBatchProgress.text())
+    assert machine.cover_strikes == 0
+
+def test_batch_measure_probes_every_rack_tool(harness, machine):
+    harness.w.pbProbeCache.click(True)
+    harness.change_tool(2)
+    probed = probe_phases(harness)
+    harness.w.btnBatchMeasure.click()
+    assert harness.wait(tick=True)
+    harness.tick()
+    # T8 is not in the rack, T2 is measured again in spite of its cached length and stays loaded
+    assert probe_phases(harness) - probed == 6
+    assert machine.tool_in_spindle == 2
+    for tool in (1, 2, 3, 4, 5, 6):
+        assert machine.tools[tool]['z'] == pytest.approx(machine.toolsetter_z + machine.tool_length(tool))
+    held, real = rack_state(harness, machine)
+    assert held == real
+
+def test_batch_cycle_changes_to_every_checked_tool(harness, machine):
+    harness.handler.toolModel.setChecked([5, 1, 3, 8])
+    harness.w.btnBatchCycle.click()
+    assert harness.wait(tick=True)
+    harness.tick()
+    # one sweep along the rack, T8 is not a rack tool
+    changes = [text.split()[4] for _, _, text in machine.messages if text.startswith('Picking up tool ID')]
+    assert [int(float(t)) for t in changes] == [1, 3, 5]
+    assert machine.tool_in_spindle == 5
+    assert 'CYCLE finished: 3/3' in harness.w.lblBatchProgress.text()
+
+def test_batch_verify_is_faster_than_the_buttons(harness, machine):
+    tools = [1, 2, 6, 4, 3, 5] # every rack tool, in pocket order
+    start = machine.clock
+    for tool in tools:
+        harness.handler.toolModel.setChecked([tool])
+        harness.w.btnPickupTool.click()
+        assert harness.wait()
+        harness.tick()
+        harness.w.btnDropTool.click()
+        assert harness.wait()
+        harness.tick()
+    buttons = machine.clock - start
+    start = machine.clock
+    harness.w.btnBatchVerify.click()
+    assert harness.wait(tick=True)
+    batch = machine.clock - start
+    assert machine.error is None
+    assert 'VERIFY finished: 6/6' in harness.w.lblBatchProgress.text()
+    # no cover close, open and settle and no safe Z retract between the pockets
+    timings = harness.handler.getToolChangePlanner().timings
+    assert buttons - batch >= (len(tools) - 1) * (timings.cover_dwell * 2 + timings.cover_settle)
@@ -0,0 +1,232 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Benchmarks of the handler on the simulated machine:
+
+        python3 -m pytest sim/tests/test_benchmarks.py --benchmark-columns=mean,max,rounds
+
+    The tool change benchmarks time the interpreter (wall clock) and report the simulated
+    cycle time of the change in extra_info.
+'''
+
+import itertools
+
+import pytest
+
+def test_periodic_tick_empty_spindle(benchmark, harness):
+    benchmark(harness.tick)
+    stats = harness.handler.getStatusStats()
+    assert stats['poll_errors'] == 0
+    # nothing changes between ticks, the view model skips the widget updates
+    assert harness.handler.getViewStats()['skipped'] > 0
+
+def test_periodic_tick_tool_loaded(benchmark, harness, machine):
+    machine.load_tool(2)
+    harness.tick()
+    benchmark(harness.tick)
+    assert harness.w.lblToolNo.text() == '2'
+    assert harness.w.lblToolPocket.text() == '2'
+
+def test_tool_pocket_lookup(benchmark, handler_module, big_tool_table):
+    reader = handler_module.ToolTableReader(big_tool_table)
+    tools = list(range(1, 501))
+    pockets = benchmark(lambda: [reader.get_tool_pocket(t) for t in tools])
+    assert pockets == tools
+
+def test_tool_table_reload_unchanged(benchmark, handler_module, big_tool_table):
+    reader = handler_module.ToolTableReader(big_tool_table)
+    assert benchmark(reader.load_tool_db) is False
+    assert reader.reload_count == 1
+
+def test_tool_table_reload_forced(benchmark, handler_module, big_tool_table):
+    reader = handler_module.ToolTableReader(big_tool_table)
+    assert benchmark(reader.load_tool_db, force=True) is True
+    assert reader.get_tool_pocket(500) == 500
+
+def test_tool_library_add_delete(benchmark, handler_module, big_tool_table):
+    from atc_toolmodel import ToolLibraryModel
+    reader = handler_module.ToolTableReader(big_tool_table)
+    model = ToolLibraryModel(reader)
+    resets = []
+    model.modelReset.connect(lambda: resets.append(1))
+
+    def add_delete():
+        reader.update({501: {'P': 501}})
+        model.refresh()
+        reader.update({501: None})
+        model.refresh()
+
+    benchmark(add_delete)
+    assert (len(model.rows), model.rowCount(), resets) == (500, 100, [])
+
+def test_tool_library_filter(benchmark, handler_module, big_tool_table):
+    from atc_toolmodel import ToolLibraryModel
+    model = ToolLibraryModel(handler_module.ToolTableReader(big_tool_table))
+    terms = itertools.cycle(['tool 4', 'P12', '250', ''])
+    benchmark(lambda: model.setFilter(text=next(terms)))
+
+class PinDict(dict):
+    '''
+        HAL component for the parameter startup benchmarks, the pins only hold their value
+    '''
+    def newpin(self, name, type, dir):
+        self[name] = 0
+
+def legacy_param_startup(params:list, prefs, comp, widgets, section:str):
+    # the call pattern of the hand-wired blocks: getpref, pin, widget, validator, connect per key
+    import hal
+    from atc_params import PIN_TYPES, PREF_TYPES
+    for p in params:
+        if p.pin is not None:
+            comp.newpin(p.pin, getattr(hal, PIN_TYPES[p.kind]), getattr(hal, p.pin_dir))
+    for p in params:
+        if p.pref is None:
+            continue
+        value = prefs.getpref(p.pref, p.default if p.default is not None else '0', PREF_TYPES[p.kind], section)
+        if p.pin is not None:
+            comp[p.pin] = p.pin_value(p.convert(value))
+        if isinstance(p.widget, str):
+            w = getattr(widgets, p.widget)
+            w.setText(str(value))
+            w.editingFinished.connect(lambda: None)
+
+def test_param_startup_legacy(benchmark, handler_module, tmp_path):
+    from atc_params import ConfigElement, build_params
+    from qtvcp.lib.preferences import Access
+    from sim.widgets import Widgets
+    params = build_params()
+    filename = str(tmp_path / 'qtdragon.pref')
+
+    def startup():
+        open(filename, 'w').close() # first start, every preference is missing
+        prefs = Access(filename)
+        legacy_param_startup(params, prefs, PinDict(), Widgets(prefs), ConfigElement.ATC_SECTION)
+        return prefs
+
+    prefs = benchmark(startup)
+    # QtVCP rewrites the file for every missing key
+    assert prefs.writes == sum(p.pref is not None for p in params)
+
+def test_param_startup_registry(benchmark, handler_module, tmp_path):
+    import hal
+    from types import SimpleNamespace
+    from atc_params import ConfigElement, ParamRegistry, build_params
+    from qtvcp.lib.preferences import Access
+    from sim.widgets import Widgets
+    params = build_params()
+    owner = SimpleNamespace(**{p.on_change: lambda value: None for p in params if p.on_change is not None})
+    section = ConfigElement.ATC_SECTION
+    filename = str(tmp_path / 'qtdragon.pref')
+
+    def startup():
+        open(filename, 'w').close()
+        access = Access(filename)
+        prefs = handler_module.PrefStore(access, sections=[section])
+        registry = ParamRegistry(params, section)
+        comp = PinDict()
+        registry.create_pins(comp, hal)
+        registry.load(prefs)
+        registry.apply(comp.__setitem__, owner)
+        registry.bind(Widgets(access), validator=lambda p: None)
+        prefs.flush(wait=True)
+        return prefs, comp
+
+    prefs, comp = benchmark(startup)
+    # the missing keys are written back together, once
+    assert prefs.get_stats()['flushes'] == 1
+    assert len(comp) == sum(p.pin is not None for p in params)
+
+def test_log_flood(benchmark, handler_module, tmp_path):
+    import logging
+    from atc_log import LogHub
+    base = logging.getLogger('rapid_atc_flood')
+    base.propagate = False
+    hub = LogHub(base, repeat_interval=10.0)
+    hub.setLevel(logging.INFO)
+    periodic = hub.getLogger('periodic')
+    filename = str(tmp_path / 'rapid_atc.log')
+    hub.startFile(filename)
+
+    def flood():
+        # a broken pin failing on every tick
+        for _ in range(10000):
+            periodic.error("'motion.digital-in-42' not found")
+
+    benchmark(flood)
+    hub.stopFile()
+    with open(filename) as file:
+        assert sum(1 for _ in file) == 1 # the repeats inside the interval are dropped
+    assert hub.repeats.dropped > 0
+
+def run_changes(benchmark, harness, machine, tools:list) -> list:
+    sequence = itertools.cycle(tools)
+    seconds = []
+    benchmark.pedantic(lambda: seconds.append(harness.change_tool(next(sequence))), rounds=len(tools) * 3,
+                       warmup_rounds=1)
+    assert machine.error is None
+    benchmark.extra_info['sim_seconds_mean'] = round(sum(seconds) / len(seconds), 2)
+    benchmark.extra_info['sim_seconds_max'] = round(max(seconds), 2)
+    benchmark.extra_info['lines_per_change'] = machine.interpreter.lines_executed // len(seconds)
+    benchmark.extra_info['syncs_per_change'] = round(machine.syncs / len(seconds), 1)
+    probe = harness.handler.profiler.summary()['phases'].get('probe.probe')
+    if probe is not None:
+        benchmark.extra_info['probe_seconds_p50'] = round(probe['p50'], 2)
+    return seconds
+
+def test_tool_change_cycle(benchmark, harness, machine):
+    seconds = run_changes(benchmark, harness, machine, [2, 5, 3, 4])
+    summary = harness.handler.profiler.summary()
+    assert summary['total']['n'] == len(seconds) # the warmup round included
+    # the rack part of a change, without probing, should be close to the planner's estimate
+    planner = harness.handler.getToolChangePlanner()
+    estimate = planner.change_time(5, 3)
+    rack = sum(st['p50'] for name, st in summary['phases'].items() if not name.startswith('probe.'))
+    benchmark.extra_info['planner_seconds'] = round(estimate, 2)
+    benchmark.extra_info['rack_seconds_p50'] = round(rack, 2)
+    assert rack == pytest.approx(estimate, rel=0.5)
+
+def test_tool_change_cycle_direct_traverse(benchmark, harness, machine):
+    harness.w.pbAllowDirectTraverse.click(True)
+    run_changes(benchmark, harness, machine, [2, 3])
+    assert any('direct traverse' in text for _, _, text in machine.messages)
+
+def test_tool_change_cycle_event_waits(benchmark, harness, machine):
+    harness.w.pbEventWaits.click(True)
+    harness.w.leCoverOpenDPin.edit('2')
+    run_changes(benchmark, harness, machine, [2, 5])
+
+def test_tool_change_cycle_python_remap(benchmark, harness, machine):
+    # same sequence as test_tool_change_cycle, through python/rapid_atc_remap.py
+    machine.set_remap('M6 modalgroup=6 python=rapid_tool_change')
+    run_changes(benchmark, harness, machine, [2, 5, 3, 4])
+
+def test_tool_change_cycle_prestaged(benchmark, harness, machine):
+    harness.w.pbPrestage.click(True)
+    run_changes(benchmark, harness, machine, [2, 5, 3, 4])
+    assert machine.cover_strikes == 0
+
+def test_tool_change_cycle_probe_window(benchmark, harness, machine):
+    harness.w.leProbeWindow.edit('5')
+    run_changes(benchmark, harness, machine, [2, 5, 3, 4])
+    assert machine.setter_crashes == 0
@@ -0,0 +1,80 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+'''
+    Loading the handler, checked with python -X importtime in a fresh interpreter so modules
+    imported by earlier tests don't hide what the handler pulls in
+'''
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import sim
+
+IMPORT_HANDLER = '''
+import sys
+sys.path.insert(0, {config_dir!r})
+import sim
+sim.install(sim.FakeMachine.from_config({workdir!r}))
+import rapidchange_handler, debugpy
+print(debugpy.listening)
+'''
+
+def import_handler(workdir:str, **env) -> tuple:
+    '''
+        Import the handler in a new interpreter, returns the cumulative import time in
+        microseconds of each module, in the order their imports finished, and the addresses
+        debugpy listened on
+    '''
+    script = IMPORT_HANDLER.format(config_dir=sim.CONFIG_DIR, workdir=workdir)
+    environ = {k: v for k, v in os.environ.items() if k != 'RAPID_ATC_DEBUGPY'}
+    environ.update(env)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], env=environ,
+                            capture_output=True, text=True, timeout=60, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if cumulative.strip().isdigit():
+            times.setdefault(name.strip(), int(cumulative))
+    return times, result.stdout.strip()
+
+def test_handler_import_skips_debugpy(tmp_path, record_property):
+    times, listening = import_handler(str(tmp_path))
+    # debugpy only shows up because the script imports it after the handler
+    assert listening == '[]'
+    assert list(times).index('debugpy') > list(times).index('rapidchange_handler')
+    record_property('handler_import_us', times['rapidchange_handler'])
+
+@pytest.mark.parametrize('setting, address', [('1', ('127.0.0.1', 5678)),
+                                              ('localhost:5700', ('localhost', 5700))])
+def test_debugpy_enabled_from_environment(tmp_path, setting, address):
+    times, listening = import_handler(str(tmp_path), RAPID_ATC_DEBUGPY=setting)
+    assert listening == repr([address])
+    assert list(times).index('debugpy') < list(times).index('rapidchange_handler')
@@ -0,0 +1,149 @@
+#MIT License
+
+# Copyright (c) 2023 Kenneth Thompson, https://github.com/KennethThompson
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+    Stand-in widgets for the handler, no Qt needed. Any widget name resolves to a Widget
+    that keeps its text/checked/enabled/visible state and has the clicked, editingFinished
+    and textChanged signals. click() and edit() drive them like a user would.
+'''
+
+import inspect
+from types import SimpleNamespace
+
+class Signal():
+    def __init__(self) -> None:
+        self.slots = []
+
+    def connect(self, slot):
+        # like PyQt, a slot that takes fewer arguments gets the leading ones
+        try:
+            params = inspect.signature(slot).parameters.values()
+            if any(p.kind == p.VAR_POSITIONAL for p in params):
+                count = None
+            else:
+                count = sum(1 for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+                            and p.default is p.empty)
+        except (TypeError, ValueError):
+            count = None
+        self.slots.append((slot, count))
+
+    def emit(self, *args):
+        for slot, count in list(self.slots):
+            slot(*(args if count is None else args[:count]))
+
+class Widget():
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.text_ = ''
+        self.checked = False
+        self.enabled = True
+        self.visible = True
+        self.state = False
+        self.validator = None
+        self.clicked = Signal()
+        self.editingFinished = Signal()
+        self.textChanged = Signal()
+
+    def __repr__(self) -> str:
+        return f'<Widget {self.name}>'
+
+    def setText(self, text:str):
+        if text != self.text_:
+            self.text_ = text
+            self.textChanged.emit(text)
+
+    def text(self) -> str:
+        return self.text_
+
+    setPlainText = setText
+    toPlainText = text
+
+    def setChecked(self, b:bool):
+        self.checked = bool(b)
+
+    def isChecked(self) -> bool:
+        return self.checked
+
+    def setEnabled(self, b:bool):
+        self.enabled = bool(b)
+
+    def isEnabled(self) -> bool:
+        return self.enabled
+
+    def setVisible(self, b:bool):
+        self.visible = bool(b)
+
+    def isVisible(self) -> bool:
+        return self.visible
+
+    def setState(self, b:bool):
+        self.state = bool(b)
+
+    def setValidator(self, validator):
+        self.validator = validator
+
+    def repaint(self):
+        pass
+
+    def moveCursor(self, operation):
+        pass
+
+    def click(self, checked:bool = None):
+        if checked is not None:
+            self.checked = checked
+        self.clicked.emit(self.checked)
+
+    def edit(self, text:str):
+        self.setText(text)
+        self.editingFinished.emit()
+
+class TableView(Widget):
+    def __init__(self, name:str) -> None:
+        super().__init__(name)
+        self.model_ = None
+        self.hidden = set()
+
+    def setModel(self, model):
+        self.model_ = model
+
+    def model(self):
+        return self.model_
+
+    def hideColumn(self, column:int):
+        self.hidden.add(column)
+
+class Widgets():
+    '''
+        The widgets object QtVCP passes to the handler, MAIN.PREFS_ is the preference object
+    '''
+    SPECIAL = {'tvToolLibrary': TableView}
+
+    def __init__(self, prefs) -> None:
+        self.MAIN = SimpleNamespace(PREFS_=prefs)
+
+    def __getattr__(self, name:str) -> Widget:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        widget = self.SPECIAL.get(name, Widget)(name)
+        setattr(self, name, widget)
+        return widget